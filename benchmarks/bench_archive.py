@@ -0,0 +1,86 @@
+"""
+Compares loading demonstrations from their directories with loading them from a packed archive
+(weblinx.utils.archive): listing the demonstrations, then reading the replay, and the HTML and
+bounding boxes of every turn. Reports the number of files opened (on a network filesystem,
+each one is a round trip) and the wall time, and checks that both give the same data.
+
+Usage (from the repository root):
+
+    python -m benchmarks.bench_archive --demos-dir wl_data/demonstrations --max-demos 50
+    python -m benchmarks.bench_archive --demos 50 --snapshots 20 --nodes 2000 --open-latency-ms 5
+"""
+import argparse
+import builtins
+import os
+import tempfile
+import time
+from unittest import mock
+
+import weblinx as wl
+from weblinx.utils.archive import pack_demonstrations
+from benchmarks.bench_file_cache import build_demo
+
+
+def load_all(base_dir, names):
+    demos = [wl.Demonstration(name, base_dir=base_dir) for name in names]
+    data = {}
+    for demo in demos:
+        for turn in wl.Replay.from_demonstration(demo):
+            data[(demo.name, turn.index)] = (turn.html, turn.bboxes)
+    return data
+
+
+def measure(base_dir, names, open_latency=0.0):
+    wl.utils.cache.file_cache.clear()
+    builtin_open = builtins.open
+    counts = {"opens": 0}
+
+    def counting_open(*args, **kwargs):
+        counts["opens"] += 1
+        # Simulates the round trip of an open on a network filesystem
+        time.sleep(open_latency)
+        return builtin_open(*args, **kwargs)
+
+    with mock.patch.object(builtins, "open", counting_open):
+        start = time.perf_counter()
+        data = load_all(base_dir, names)
+        counts["seconds"] = time.perf_counter() - start
+    return data, counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--demos-dir", help="Directory of demonstrations; synthetic ones are used if omitted")
+    parser.add_argument("--max-demos", type=int, default=50)
+    parser.add_argument("--demos", type=int, default=50)
+    parser.add_argument("--snapshots", type=int, default=20)
+    parser.add_argument("--nodes", type=int, default=2000)
+    parser.add_argument("--open-latency-ms", type=float, default=0.0, help="Latency added to each file opened")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if args.demos_dir:
+            demos_dir = args.demos_dir
+            names = [demo.name for demo in wl.list_demonstrations(demos_dir, valid_only=True)][: args.max_demos]
+        else:
+            demos_dir = os.path.join(tmp_dir, "demonstrations")
+            names = [f"demo-{i}" for i in range(args.demos)]
+            for name in names:
+                build_demo(os.path.join(demos_dir, name), args.snapshots, 2, args.nodes)
+
+        archive_path = os.path.join(tmp_dir, "demos.wlpack")
+        start = time.perf_counter()
+        pack_demonstrations([wl.Demonstration(name, base_dir=demos_dir) for name in names], archive_path)
+        pack_time = time.perf_counter() - start
+        print(f"packed {len(names)} demos in {pack_time:.2f}s ({os.path.getsize(archive_path) / 1e6:.1f}MB)")
+
+        open_latency = args.open_latency_ms / 1000
+        dir_data, dir_counts = measure(demos_dir, names, open_latency)
+        archive_data, archive_counts = measure(archive_path, names, open_latency)
+        for name, counts in [("directories", dir_counts), ("archive", archive_counts)]:
+            print(f"{name:<12} | files opened={counts['opens']:>6} | {counts['seconds']:.3f}s")
+        print(f"same_data={dir_data == archive_data}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Compares the loops over the bounding boxes dicts (the previous implementations of
+`filter_bboxes`, `get_element_uid_by_coords` and `IOUMetric.score`) with their versions based
+on weblinx.utils.bboxes.BBoxTable, on synthetic turns of many elements: each turn is filtered
+once and receives several predicted clicks, and the IoU of every prediction is computed.
+Reports the wall time of both and checks that they give the same results.
+
+Usage (from the repository root):
+
+    python -m benchmarks.bench_bboxes --turns 200 --snapshots 50 --elements 5000 --clicks 5
+"""
+import argparse
+import math
+import random
+import time
+from types import SimpleNamespace
+
+from weblinx.eval.metrics import IOUMetric
+from weblinx.processing.outputs import get_element_uid_by_coords
+from weblinx.utils.html import filter_bboxes
+
+
+def legacy_filter_bboxes(bboxes, min_height=10, min_width=10, viewport_height=None, viewport_width=None):
+    remaining_bboxes = {}
+    for wid, box in bboxes.items():
+        if box["width"] <= 0 or box["height"] <= 0:
+            continue
+        if box["width"] < min_width and box["height"] < min_height:
+            continue
+        if viewport_height is not None and box["y"] > viewport_height:
+            continue
+        if viewport_width is not None and box["x"] > viewport_width:
+            continue
+        remaining_bboxes[wid] = box
+    return remaining_bboxes
+
+
+def legacy_get_element_uid_by_coords(turn, x, y):
+    bboxes = turn.bboxes
+    if not bboxes:
+        return None
+    min_elem_size = None
+    elem_uid = None
+    for uid, bbox in bboxes.items():
+        left = math.floor(bbox["left"])
+        right = math.ceil(bbox["right"])
+        top = math.floor(bbox["top"])
+        bottom = math.ceil(bbox["bottom"])
+        if left <= x <= right and top <= y <= bottom:
+            elem_size = bbox["width"] * bbox["height"]
+            if elem_size == 0:
+                continue
+            if min_elem_size is None or elem_size < min_elem_size:
+                min_elem_size = bbox["width"] * bbox["height"]
+                elem_uid = uid
+    return elem_uid
+
+
+def build_bboxes(num_elements, rng):
+    bboxes = {}
+    for i in range(num_elements):
+        # Mixes integer and fractional coordinates, empty boxes and boxes of equal areas
+        x = rng.choice([rng.randint(0, 1600), rng.uniform(0, 1600)])
+        y = rng.choice([rng.randint(0, 4000), rng.uniform(0, 4000)])
+        width = rng.choice([0, 5, 20, 100, rng.uniform(0, 600)])
+        height = rng.choice([0, 5, 20, 40, rng.uniform(0, 300)])
+        bboxes[f"uid-{i}"] = {
+            "x": x, "y": y, "width": width, "height": height,
+            "left": x, "top": y, "right": x + width, "bottom": y + height,
+        }
+    return bboxes
+
+
+def run(turns, clicks, preds, refs, filter_fn, coords_fn, iou_fn):
+    start = time.perf_counter()
+    filtered = [filter_fn(turn.bboxes, viewport_height=turn.viewport_height, viewport_width=turn.viewport_width) for turn in turns]
+    uids = [coords_fn(turn, x, y) for turn, points in zip(turns, clicks) for x, y in points]
+    ious = iou_fn(preds, refs)
+    return (filtered, uids, ious), time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--turns", type=int, default=200)
+    parser.add_argument("--snapshots", type=int, default=50, help="Number of distinct bboxes files")
+    parser.add_argument("--elements", type=int, default=5000)
+    parser.add_argument("--clicks", type=int, default=5, help="Predicted clicks per turn")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    snapshots = [build_bboxes(args.elements, rng) for _ in range(args.snapshots)]
+    # Turns of the same snapshot share the same bboxes dict, as with Turn.bboxes
+    turns = [
+        SimpleNamespace(bboxes=snapshots[i * args.snapshots // args.turns], viewport_height=900, viewport_width=1400)
+        for i in range(args.turns)
+    ]
+    clicks = [[(rng.randint(0, 1600), rng.uniform(0, 4000)) for _ in range(args.clicks)] for _ in turns]
+
+    element = lambda bboxes: {"bbox": rng.choice(list(bboxes.values()))}
+    preds = [{"element": element(turn.bboxes)} for turn in turns for _ in range(args.clicks)]
+    refs = [{"element": element(turn.bboxes)} for turn in turns for _ in range(args.clicks)]
+    # Keeps the pairs whose union is not empty, for which IOUMetric.score raises
+    pairs = [(p, r) for p, r in zip(preds, refs) if p["element"]["bbox"]["width"] * p["element"]["bbox"]["height"] or r["element"]["bbox"]["width"] * r["element"]["bbox"]["height"]]
+    preds, refs = [p for p, _ in pairs], [r for _, r in pairs]
+
+    metric = IOUMetric()
+    legacy, legacy_time = run(
+        turns, clicks, preds, refs, legacy_filter_bboxes, legacy_get_element_uid_by_coords,
+        lambda preds, refs: [metric.score(p, r) for p, r in zip(preds, refs)],
+    )
+    table, table_time = run(turns, clicks, preds, refs, filter_bboxes, get_element_uid_by_coords, metric.score_batch)
+
+    print(f"{args.turns} turns, {args.snapshots} bboxes files of {args.elements} elements, {len(preds)} predictions")
+    print(f"loops      | {legacy_time:.3f}s")
+    print(f"bbox table | {table_time:.3f}s | speedup={legacy_time / table_time:.1f}x")
+    print(
+        f"same_filtered={legacy[0] == table[0]} same_uids={legacy[1] == table[1]} same_ious={legacy[2] == table[2]}"
+    )
+
+
+if __name__ == "__main__":
+    main()
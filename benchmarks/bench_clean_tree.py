@@ -0,0 +1,174 @@
+"""
+Compares the previous cleaning of weblinx.processing.dom (`remove_uid_when_not_candidate`,
+`remove_html_comments` and `sanitize_elem_attributes`, each a traversal of the tree, the last
+one removing attributes while iterating over them) with the single traversal of
+`CleaningRules.clean`, on synthetic WebLINX-shaped pages (see bench_prune_tree) with the
+attributes of the sanitize rules, event handlers, styles and inline SVG. Checks that both give
+the same trees, on whole pages and after `clean_and_prune_tree`, and that extra rules give the
+same trees as removing their attributes in a separate traversal. Reports the time per call.
+
+Usage (from the repository root):
+
+    python -m benchmarks.bench_clean_tree --sizes 1000 10000 --repeat 10
+"""
+import argparse
+import random
+import time
+from copy import deepcopy
+
+import lxml.html
+
+from weblinx.processing.dom import (
+    AttributeRule,
+    CleaningRules,
+    clean_and_prune_tree,
+    clean_tree,
+    prune_tree,
+)
+from benchmarks.bench_prune_tree import build_webtasks_page
+
+EXTRA_ATTRS = [
+    'id="main"', 'data-testid="x"', '_ngcontent-c1=""', 'ng-click="go()"', 'x-data="{}"',
+    'xml:lang="en"', 'jsaction="click:a"', 'onclick="go()"', 'onmouseover="hover()"',
+    'style="color: red"', 'role="button"', 'ID="upper"',
+]
+
+
+def add_attributes(html, seed):
+    rng = random.Random(seed)
+    parts = html.split("<div ")
+    html = parts[0] + "".join(f"<div {' '.join(rng.sample(EXTRA_ATTRS, 3))} " + part for part in parts[1:])
+    return html.replace("<use ", '<path d="M0 0L10 10" fill="red"></path><use ')
+
+
+def legacy_sanitize_elem_attributes(tree, uid_key="data-webtasks-id"):
+    for node in tree.iter():
+        if node.attrib is None:
+            continue
+        for k, v in node.attrib.items():
+            if k.startswith("_"):
+                node.attrib.pop(k)
+            if k.startswith("ng"):
+                node.attrib.pop(k)
+            if k.startswith("x-"):
+                node.attrib.pop(k)
+            if k.startswith("xml"):
+                node.attrib.pop(k)
+            if k.startswith("js"):
+                node.attrib.pop(k)
+            if k == uid_key:
+                continue
+            if k.startswith("data-"):
+                node.attrib.pop(k)
+            if k == "id":
+                node.attrib.pop(k)
+
+
+def legacy_clean(dom_tree, candidate_uids=None, uid_key="data-webtasks-id"):
+    if candidate_uids is not None:
+        candidate_uids = set(candidate_uids)
+        for node in dom_tree.iter():
+            if node.attrib is None:
+                continue
+            if uid_key in node.attrib and node.attrib[uid_key] not in candidate_uids:
+                node.attrib.pop(uid_key)
+    for node in dom_tree.iter():
+        if isinstance(node, lxml.html.HtmlComment):
+            node.drop_tree()
+    legacy_sanitize_elem_attributes(dom_tree)
+    return dom_tree
+
+
+def legacy_clean_and_prune_tree(dom_tree, cands_turn, max_depth=1, max_children=5, max_sibling=2):
+    candidate_uids = [cand["uid"] for cand in cands_turn]
+    dom_tree = prune_tree(dom_tree, set(candidate_uids), max_depth=max_depth, max_children=max_children, max_sibling=max_sibling)
+    return legacy_clean(dom_tree, candidate_uids)
+
+
+def remove_separately(dom_tree, rules):
+    # Reference for the extra rules: one more traversal per rule
+    for rule in rules:
+        for node in dom_tree.iter():
+            if isinstance(node.tag, str) and (rule.tags is None or node.tag in rule.tags):
+                for key in [k for k in node.attrib.keys() if rule.matches(k) and k != "data-webtasks-id"]:
+                    del node.attrib[key]
+    return dom_tree
+
+
+EXTRA_RULES = [
+    AttributeRule(names=("style",)),
+    AttributeRule(prefixes=("on",)),
+    AttributeRule(names=("d",), tags=("path",)),
+]
+
+
+def check_equivalence(num_pages):
+    rng = random.Random(1)
+    cases = mismatches = 0
+    extra = CleaningRules().with_rules(*EXTRA_RULES)
+    for seed in range(num_pages):
+        root = lxml.html.fromstring(add_attributes(build_webtasks_page(rng.choice([100, 500, 2000]), seed=seed), seed))
+        uids = [n.get("data-webtasks-id") for n in root.iter() if isinstance(n.tag, str) and n.get("data-webtasks-id")]
+        cands = [{"uid": uid} for uid in rng.sample(uids, min(20, len(uids)))]
+
+        pairs = [
+            (legacy_clean(deepcopy(root)), clean_tree(deepcopy(root))),
+            (legacy_clean(deepcopy(root), uids[::3]), clean_tree(deepcopy(root), candidate_uids=uids[::3])),
+            (legacy_clean_and_prune_tree(root, cands), clean_and_prune_tree(root, cands)),
+            (
+                remove_separately(legacy_clean_and_prune_tree(root, cands), EXTRA_RULES),
+                clean_and_prune_tree(root, cands, rules=extra),
+            ),
+            (remove_separately(legacy_clean(deepcopy(root)), EXTRA_RULES), clean_tree(deepcopy(root), rules=extra)),
+        ]
+        for expected, result in pairs:
+            cases += 1
+            mismatches += lxml.html.tostring(expected) != lxml.html.tostring(result)
+    return cases, mismatches
+
+
+def time_calls(fn, make_tree, repeat):
+    timings = []
+    for _ in range(repeat):
+        tree = make_tree()
+        start = time.perf_counter()
+        fn(tree)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--check-pages", type=int, default=20)
+    args = parser.parse_args()
+
+    cases, mismatches = check_equivalence(args.check_pages)
+    print(f"equivalence: {cases} cases, {mismatches} mismatches")
+
+    rng = random.Random(0)
+    extra = CleaningRules().with_rules(*EXTRA_RULES)
+    for size in args.sizes:
+        root = lxml.html.fromstring(add_attributes(build_webtasks_page(size), 0))
+        uids = [n.get("data-webtasks-id") for n in root.iter() if isinstance(n.tag, str) and n.get("data-webtasks-id")]
+        cands = [{"uid": uid} for uid in rng.sample(uids, 20)]
+        copy = lambda: deepcopy(root)
+        rows = [
+            ("clean page", legacy_clean, clean_tree, copy),
+            ("clean page + extra rules",
+             lambda t: remove_separately(legacy_clean(t), EXTRA_RULES), lambda t: clean_tree(t, rules=extra), copy),
+            ("clean_and_prune_tree",
+             lambda t: legacy_clean_and_prune_tree(t, cands), lambda t: clean_and_prune_tree(t, cands), lambda: root),
+        ]
+        for name, legacy_fn, fused_fn, make_tree in rows:
+            legacy = time_calls(legacy_fn, make_tree, args.repeat)
+            fused = time_calls(fused_fn, make_tree, args.repeat)
+            print(
+                f"{size:>6} nodes | {name:<24} | before={legacy * 1000:8.2f}ms | after={fused * 1000:7.2f}ms"
+                f" | speedup={legacy / fused:5.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
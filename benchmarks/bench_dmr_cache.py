@@ -0,0 +1,73 @@
+"""
+Compares the cached in-process DMR scorer (modeling.dmr.eval.CachedDocScorer) with encoding
+every doc on every turn (as in run_model_and_update_groups), on a sequence of snapshots of
+the same page where only a fraction of the element docs change between turns.
+
+Usage (from the repository root, requires sentence-transformers):
+
+    python -m benchmarks.bench_dmr_cache --docs 500 --turns 10 --changed 0.05
+"""
+import argparse
+import random
+import time
+
+from sentence_transformers import SentenceTransformer
+from sentence_transformers.util import cos_sim
+
+from modeling.dmr.eval import CachedDocScorer
+
+TAGS = ["button", "a", "input", "div", "span", "img", "label"]
+WORDS = "search submit login cart menu next previous home profile settings help close open".split()
+
+
+def make_doc(rng, i):
+    tag = rng.choice(TAGS)
+    text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 6)))
+    return f"[[tag]] {tag} [[xpath]] /html/body/div[{i}]/{tag} [[text]] {text} [[bbox]] x={i} y={i * 2} width=80 height=20 [[attributes]] class='item-{i % 17}' [[children]] "
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--model", default="McGill-NLP/MiniLM-L6-dmr")
+    parser.add_argument("--docs", type=int, default=500)
+    parser.add_argument("--turns", type=int, default=10)
+    parser.add_argument("--changed", type=float, default=0.05, help="Fraction of docs changed between turns")
+    parser.add_argument("--device", default="cpu")
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    model = SentenceTransformer(args.model, device=args.device)
+    scorer = CachedDocScorer(model)
+
+    docs = [make_doc(rng, i) for i in range(args.docs)]
+    uncached_total, cached_total = 0.0, 0.0
+    max_diff = 0.0
+
+    for turn in range(args.turns):
+        query = f"Please {rng.choice(WORDS)} the {rng.choice(WORDS)} ; turn {turn}"
+        for i in rng.sample(range(args.docs), int(args.docs * args.changed)):
+            docs[i] = make_doc(rng, i)
+
+        start = time.perf_counter()
+        encoded = model.encode([query] + docs, batch_size=64, show_progress_bar=False)
+        scores_uncached = cos_sim(encoded[0], encoded[1:]).cpu().squeeze().tolist()
+        uncached_total += time.perf_counter() - start
+
+        start = time.perf_counter()
+        scores_cached = scorer.score(query, docs)
+        cached_total += time.perf_counter() - start
+
+        max_diff = max(max_diff, max(abs(a - b) for a, b in zip(scores_uncached, scores_cached)))
+
+    stats = scorer.stats()
+    print(
+        f"docs={args.docs} turns={args.turns} changed={args.changed:.0%} | "
+        f"uncached: {uncached_total / args.turns * 1000:.1f}ms/turn | "
+        f"cached: {cached_total / args.turns * 1000:.1f}ms/turn | "
+        f"speedup={uncached_total / cached_total:.1f}x | "
+        f"hit_rate={stats['hit_rate']:.2%} | max_score_diff={max_diff:.2e}"
+    )
+
+
+if __name__ == "__main__":
+    main()
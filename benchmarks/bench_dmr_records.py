@@ -0,0 +1,186 @@
+"""
+Compares how the DMR records of a turn represent its elements: previously, the page was parsed
+into a tree, queried with `//*[@data-webtasks-id]`, and each element in the filtered bounding
+boxes was represented with `represent_element_as_dict` (an xpath computed by getpath); now,
+`extract_elements_as_dicts` represents them from the events sent by lxml's HTML parser to a
+parser target, without building a tree. Checks that both give the same dicts and uids on
+synthetic WebLINX-shaped pages (see bench_prune_tree), variants of them (comments, boolean
+attributes, entities, scripts, encoding declarations, fragments), pages whose script, style
+or textarea end tag straddles the read sizes of the parser, and the pages of --demos-dir,
+then reports the time per page and the peak memory of each, measured in a new process.
+
+Usage (from the repository root):
+
+    python -m benchmarks.bench_dmr_records --sizes 1000 10000 --repeat 5
+    python -m benchmarks.bench_dmr_records --demos-dir wl_data/demonstrations --max-demos 20
+"""
+import argparse
+import random
+import subprocess
+import sys
+import time
+
+import lxml.html
+
+import weblinx as wl
+import weblinx.utils.html as wh
+from modeling.dmr.processing import extract_elements_as_dicts, represent_element_as_dict
+from benchmarks.bench_prune_tree import build_webtasks_page
+
+UID_KEY = "data-webtasks-id"
+
+VARIANTS = {
+    "plain": lambda html: html,
+    "comments": lambda html: html.replace("<span", "<!-- c --><span").replace("</p>", "<!-- d --></p>"),
+    "boolean-attrs": lambda html: html.replace("<input ", '<input disabled checked="" hidden ').replace("<button ", "<button disabled "),
+    "serialized-boolean-attrs": lambda html: html.replace("<input ", '<input disabled="" checked="checked" READONLY ').replace("<p ", '<p nowrap="" '),
+    "entities": lambda html: html.replace("price", "&lt;b&gt; &ndash; caf\xe9 &#x1F600;"),
+    "script": lambda html: html.replace("</body>", '<script>if (a < b) x = "<p>";</script><p data-webtasks-id="s">x</p></body>'),
+    "meta-charset": lambda html: html.replace("<head>", '<head><meta charset="iso-8859-1">').replace("price", "caf\xe9"),
+    "fragment": lambda html: html[html.index("<body") :].replace("<body", "<div", 1).replace("</body></html>", "</div><p>x</p>"),
+    "whitespace": lambda html: html.replace("><", ">\n  <"),
+    "unclosed": lambda html: html.replace("</p>", "").replace("</li>", ""),
+}
+
+
+def build_split_end_tag_pages(rng):
+    """
+    Pages whose `</script>`, `</style>` or `</textarea>` starts just before a multiple of the
+    read sizes of libxml2's parser, where the end tag was missed when the page was fed to the
+    push parser in chunks, and every element after it dropped.
+    """
+    pages = []
+    for tag in ["script", "style", "textarea"]:
+        for boundary in [4096, 8192, 65536]:
+            for before in range(1, 9):
+                start = f'<!DOCTYPE html><html><body><p {UID_KEY}="a">a</p><{tag} {UID_KEY}="s">'
+                padding = "x" * (boundary - before - len(start))
+                html = (
+                    f"{start}{padding}</{tag}><p {UID_KEY}=\"b\">b</p><div {UID_KEY}=\"c\">c</div></body></html>"
+                )
+                pages.append((f"split-{tag}-{boundary}-{before}", html, build_bboxes(html, rng)))
+    return pages
+
+
+def build_bboxes(html, rng):
+    uids = [n.get(UID_KEY) for n in lxml.html.fromstring(html).iter() if isinstance(n.tag, str) and n.get(UID_KEY)]
+    bboxes = {}
+    for uid in uids:
+        x, y = rng.uniform(0, 1600), rng.uniform(0, 3000)
+        width, height = rng.choice([0, 5, 50, 200]), rng.choice([0, 5, 30, 100])
+        bboxes[uid] = {"x": x, "y": y, "width": width, "height": height}
+    return bboxes
+
+
+def legacy_extract(html, bboxes, uids, uid_key=UID_KEY):
+    # Parses without the tree cache of weblinx.processing.dom
+    root = lxml.html.fromstring(html)
+    root_tree = root.getroottree()
+    elements = root.xpath(f"//*[@{uid_key}]")
+    elements_filt = [p for p in elements if p.attrib[uid_key] in uids]
+    results = [(p.attrib[uid_key], represent_element_as_dict(p, bboxes[p.attrib[uid_key]], root_tree)) for p in elements_filt]
+    return results, {p.attrib[uid_key] for p in elements}
+
+
+def filtered_uids(bboxes):
+    return wh.filter_bboxes(bboxes, viewport_height=900, viewport_width=1400)
+
+
+def build_corpus(num_pages, demos_dir=None, max_demos=None):
+    rng = random.Random(0)
+    corpus = []
+    for seed in range(num_pages):
+        html = build_webtasks_page(rng.choice([100, 500, 2000]), seed=seed)
+        for name, variant in VARIANTS.items():
+            page = variant(html)
+            corpus.append((f"synthetic-{seed}-{name}", page, build_bboxes(page, rng)))
+    corpus.extend(build_split_end_tag_pages(rng))
+
+    if demos_dir is not None:
+        for demo in wl.list_demonstrations(demos_dir, valid_only=True)[:max_demos]:
+            for turn in wl.Replay.from_demonstration(demo).filter_if_html_page():
+                if turn.has_bboxes():
+                    corpus.append((f"{demo.name}-{turn.index}", turn.html, turn.bboxes))
+    return corpus
+
+
+def check_equivalence(corpus):
+    mismatches = []
+    for name, html, bboxes in corpus:
+        uids = filtered_uids(bboxes)
+        if extract_elements_as_dicts(html, bboxes, uids=uids) != legacy_extract(html, bboxes, uids):
+            mismatches.append(name)
+    return mismatches
+
+
+def measure_memory(mode, size):
+    # Run in a new process, whose peak resident memory is then only that of one mode
+    html = build_webtasks_page(size)
+    bboxes = build_bboxes(html, random.Random(0))
+    uids = filtered_uids(bboxes)
+    before = read_peak_rss()
+    fn = legacy_extract if mode == "legacy" else extract_elements_as_dicts
+    fn(html, bboxes, uids)
+    print(read_peak_rss() - before)
+
+
+def read_peak_rss():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) // 1024
+    return 0
+
+
+def peak_memory(mode, size):
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.bench_dmr_records", "--memory-mode", mode, "--sizes", str(size)],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return int(output.strip().splitlines()[-1])
+
+
+def time_calls(fn, html, bboxes, uids, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(html, bboxes, uids)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--check-pages", type=int, default=10)
+    parser.add_argument("--demos-dir", help="Directory of demonstrations whose turns are added to the corpus")
+    parser.add_argument("--max-demos", type=int, default=20)
+    parser.add_argument("--memory-mode", choices=["legacy", "streaming"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.memory_mode:
+        measure_memory(args.memory_mode, args.sizes[0])
+        return
+
+    corpus = build_corpus(args.check_pages, args.demos_dir, args.max_demos)
+    mismatches = check_equivalence(corpus)
+    print(f"equivalence: {len(corpus)} pages, {len(mismatches)} mismatches {mismatches[:5]}")
+
+    for size in args.sizes:
+        html = build_webtasks_page(size)
+        bboxes = build_bboxes(html, random.Random(0))
+        uids = filtered_uids(bboxes)
+        legacy = time_calls(legacy_extract, html, bboxes, uids, args.repeat)
+        streaming = time_calls(extract_elements_as_dicts, html, bboxes, uids, args.repeat)
+        print(
+            f"{size:>6} nodes ({len(uids)} kept) | tree: {legacy * 1000:8.2f}ms, {peak_memory('legacy', size):4d}MB"
+            f" | streaming: {streaming * 1000:8.2f}ms, {peak_memory('streaming', size):4d}MB"
+            f" | speedup={legacy / streaming:5.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
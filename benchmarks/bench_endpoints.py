@@ -0,0 +1,85 @@
+"""
+Measures the endpoint client against the local stub server: bare requests.post vs the pooled
+EndpointClient, sequential vs concurrent DMR + action calls, and retries under failures.
+
+Usage (from the repository root):
+
+    python -m benchmarks.bench_endpoints --requests 50 --latency 0.05 --failure-rate 0.2
+"""
+import argparse
+import time
+from concurrent.futures import wait
+
+import requests
+
+from http_helper import EndpointClient, EndpointError
+from stub_server import start_stub_server
+
+DMR_PAYLOAD = {
+    "inputs": {
+        "sentences": [f"button submit form number {i}" for i in range(50)],
+        "source_sentence": "submit the form",
+        "parameters": {},
+    }
+}
+ACTION_PAYLOAD = {"inputs": "prompt", "parameters": {"max_new_tokens": 256}}
+
+
+def timed(fn, n):
+    start = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - start) / n
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--failure-rate", type=float, default=0.2)
+    args = parser.parse_args()
+
+    server = start_stub_server(latency=args.latency)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    dmr = EndpointClient(base_url + "/dmr")
+    action = EndpointClient(base_url + "/action")
+
+    try:
+        bare = timed(lambda: requests.post(base_url + "/dmr", json=DMR_PAYLOAD).json(), args.requests)
+        pooled = timed(lambda: dmr.post(DMR_PAYLOAD), args.requests)
+        print(f"per request: bare requests.post={bare * 1000:.1f}ms | pooled client={pooled * 1000:.1f}ms")
+
+        sequential = timed(lambda: (dmr.post(DMR_PAYLOAD), action.post(ACTION_PAYLOAD)), args.requests)
+        concurrent = timed(lambda: wait([dmr.submit(DMR_PAYLOAD), action.submit(ACTION_PAYLOAD)]), args.requests)
+        print(f"dmr + action: sequential={sequential * 1000:.1f}ms | concurrent={concurrent * 1000:.1f}ms")
+
+        server.config["failure_rate"] = args.failure_rate
+        flaky = EndpointClient(base_url + "/dmr", max_retries=3, backoff=0.01)
+        failures = 0
+        start = time.perf_counter()
+        for _ in range(args.requests):
+            try:
+                flaky.post(DMR_PAYLOAD)
+            except EndpointError:
+                failures += 1
+        elapsed = (time.perf_counter() - start) / args.requests
+        print(
+            f"failure_rate={args.failure_rate}: {failures}/{args.requests} requests failed after retries "
+            f"(expected ~{args.requests * args.failure_rate ** 4:.2f}), {elapsed * 1000:.1f}ms per request"
+        )
+
+        server.config["failure_rate"] = 0.0
+        server.config["latency"] = 2.0
+        slow = EndpointClient(base_url + "/dmr", timeout=0.2, max_retries=1, backoff=0.01)
+        start = time.perf_counter()
+        try:
+            slow.post(DMR_PAYLOAD)
+        except EndpointError:
+            pass
+        print(f"hung endpoint: gave up after {time.perf_counter() - start:.2f}s (timeout=0.2s, max_retries=1)")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Measures the process-wide file cache behind Turn.html and Turn.bboxes (weblinx.utils.cache) on
+a pass over a demonstration where several turns refer to the same snapshot, as chat turns that
+get the page of the previous turn. The demonstration is read through two separate replays, as
+when selecting the turns and then building their prompts. Reports the number of files read,
+the cache statistics and the wall time, with the cache disabled and enabled.
+
+Usage (from the repository root):
+
+    python -m benchmarks.bench_file_cache --snapshots 100 --turns-per-snapshot 3 --nodes 5000
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from unittest import mock
+
+import weblinx as wl
+from benchmarks.bench_snapshot import build_synthetic_page
+
+
+def build_demo(demo_dir, num_snapshots, turns_per_snapshot, num_nodes):
+    os.makedirs(os.path.join(demo_dir, "pages"))
+    os.makedirs(os.path.join(demo_dir, "bboxes"))
+    page = build_synthetic_page(num_nodes)
+    bboxes = {
+        f"uid-{i}": {"x": 0, "y": i, "top": i, "left": 0, "bottom": i + 20, "right": 100, "width": 100, "height": 20}
+        for i in range(num_nodes)
+    }
+
+    data = []
+    for i in range(num_snapshots):
+        with open(os.path.join(demo_dir, "pages", f"page-{i}-0.html"), "w") as f:
+            f.write(page.replace("synthetic", f"synthetic {i}"))
+        with open(os.path.join(demo_dir, "bboxes", f"bboxes-{i}.json"), "w") as f:
+            json.dump(bboxes, f)
+        for j in range(turns_per_snapshot):
+            data.append({
+                "type": "browser",
+                "timestamp": len(data),
+                "action": {"intent": "scroll" if j else "click"},
+                "state": {"page": f"page-{i}-0.html"},
+            })
+
+    with open(os.path.join(demo_dir, "replay.json"), "w") as f:
+        json.dump({"data": data}, f)
+
+
+def run_pass(demo):
+    # Turns selected with one replay, then their prompts built with another
+    for _ in range(2):
+        replay = wl.Replay.from_demonstration(demo)
+        for turn in replay.filter_if_html_page():
+            turn.html, turn.bboxes
+
+
+def measure(demo):
+    open_html = wl.utils.html.open_html_with_encodings
+    read_json = wl.utils.auto_read_json
+    counts = {"file_reads": 0}
+
+    def counting(fn):
+        def wrapper(*args, **kwargs):
+            counts["file_reads"] += 1
+            return fn(*args, **kwargs)
+
+        return wrapper
+
+    wl.utils.cache.file_cache.clear()
+    with mock.patch.object(wl.utils.html, "open_html_with_encodings", counting(open_html)), mock.patch.object(
+        wl.utils, "auto_read_json", counting(read_json)
+    ):
+        start = time.perf_counter()
+        run_pass(demo)
+        counts["seconds"] = time.perf_counter() - start
+    counts.update(wl.utils.cache.file_cache.stats())
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--snapshots", type=int, default=100)
+    parser.add_argument("--turns-per-snapshot", type=int, default=3)
+    parser.add_argument("--nodes", type=int, default=5000)
+    parser.add_argument("--max-mb", type=int, default=512)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        build_demo(os.path.join(tmp_dir, "synthetic"), args.snapshots, args.turns_per_snapshot, args.nodes)
+        demo = wl.Demonstration("synthetic", base_dir=tmp_dir)
+        num_files = 2 * args.snapshots
+
+        for name, max_bytes in [("no cache", 0), (f"cache {args.max_mb}MB", args.max_mb * 1024**2)]:
+            wl.utils.cache.set_file_cache_size(max_bytes)
+            counts = measure(demo)
+            print(
+                f"{name:<12} | {num_files} files | reads={counts['file_reads']:>5} | hits={counts['hits']:>5} "
+                f"misses={counts['misses']:>5} evictions={counts['evictions']:>5} | "
+                f"cached={counts['bytes'] / 1e6:.1f}MB | {counts['seconds']:.3f}s"
+            )
+
+
+if __name__ == "__main__":
+    main()
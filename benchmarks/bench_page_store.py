@@ -0,0 +1,138 @@
+"""
+Compares the raw `page-*.html` layout with the content-addressed page store
+(weblinx.utils.store): disk usage of the pages, and the time to read every page through
+`Turn.html`, also checking that both layouts give the same HTML. Runs on a copy of the given
+demonstrations, or on a synthetic session where consecutive snapshots are identical or
+differ slightly, as with scrolls and text inputs.
+
+Usage (from the repository root):
+
+    python -m benchmarks.bench_page_store --demos-dir wl_data/demonstrations --max-demos 20
+    python -m benchmarks.bench_page_store --turns 100 --nodes 20000 --cold
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+import weblinx as wl
+from weblinx.utils.store import PageStore
+from benchmarks.bench_snapshot import build_synthetic_page
+
+
+def build_synthetic_demo(demo_dir, num_turns, num_nodes):
+    os.makedirs(os.path.join(demo_dir, "pages"))
+    page = build_synthetic_page(num_nodes)
+    data = []
+    for i in range(num_turns):
+        # Two out of three snapshots are identical to the previous one (scroll, hover), the
+        # others add a few characters (text input)
+        if i % 3 == 0:
+            page = page.replace("</body>", f"<input value='typed {i}'></body>")
+        with open(os.path.join(demo_dir, "pages", f"page-{i}-0.html"), "w") as f:
+            f.write(page)
+        data.append({"type": "browser", "timestamp": i, "action": {"intent": "scroll"}, "state": {"page": f"page-{i}-0.html"}})
+
+    with open(os.path.join(demo_dir, "replay.json"), "w") as f:
+        json.dump({"data": data}, f)
+
+
+def pages_disk_usage(demo_dirs):
+    return sum(
+        p.stat().st_size for d in demo_dirs for p in Path(d, "pages").rglob("*") if p.is_file()
+    )
+
+
+def evict_from_page_cache(demo_dirs):
+    # Archived sessions are not in the page cache, so the reads are bound by the disk
+    for d in demo_dirs:
+        for p in Path(d, "pages").rglob("*"):
+            if p.is_file():
+                fd = os.open(p, os.O_RDONLY)
+                try:
+                    os.fdatasync(fd)
+                    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+                finally:
+                    os.close(fd)
+
+
+def read_all_pages(demo_dirs, cold=False):
+    if cold:
+        evict_from_page_cache(demo_dirs)
+    # Fresh demonstrations and stores, so the index is loaded as in a new process
+    wl.utils.store._open_stores.clear()
+    start = time.perf_counter()
+    pages = {}
+    for demo_dir in demo_dirs:
+        demo = wl.Demonstration(os.path.basename(demo_dir), base_dir=os.path.dirname(demo_dir))
+        for turn in wl.Replay.from_demonstration(demo).filter_if_html_page():
+            pages[(demo.name, turn.index)] = turn.html
+    return pages, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--demos-dir", help="Directory of demonstrations; a synthetic session is used if omitted")
+    parser.add_argument("--max-demos", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=100)
+    parser.add_argument("--nodes", type=int, default=20000)
+    parser.add_argument("--codec", default="auto", choices=["auto", "zstd", "gzip"])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--cold", action="store_true", help="Evict the pages from the OS page cache before each read")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        raw_root = os.path.join(tmp_dir, "raw")
+        store_root = os.path.join(tmp_dir, "store")
+
+        if args.demos_dir:
+            names = sorted(
+                name for name in os.listdir(args.demos_dir)
+                if os.path.exists(os.path.join(args.demos_dir, name, "replay.json"))
+            )[: args.max_demos]
+            for name in names:
+                shutil.copytree(os.path.join(args.demos_dir, name), os.path.join(raw_root, name))
+        else:
+            names = ["synthetic"]
+            build_synthetic_demo(os.path.join(raw_root, "synthetic"), args.turns, args.nodes)
+
+        shutil.copytree(raw_root, store_root)
+        raw_dirs = [os.path.join(raw_root, name) for name in names]
+        store_dirs = [os.path.join(store_root, name) for name in names]
+
+        start = time.perf_counter()
+        num_pages = sum(
+            PageStore(os.path.join(d, "pages"), codec=args.codec).import_pages(remove_raw=True)
+            for d in store_dirs
+        )
+        pack_time = time.perf_counter() - start
+
+        raw_usage = pages_disk_usage(raw_dirs)
+        store_usage = pages_disk_usage(store_dirs)
+        print(
+            f"{len(names)} demos, {num_pages} pages | raw={raw_usage / 1e6:.1f}MB "
+            f"store={store_usage / 1e6:.1f}MB ({raw_usage / max(store_usage, 1):.1f}x smaller) | "
+            f"packed in {pack_time:.2f}s"
+        )
+
+        raw_times, store_times = [], []
+        for _ in range(args.repeat):
+            raw_pages, raw_time = read_all_pages(raw_dirs, cold=args.cold)
+            store_pages, store_time = read_all_pages(store_dirs, cold=args.cold)
+            raw_times.append(raw_time)
+            store_times.append(store_time)
+
+        same = raw_pages == store_pages
+        total_mb = sum(len(html) for html in raw_pages.values() if html) / 1e6
+        print(
+            f"Turn.html over {len(raw_pages)} turns ({total_mb:.1f}MB of html) | "
+            f"raw={min(raw_times):.3f}s ({total_mb / min(raw_times):.0f}MB/s) | "
+            f"store={min(store_times):.3f}s ({total_mb / min(store_times):.0f}MB/s) | same_html={same}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Compares loading the demonstrations of a split one after the other with loading them through
+weblinx.utils.parallel.parallel_map, in threads and in processes. Two workloads are measured:
+reading the replay, HTML and bounding boxes of every turn (I/O), and parsing the pages of every
+turn with lxml (CPU). Reports the wall time of each, and checks that every mode returns the
+same results, in the same order.
+
+Usage (from the repository root):
+
+    python -m benchmarks.bench_parallel_loading --demos 40 --snapshots 10 --nodes 2000 --workers 8
+    python -m benchmarks.bench_parallel_loading --demos 40 --open-latency-ms 5
+    python -m benchmarks.bench_parallel_loading --demos-dir wl_data/demonstrations --max-demos 50
+"""
+import argparse
+import builtins
+import os
+import tempfile
+import time
+from unittest import mock
+
+import lxml.html
+
+import weblinx as wl
+from weblinx.utils.parallel import parallel_map
+from benchmarks.bench_file_cache import build_demo
+
+
+def load_demo(demo):
+    replay = wl.Replay.from_demonstration(demo)
+    return demo.name, [(turn.index, len(turn.html or ""), len(turn.bboxes or {})) for turn in replay]
+
+
+def parse_demo(demo):
+    replay = wl.Replay.from_demonstration(demo)
+    counts = []
+    for turn in replay.filter_if_html_page():
+        # Parses every page, without the tree cache of weblinx.processing.dom
+        root = lxml.html.fromstring(turn.html)
+        counts.append((turn.index, sum(1 for _ in root.iter())))
+    return demo.name, counts
+
+
+def measure(fn, names, base_dir, num_workers, use_processes, open_latency=0.0):
+    wl.utils.cache.file_cache.clear()
+    # New Demonstration objects, so that no replay is already loaded
+    demos = [wl.Demonstration(name, base_dir=base_dir) for name in names]
+    builtin_open = builtins.open
+
+    def slow_open(*args, **kwargs):
+        # Simulates the round trip of an open on a network filesystem
+        time.sleep(open_latency)
+        return builtin_open(*args, **kwargs)
+
+    # Forked worker processes inherit the patch
+    with mock.patch.object(builtins, "open", slow_open):
+        start = time.perf_counter()
+        results = parallel_map(fn, demos, num_workers=num_workers, use_processes=use_processes)
+        return results, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--demos-dir", help="Directory of demonstrations; synthetic ones are used if omitted")
+    parser.add_argument("--max-demos", type=int, default=50)
+    parser.add_argument("--demos", type=int, default=40)
+    parser.add_argument("--snapshots", type=int, default=10)
+    parser.add_argument("--nodes", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--open-latency-ms", type=float, default=0.0, help="Latency added to each file opened")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if args.demos_dir:
+            demos_dir = args.demos_dir
+            names = [demo.name for demo in wl.list_demonstrations(demos_dir, valid_only=True)][: args.max_demos]
+        else:
+            demos_dir = os.path.join(tmp_dir, "demonstrations")
+            names = [f"demo-{i}" for i in range(args.demos)]
+            for name in names:
+                build_demo(os.path.join(demos_dir, name), args.snapshots, 2, args.nodes)
+
+        print(f"{len(names)} demos, {args.workers} workers, {os.cpu_count()} cpus")
+        open_latency = args.open_latency_ms / 1000
+        for workload, fn in [("load", load_demo), ("parse", parse_demo)]:
+            baseline, baseline_time = measure(fn, names, demos_dir, 0, False, open_latency)
+            print(f"{workload:<6} | sequential | {baseline_time:.3f}s")
+            for mode, use_processes in [("threads", False), ("processes", True)]:
+                results, seconds = measure(fn, names, demos_dir, args.workers, use_processes, open_latency)
+                print(
+                    f"{workload:<6} | {mode:<10} | {seconds:.3f}s | speedup={baseline_time / seconds:.2f}x"
+                    f" | same_results={results == baseline}"
+                )
+
+
+if __name__ == "__main__":
+    main()
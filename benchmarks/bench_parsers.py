@@ -0,0 +1,203 @@
+"""
+Checks the parser backends of weblinx.processing.dom against the lxml reference, then measures
+their throughput. The conformance check runs `compare_parser_backends` on every page and
+reports, for each backend, the share of the uids whose tag, xpath, text and attributes agree.
+It is run on three corpora: synthetic pages nested as real pages are, the random nesting of
+bench_prune_tree serialized as a browser would (where libxml2 and HTML5 parsers repair the
+nesting differently, so the xpaths disagree), and the pages of --demos-dir. The throughput is measured
+on parsing alone, on the xpaths of the uids (`get_xpaths_by_uid`, as in Turn.get_xpaths_dict),
+and on listing the elements joined with their bounding boxes (`list_elements`).
+
+Usage (from the repository root, the selectolax backend requires `pip install selectolax`):
+
+    python -m benchmarks.bench_parsers --sizes 1000 10000 --repeat 5
+    python -m benchmarks.bench_parsers --demos-dir wl_data/demonstrations --max-demos 20
+"""
+import argparse
+import random
+import time
+
+import weblinx as wl
+from weblinx.processing import dom
+from weblinx.processing.dom import compare_parser_backends, get_parser_backend, get_xpaths_by_uid, list_elements
+from benchmarks.bench_prune_tree import WORDS, build_webtasks_page
+
+UID_KEY = "data-webtasks-id"
+
+
+def browser_serialize(html):
+    # The snapshots are the outerHTML of the DOM built by the browser, with the nesting
+    # rules of HTML5 already applied (e.g. no <div> in a <p>), as lexbor's own serialization
+    from selectolax.lexbor import LexborHTMLParser
+
+    return LexborHTMLParser(html).html
+
+
+def build_realistic_page(num_nodes, seed=0, uid_key=UID_KEY):
+    """
+    Builds the HTML of a page with about `num_nodes` elements nested as on real pages (lists,
+    tables, forms, headings and paragraphs of phrasing content, inline SVG), unlike the random
+    nesting of bench_prune_tree, which libxml2 and HTML5 parsers repair differently.
+    """
+    rng = random.Random(seed)
+    count = 0
+
+    def uid():
+        nonlocal count
+        count += 1
+        return f'{uid_key}="{count}"'
+
+    def text():
+        return " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 4)))
+
+    def phrasing():
+        kind = rng.choice(["a", "span", "b", "button", "img", "svg", "text"])
+        if kind == "text":
+            return text()
+        if kind == "img":
+            return f'<img {uid()} src="/i/{count}.png" alt="">'
+        if kind == "svg":
+            return f'<svg {uid()} viewBox="0 0 24 24"><path {uid()} d="M0 0L24 24"></path></svg>'
+        if kind == "a":
+            return f'<a {uid()} href="/page/{count}?a=1&amp;b=2">{text()}</a>'
+        return f'<{kind} {uid()} class="c{rng.randint(0, 9)}">{text()}</{kind}>'
+
+    def block(depth):
+        kind = rng.choice(["div", "div", "p", "h2", "ul", "table", "form", "section"] if depth < 8 else ["p", "h2"])
+        if kind in ("p", "h2"):
+            inner = " ".join(phrasing() for _ in range(rng.randint(1, 4)))
+            return f"<{kind} {uid()}>{inner}</{kind}>"
+        if kind == "ul":
+            items = "".join(f"<li {uid()}>{phrasing()}</li>\n" for _ in range(rng.randint(1, 6)))
+            return f'<ul {uid()} class="menu">{items}</ul>'
+        if kind == "table":
+            rows = "".join(
+                f"<tr {uid()}>" + "".join(f"<td {uid()}>{phrasing()}</td>" for _ in range(3)) + "</tr>"
+                for _ in range(rng.randint(1, 4))
+            )
+            return f"<table {uid()}><tbody {uid()}>{rows}</tbody></table>"
+        if kind == "form":
+            return (
+                f'<form {uid()} action="/search"><label {uid()}>{text()} <input {uid()} type="text" value="" required>'
+                f'</label><select {uid()}><option {uid()} selected>{text()}</option><option {uid()}>x</option>'
+                f"</select><!-- form --><button {uid()}>{text()}</button></form>"
+            )
+        children = "".join(block(depth + 1) for _ in range(rng.choice([1, 2, 3, 5])) if count < num_nodes)
+        return f"<{kind} {uid()}>\n  {children}</{kind}>"
+
+    body = []
+    while count < num_nodes:
+        body.append(block(1))
+    return (
+        f'<!DOCTYPE html><html {uid_key}="html"><head><title>realistic</title></head>'
+        f'<body {uid_key}="body">{"".join(body)}</body></html>'
+    )
+
+
+def build_pages(num_pages):
+    rng = random.Random(0)
+    pages = []
+    for seed in range(num_pages):
+        size = rng.choice([100, 500, 2000])
+        pages.append((f"realistic-{seed}", build_realistic_page(size, seed=seed)))
+        html = build_webtasks_page(size, seed=seed)
+        html = html.replace("<input ", "<input disabled ").replace("<img ", '<img alt="" ')
+        pages.append((f"random-nesting-{seed}", browser_serialize(html)))
+    return pages
+
+
+def load_pages(demos_dir, max_demos):
+    pages = []
+    for demo in wl.list_demonstrations(demos_dir, valid_only=True)[:max_demos]:
+        for turn in wl.Replay.from_demonstration(demo).filter_if_html_page():
+            pages.append((f"{demo.name}-{turn.index}", turn.html))
+    return pages
+
+
+def check_conformance(pages, backend):
+    fields = ["tag", "xpath", "text", "attributes"]
+    totals = dict.fromkeys(["num_uids", "missing_uids", "extra_uids"] + fields, 0)
+    examples = []
+    for name, html in pages:
+        differences = compare_parser_backends(html, backend, uid_key=UID_KEY)
+        for key, value in differences.items():
+            totals[key] += value if key == "num_uids" else len(value)
+            if key != "num_uids" and value and len(examples) < 3:
+                examples.append((name, key, value[:3]))
+    return totals, examples
+
+
+def time_calls(fn, pages, repeat):
+    timings = []
+    for _ in range(repeat):
+        # Every call parses, without the tree cache of the lxml backend
+        dom.parsed_tree_cache.clear()
+        start = time.perf_counter()
+        for html, bboxes in pages:
+            fn(html, bboxes)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--backends", nargs="+", default=["lxml", "selectolax"])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--pages", type=int, default=10, help="Pages per size for the throughput")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--check-pages", type=int, default=20)
+    parser.add_argument("--demos-dir", help="Directory of demonstrations whose pages are checked")
+    parser.add_argument("--max-demos", type=int, default=20)
+    args = parser.parse_args()
+
+    pages = build_pages(args.check_pages)
+    if args.demos_dir:
+        pages += load_pages(args.demos_dir, args.max_demos)
+
+    corpora = {
+        "realistic": [page for page in pages if page[0].startswith("realistic")],
+        "random-nesting": [page for page in pages if page[0].startswith("random-nesting")],
+        "demos": [page for page in pages if not page[0].startswith(("realistic", "random-nesting"))],
+    }
+    for name in args.backends:
+        if name == "lxml":
+            continue
+        for corpus_name, corpus in corpora.items():
+            if not corpus:
+                continue
+            totals, examples = check_conformance(corpus, name)
+            num_uids = max(totals["num_uids"], 1)
+            agreement = " ".join(
+                f"{key}={100 * (1 - totals[key] / num_uids):.2f}%" for key in ["tag", "xpath", "text", "attributes"]
+            )
+            print(
+                f"conformance {name} on {corpus_name}: {len(corpus)} pages, {totals['num_uids']} uids,"
+                f" missing={totals['missing_uids']} extra={totals['extra_uids']} | {agreement} | {examples}"
+            )
+
+    rng = random.Random(0)
+    for size in args.sizes:
+        sized_pages = []
+        for seed in range(args.pages):
+            html = build_realistic_page(size, seed=seed)
+            uids = [e["uid"] for e in list_elements(html, uid_key=UID_KEY)]
+            # About a tenth of the elements are in the filtered bounding boxes
+            bboxes = {uid: {"x": 0, "y": 0, "width": 10, "height": 10} for uid in uids if rng.random() < 0.1}
+            sized_pages.append((html, bboxes))
+        megabytes = sum(len(html) for html, _ in sized_pages) / 1e6
+
+        workloads = {
+            "parse": lambda backend: lambda html, bboxes: backend.parse(html),
+            "xpaths": lambda backend: lambda html, bboxes: get_xpaths_by_uid(html, uid_key=UID_KEY, backend=backend),
+            "elements": lambda backend: lambda html, bboxes: list_elements(html, bboxes, uid_key=UID_KEY, backend=backend),
+        }
+        for workload, make_fn in workloads.items():
+            results = []
+            for name in args.backends:
+                seconds = time_calls(make_fn(get_parser_backend(name)), sized_pages, args.repeat)
+                results.append(f"{name}={megabytes / seconds:6.1f}MB/s ({1000 * seconds / args.pages:6.2f}ms/page)")
+            print(f"{size:>6} nodes | {workload:<8} | " + " | ".join(results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""
+Compares the previous `prune_tree` of weblinx.processing.dom (an xpath query per candidate and
+a copy of the whole tree) with the current one (an index of the uids and a copy of the kept
+nodes only), by page size and number of candidates, on synthetic pages shaped like WebLINX
+snapshots: every element has a `data-webtasks-id`, with nested containers, text, tails,
+entities, comments, inline SVG and a few elements without uid. Reports the time per call and
+checks that the pruned trees serialize to the same bytes, also on edge cases (missing, duplicate
+and quoted uids, `<text>` elements).
+
+Usage (from the repository root):
+
+    python -m benchmarks.bench_prune_tree --sizes 1000 10000 --candidates 10 20 --repeat 5
+"""
+import argparse
+import random
+import time
+from copy import deepcopy
+
+import lxml.html
+
+from weblinx.processing.dom import get_descendants, prune_tree
+
+TAGS = ["div", "span", "a", "p", "button", "label", "li", "ul", "input", "img", "h2", "section"]
+WORDS = ["search", "flights", "hotel", "&amp;", "price", "&nbsp;", "sign in", "&quot;next&quot;", "(1)", "menu", "&#39;s"]
+
+
+def build_webtasks_page(num_nodes, seed=0, uid_key="data-webtasks-id"):
+    """
+    Builds the HTML of a page with about `num_nodes` elements, shaped like a WebLINX snapshot.
+    """
+    rng = random.Random(seed)
+    count = 0
+
+    def text():
+        return " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 4)))
+
+    def element(depth):
+        nonlocal count
+        count += 1
+        uid = count
+        tag = rng.choice(TAGS) if depth > 1 else "div"
+        attrs = []
+        # A few elements without uid
+        if rng.random() > 0.02:
+            attrs.append(f'{uid_key}="{uid}"')
+        if rng.random() < 0.6:
+            attrs.append(f'class="c{rng.randint(0, 40)} row"')
+        if tag == "a":
+            attrs.append(f'href="/page/{uid}?a=1&amp;b=2"')
+        if rng.random() < 0.2:
+            attrs.append(f'aria-label="{text()}"')
+        if rng.random() < 0.05:
+            attrs.append('style="display: none"')
+        open_tag = f"<{tag} {' '.join(attrs)}>" if attrs else f"<{tag}>"
+
+        if tag in ("input", "img"):
+            return open_tag + (text() if rng.random() < 0.3 else "")
+
+        parts = [open_tag]
+        if rng.random() < 0.5:
+            parts.append(text())
+        if rng.random() < 0.02:
+            parts.append(f"<!-- comment {uid} -->")
+        if rng.random() < 0.01:
+            count += 2
+            parts.append(
+                f'<svg {uid_key}="{count - 1}" viewBox="0 0 10 10"><use {uid_key}="{count}" xlink:href="#icon"></use></svg>'
+            )
+        if depth < 12:
+            num_children = rng.choice([0, 0, 1, 1, 2, 3, 5, 8])
+            for _ in range(num_children):
+                if count >= num_nodes:
+                    break
+                parts.append(element(depth + 1))
+                if rng.random() < 0.3:
+                    parts.append(text())
+        parts.append(f"</{tag}>")
+        return "".join(parts)
+
+    body = []
+    while count < num_nodes:
+        body.append(element(1))
+    return (
+        f'<!DOCTYPE html><html {uid_key}="0"><head><title>synthetic</title></head>'
+        f'<body {uid_key}="b">{"".join(body)}</body></html>'
+    )
+
+
+def legacy_prune_tree(dom_tree, candidate_set, max_depth=5, max_children=50, max_sibling=3, uid_key="data-webtasks-id"):
+    nodes_to_keep = set()
+    for candidate_id in candidate_set:
+        try:
+            xpath = dom_tree.xpath(f'//*[@{uid_key}="{candidate_id}"]')
+        except:
+            continue
+        if len(xpath) <= 0:
+            continue
+        candidate_node = xpath[0]
+        nodes_to_keep.add(candidate_node.attrib[uid_key])
+        nodes_to_keep.update([x.attrib.get(uid_key, "") for x in candidate_node.xpath("ancestor::*")])
+        nodes_to_keep.update([x.attrib.get(uid_key, "") for x in get_descendants(candidate_node, max_depth)][:max_children])
+        parent = candidate_node.getparent()
+        if parent is not None:
+            siblings = [x for x in parent.getchildren() if x.tag != "text"]
+            if candidate_node not in siblings:
+                continue
+            idx_in_sibling = siblings.index(candidate_node)
+            nodes_to_keep.update(
+                [
+                    x.attrib.get(uid_key, "")
+                    for x in siblings[max(0, idx_in_sibling - max_sibling) : idx_in_sibling + max_sibling + 1]
+                ]
+            )
+    new_tree = deepcopy(dom_tree)
+    for node in new_tree.xpath("//*")[::-1]:
+        if node.tag != "text":
+            is_keep = node.attrib.get(uid_key, "") in nodes_to_keep
+            is_candidate = node.attrib.get(uid_key, "") in candidate_set
+        else:
+            is_keep = node.getparent().attrib.get(uid_key, "") in nodes_to_keep
+            is_candidate = node.getparent().attrib.get(uid_key, "") in candidate_set
+        if not is_keep and node.getparent() is not None:
+            node.getparent().remove(node)
+        else:
+            if not is_candidate or node.tag == "text":
+                node.attrib.pop(uid_key, None)
+            if (
+                len(node.attrib) == 0
+                and not any([x.tag == "text" for x in node.getchildren()])
+                and node.getparent() is not None
+                and node.tag != "text"
+                and len(node.getchildren()) <= 1
+            ):
+                for child in node.getchildren():
+                    node.addprevious(child)
+                node.getparent().remove(node)
+    return new_tree
+
+
+def check_equivalence(num_pages=30, uid_key="data-webtasks-id"):
+    """
+    Returns the number of (page, candidates, parameters) cases compared and the number of
+    mismatches, on small pages with edge cases.
+    """
+    rng = random.Random(1)
+    cases = mismatches = 0
+    for seed in range(num_pages):
+        html = build_webtasks_page(rng.choice([50, 300, 1500]), seed=seed)
+        if seed % 3 == 0:
+            # <text> elements, as in the pages preprocessed by Mind2Web
+            html = html.replace("<label ", "<text ").replace("</label>", "</text>")
+        if seed % 5 == 0:
+            # Duplicate uids
+            html = html.replace(f'{uid_key}="1"', f'{uid_key}="2"')
+        root = lxml.html.fromstring(html)
+        uids = [node.get(uid_key) for node in root.iter() if isinstance(node.tag, str) and node.get(uid_key)]
+        before = lxml.html.tostring(root)
+
+        for num_candidates in [0, 1, 5, 20]:
+            candidates = set(rng.sample(uids, min(num_candidates, len(uids))))
+            candidates |= {"missing", 'quo"te'} if num_candidates == 5 else set()
+            for params in [{}, dict(max_depth=1, max_children=5, max_sibling=2), dict(max_depth=0, max_children=0, max_sibling=0)]:
+                expected = lxml.html.tostring(legacy_prune_tree(root, candidates, **params))
+                result = lxml.html.tostring(prune_tree(root, candidates, **params))
+                cases += 1
+                mismatches += expected != result
+        # prune_tree must not modify its input
+        mismatches += lxml.html.tostring(root) != before
+    return cases, mismatches
+
+
+def time_calls(fn, root, candidates, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(root, candidates, max_depth=1, max_children=5, max_sibling=2)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 5000, 10000])
+    parser.add_argument("--candidates", type=int, nargs="+", default=[10, 20])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--check-pages", type=int, default=30)
+    args = parser.parse_args()
+
+    cases, mismatches = check_equivalence(args.check_pages)
+    print(f"equivalence: {cases} cases, {mismatches} mismatches")
+
+    rng = random.Random(0)
+    for size in args.sizes:
+        root = lxml.html.fromstring(build_webtasks_page(size))
+        uids = [node.get("data-webtasks-id") for node in root.iter() if isinstance(node.tag, str) and node.get("data-webtasks-id")]
+        for num_candidates in args.candidates:
+            candidates = set(rng.sample(uids, num_candidates))
+            legacy = time_calls(legacy_prune_tree, root, candidates, args.repeat)
+            current = time_calls(prune_tree, root, candidates, args.repeat)
+            same = lxml.html.tostring(legacy_prune_tree(root, candidates, 1, 5, 2)) == lxml.html.tostring(
+                prune_tree(root, candidates, 1, 5, 2)
+            )
+            print(
+                f"{size:>6} nodes | {num_candidates:>3} candidates | before={legacy * 1000:8.2f}ms"
+                f" | after={current * 1000:7.2f}ms | speedup={legacy / current:5.1f}x | same={same}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Measures a full pass over demonstrations as the DMR records are built: for every action turn,
+its HTML and bounding boxes, then its query, which formats the previous turns and the
+instructor utterances again (format_prev_turns and find_turns_with_instructor_chat). Compares
+a replay that builds a new Turn on every access (max_cached_turns=0) with the memoized turns
+(the default), which read their pages from the file cache, counting the Turn objects built,
+the pages read from disk, the peak memory allocated (tracemalloc) and the wall time. The synthetic demonstration has an instructor utterance every four actions.
+
+Usage (from the repository root):
+
+    python -m benchmarks.bench_replay_turns --demos-dir wl_data/demonstrations --max-demos 20
+    python -m benchmarks.bench_replay_turns --turns 200 --nodes 5000
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+from unittest import mock
+
+import weblinx as wl
+from modeling.dmr.processing import build_formatters, format_turn_for_input
+from benchmarks.bench_page_store import build_synthetic_demo
+
+
+def add_chat_turns(demo_dir, every=4):
+    # An instructor utterance every few actions, whose turns find_turns_with_instructor_chat
+    # collects again for every later turn
+    path = os.path.join(demo_dir, "replay.json")
+    with open(path) as f:
+        data = json.load(f)["data"]
+    turns = []
+    for i, turn in enumerate(data):
+        if i % every == 0:
+            turns.append({"type": "chat", "speaker": "instructor", "utterance": f"Scroll down {i}", "timestamp": turn["timestamp"]})
+        turn["action"]["arguments"] = {"scrollX": 0, "scrollY": 100 * i}
+        turns.append(turn)
+    with open(path, "w") as f:
+        json.dump({"data": turns}, f)
+
+
+def full_pass(demos, max_cached_turns, num_prev_turns):
+    format_intent_input, _ = build_formatters()
+    for demo in demos:
+        replay = wl.Replay.from_demonstration(demo, max_cached_turns=max_cached_turns)
+        for turn in replay.filter_by_intents("click", "change", "textInput", "scroll", "load", "submit"):
+            turn.html, turn.bboxes
+            # The query of the DMR records, as build_records_for_single_turn
+            format_turn_for_input(replay, turn, format_intent=format_intent_input, num_prev_turns=num_prev_turns)
+
+
+def measure(demos, max_cached_turns, num_prev_turns):
+    turn_init = wl.Turn.__init__
+    open_html = wl.utils.html.open_html_with_encodings
+    counts = {"turns": 0, "page_reads": 0}
+
+    def counting_turn_init(self, *args, **kwargs):
+        counts["turns"] += 1
+        turn_init(self, *args, **kwargs)
+
+    def counting_open_html(*args, **kwargs):
+        counts["page_reads"] += 1
+        return open_html(*args, **kwargs)
+
+    with mock.patch.object(wl.Turn, "__init__", counting_turn_init), mock.patch.object(
+        wl.utils.html, "open_html_with_encodings", counting_open_html
+    ):
+        # Both modes read the pages from disk, rather than from the other's file cache
+        wl.utils.cache.file_cache.clear()
+        tracemalloc.start()
+        full_pass(demos, max_cached_turns, num_prev_turns)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    # Timed separately, tracemalloc slows down every allocation
+    start = time.perf_counter()
+    full_pass(demos, max_cached_turns, num_prev_turns)
+    counts["seconds"] = time.perf_counter() - start
+    counts["peak_mb"] = peak / 1e6
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--demos-dir", help="Directory of demonstrations; a synthetic one is used if omitted")
+    parser.add_argument("--max-demos", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=200)
+    parser.add_argument("--nodes", type=int, default=5000)
+    parser.add_argument("--num-prev-turns", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if args.demos_dir:
+            demos = wl.list_demonstrations(args.demos_dir)[: args.max_demos]
+        else:
+            build_synthetic_demo(os.path.join(tmp_dir, "synthetic"), args.turns, args.nodes)
+            add_chat_turns(os.path.join(tmp_dir, "synthetic"))
+            demos = [wl.Demonstration("synthetic", base_dir=tmp_dir)]
+
+        for name, max_cached_turns in [("new turn per access", 0), ("memoized turns", 256)]:
+            counts = measure(demos, max_cached_turns, args.num_prev_turns)
+            print(
+                f"{name:<20} | turns built={counts['turns']:>7} | page reads={counts['page_reads']:>6} | "
+                f"peak={counts['peak_mb']:.1f}MB | {counts['seconds']:.3f}s"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Load test of concurrent live sessions: measures the time-to-first-action (browser ready,
+first page loaded and settled, snapshot saved in the session directory, screenshot captured) at
+several levels of concurrency, with a cold Chrome per session vs a pre-warmed BrowserPool.
+
+Usage (from the repository root, requires Chrome and chromedriver):
+
+    python -m benchmarks.bench_sessions --concurrency 1 4 16
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import browser_helper
+import replay_helper
+from benchmarks.bench_snapshot import build_synthetic_page
+
+SETTLE = dict(strategies=("ready_state", "dom_quiescence"), timeout=10.0, quiet_period=0.1)
+
+
+def run_session(lease, release, root_dir, page_url):
+    start = time.perf_counter()
+    driver = lease()
+    session_dir = replay_helper.create_session_dir(root_dir)
+    replay_helper.reset_replay(os.path.join(session_dir, "replay.json"))
+
+    driver.get(page_url)
+    browser_helper.wait_for_settle(driver, **SETTLE)
+    browser_helper.save_pages_bbox(driver, 0, session_dir)
+    browser_helper.capture_screenshot(driver, "jpeg", max_width=1000)
+    elapsed = time.perf_counter() - start
+
+    release(driver)
+    return session_dir, elapsed
+
+
+def run_load(num_sessions, lease, release, root_dir, page_url):
+    with ThreadPoolExecutor(max_workers=num_sessions) as executor:
+        futures = [executor.submit(run_session, lease, release, root_dir, page_url) for _ in range(num_sessions)]
+        results = [f.result() for f in futures]
+
+    session_dirs = {session_dir for session_dir, _ in results}
+    isolated = len(session_dirs) == num_sessions and all(
+        os.path.exists(os.path.join(d, "pages", "page-0-0.html")) for d in session_dirs
+    )
+    return sorted(elapsed for _, elapsed in results), isolated
+
+
+def report(name, num_sessions, timings, isolated):
+    p95 = timings[min(len(timings) - 1, int(round(0.95 * (len(timings) - 1))))]
+    print(
+        f"{name:>5} | sessions={num_sessions:>3} | time-to-first-action "
+        f"p50={statistics.median(timings):.2f}s p95={p95:.2f}s max={timings[-1]:.2f}s | isolated={isolated}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--nodes", type=int, default=2000)
+    parser.add_argument("--width", type=int, default=1600)
+    parser.add_argument("--height", type=int, default=900)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        page_path = os.path.join(tmp_dir, "synthetic.html")
+        with open(page_path, "w") as f:
+            f.write(build_synthetic_page(args.nodes))
+        page_url = "file://" + page_path
+
+        for num_sessions in args.concurrency:
+            timings, isolated = run_load(
+                num_sessions,
+                lease=lambda: browser_helper.initialize_browser(args.width, args.height),
+                release=lambda driver: driver.quit(),
+                root_dir=os.path.join(tmp_dir, "cold"),
+                page_url=page_url,
+            )
+            report("cold", num_sessions, timings, isolated)
+
+            pool = browser_helper.BrowserPool(args.width, args.height, size=num_sessions, max_size=num_sessions)
+            try:
+                # Measure with a warm pool, as when sessions arrive on a running server
+                while pool.stats()["idle"] < num_sessions:
+                    time.sleep(0.1)
+                timings, isolated = run_load(
+                    num_sessions,
+                    lease=lambda: pool.lease(timeout=120),
+                    release=pool.release,
+                    root_dir=os.path.join(tmp_dir, "pool"),
+                    page_url=page_url,
+                )
+                report("pool", num_sessions, timings, isolated)
+            finally:
+                pool.close()
+
+
+if __name__ == "__main__":
+    main()
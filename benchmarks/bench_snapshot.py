@@ -0,0 +1,87 @@
+"""
+Compares the single-call snapshot (mode="script") of browser_helper.save_pages_bbox with
+the original element-by-element WebDriver path (mode="webdriver") on synthetic pages.
+
+Usage (from the repository root, requires Chrome and chromedriver):
+
+    python -m benchmarks.bench_snapshot --sizes 1000 5000 20000 --repeat 3
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import browser_helper
+
+
+def build_synthetic_page(num_nodes, branching=8):
+    """
+    Builds an HTML page with roughly `num_nodes` elements, nested `branching` wide.
+    """
+    tags = ["span", "a", "p", "button", "label"]
+    parts = ["<!DOCTYPE html><html><head><title>synthetic</title></head><body>"]
+    # html, head, title and body already account for 4 nodes
+    count = 4
+    while count < num_nodes:
+        parts.append(f'<div class="row-{count % 13}">')
+        count += 1
+        for i in range(min(branching, num_nodes - count)):
+            tag = tags[i % len(tags)]
+            parts.append(f"<{tag}>item {count}</{tag}>")
+            count += 1
+        parts.append("</div>")
+    parts.append("</body></html>")
+    return "".join(parts)
+
+
+def run_mode(driver, mode, tmp_dir, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        browser_helper.save_pages_bbox(driver, 0, tmp_dir, mode=mode)
+        timings.append(time.perf_counter() - start)
+    return min(timings), sum(timings) / len(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 5000, 20000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--width", type=int, default=1600)
+    parser.add_argument("--height", type=int, default=900)
+    args = parser.parse_args()
+
+    driver = browser_helper.initialize_browser(args.width, args.height)
+
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            os.makedirs(os.path.join(tmp_dir, "pages"))
+            os.makedirs(os.path.join(tmp_dir, "bboxes"))
+            page_path = os.path.join(tmp_dir, "synthetic.html")
+
+            for size in args.sizes:
+                with open(page_path, "w") as f:
+                    f.write(build_synthetic_page(size))
+                driver.get("file://" + page_path)
+
+                # The first snapshot assigns the uids, so both modes see the same page afterwards
+                html_script, bboxes_script = browser_helper.save_pages_bbox(driver, 0, tmp_dir, mode="script")
+                html_wd, bboxes_wd = browser_helper.save_pages_bbox(driver, 0, tmp_dir, mode="webdriver")
+                identical = html_script == html_wd and json.dumps(bboxes_script) == json.dumps(bboxes_wd)
+
+                best_script, mean_script = run_mode(driver, "script", tmp_dir, args.repeat)
+                best_wd, mean_wd = run_mode(driver, "webdriver", tmp_dir, args.repeat)
+
+                print(
+                    f"nodes={len(bboxes_script):>6} | "
+                    f"script: best={best_script:.3f}s mean={mean_script:.3f}s | "
+                    f"webdriver: best={best_wd:.3f}s mean={mean_wd:.3f}s | "
+                    f"speedup={best_wd / best_script:.1f}x | identical_output={identical}"
+                )
+    finally:
+        driver.quit()
+
+
+if __name__ == "__main__":
+    main()
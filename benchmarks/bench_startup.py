@@ -0,0 +1,112 @@
+"""
+Measures the startup of the app in fresh processes: the import time of `weblinx`,
+`model_helper` and `main`, and the time to the first response (loading the formatters and
+tokenizers, then predicting the first action against the local stub server), compared with
+the second session of the same process, which reuses the shared tokenizers.
+
+Usage (from the repository root, the tokenizer is downloaded from the Hugging Face Hub unless
+TOKENIZER_NAME points to a local copy):
+
+    python -m benchmarks.bench_startup --repeat 3
+"""
+import argparse
+import json
+import logging
+import statistics
+import subprocess
+import sys
+import time
+
+MODULES = ["weblinx", "model_helper", "main"]
+
+
+def run_child(args):
+    result = subprocess.run(
+        [sys.executable, "-m", "benchmarks.bench_startup", *args],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        return {"error": result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "failed"}
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def measure_import(module):
+    start = time.perf_counter()
+    __import__(module)
+    return {"seconds": time.perf_counter() - start}
+
+
+def measure_first_response():
+    logging.basicConfig(level=logging.WARNING)
+    start = time.perf_counter()
+    import model_helper
+    import replay_helper
+    import weblinx as wl
+    from http_helper import EndpointClient
+    from stub_server import start_stub_server
+
+    import_time = time.perf_counter() - start
+
+    server = start_stub_server()
+    model_helper.action_client = EndpointClient(f"http://127.0.0.1:{server.server_address[1]}/action")
+
+    def respond():
+        start = time.perf_counter()
+        formatters = model_helper.load_formatters()
+        load_time = time.perf_counter() - start
+
+        replay_data = {"data": [{"type": "chat", "speaker": "instructor", "utterance": "Open the news", "timestamp": 0}]}
+        replay = replay_helper.LiveReplay(replay_data, demo_name="startup", base_dir=".")
+        replay_data["data"].append(replay_helper.build_temporary_action(None, 1600, 900, "00:00:00"))
+        turn = wl.Turn.from_replay(replay, len(replay) - 1)
+        model_helper.predict_answer(None, turn, replay, *formatters)
+        return load_time, time.perf_counter() - start
+
+    first_load, first_response = respond()
+    second_load, second_response = respond()
+    server.shutdown()
+    return {
+        "import": import_time,
+        "first_load_formatters": first_load,
+        "first_response": first_response,
+        "second_load_formatters": second_load,
+        "second_response": second_response,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--child", nargs="+", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        if args.child[0] == "import":
+            print(json.dumps(measure_import(args.child[1])))
+        else:
+            print(json.dumps(measure_first_response()))
+        return
+
+    for module in MODULES:
+        runs = [run_child(["--child", "import", module]) for _ in range(args.repeat)]
+        if "error" in runs[0]:
+            print(f"import {module:<13} | skipped: {runs[0]['error']}")
+            continue
+        seconds = [run["seconds"] for run in runs]
+        print(f"import {module:<13} | median={statistics.median(seconds):.3f}s min={min(seconds):.3f}s")
+
+    run = run_child(["--child", "first-response"])
+    if "error" in run:
+        print(f"first response       | skipped: {run['error']}")
+    else:
+        print(
+            f"first response       | import={run['import']:.2f}s "
+            f"load_formatters={run['first_load_formatters']:.2f}s total={run['first_response']:.2f}s | "
+            f"second session: load_formatters={run['second_load_formatters'] * 1000:.1f}ms "
+            f"total={run['second_response']:.2f}s"
+        )
+
+
+if __name__ == "__main__":
+    main()
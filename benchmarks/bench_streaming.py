@@ -0,0 +1,67 @@
+"""
+Compares waiting for the full completion of the action model with streaming it and stopping
+at the first complete action (model_helper.generate_action_text), against the local stub
+server. Also checks that both modes give the same answer, and the fallback on an endpoint
+that does not stream.
+
+Usage (from the repository root):
+
+    python -m benchmarks.bench_streaming --token-latency 0.01 --max-new-tokens 256
+"""
+import argparse
+import logging
+import re
+import time
+
+# weblinx.processing.outputs configures the root logger at DEBUG when imported
+logging.basicConfig(level=logging.WARNING)
+
+import model_helper
+from http_helper import EndpointClient
+from stub_server import DEFAULT_ACTION_TEXT, start_stub_server
+
+ACTION_TEXTS = [
+    DEFAULT_ACTION_TEXT,
+    'click(uid="a1b2c3d4-e5f6-47")',
+    'text_input(text="weather (today) in Montreal", uid="9f8e7d6c-5b4a-43")',
+]
+
+
+def generate(payload, streaming):
+    model_helper.ACTION_STREAMING = streaming
+    start = time.perf_counter()
+    out = model_helper.generate_action_text(payload)
+    return re.findall(model_helper.ACTION_PATTERN, out)[0], time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--token-latency", type=float, default=0.01)
+    parser.add_argument("--max-new-tokens", type=int, default=256)
+    args = parser.parse_args()
+
+    server = start_stub_server(token_latency=args.token_latency)
+    model_helper.action_client = EndpointClient(f"http://127.0.0.1:{server.server_address[1]}/action")
+    payload = {"inputs": "prompt", "parameters": {"max_new_tokens": args.max_new_tokens, "return_full_text": False}}
+
+    try:
+        for action_text in ACTION_TEXTS:
+            server.config["action_text"] = action_text
+            full_answer, full_time = generate(payload, streaming=False)
+            stream_answer, stream_time = generate(payload, streaming=True)
+            print(
+                f"{action_text[:40]:<40} | full={full_time:.2f}s | streaming={stream_time:.2f}s | "
+                f"speedup={full_time / stream_time:.1f}x | same_answer={full_answer == stream_answer}"
+            )
+
+        server.config["streaming"] = False
+        fallback_answer, fallback_time = generate(payload, streaming=True)
+        print(f"non-streaming endpoint fallback: {fallback_time:.2f}s | answer={fallback_answer}")
+        time.sleep(0.5)
+        print(f"server stats: {server.get_stats()}")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
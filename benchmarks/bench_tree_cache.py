@@ -0,0 +1,107 @@
+"""
+Measures the parsed tree cache of weblinx.processing.dom (parse_html) on the consumers of a
+page in one turn: the DMR records (xpath queries), the llama prompt (clean_and_prune_tree) and
+the xpaths of the turn (Turn.get_xpaths_dict), over turns where consecutive snapshots have the
+same HTML. Compares parsing the page in each consumer with the cache, counting the parses,
+and checks that the outputs are the same. Also compares a parse with a copy of a cached tree.
+
+Usage (from the repository root):
+
+    python -m benchmarks.bench_tree_cache --turns 30 --unique-pages 10 --nodes 5000
+"""
+import argparse
+import re
+import time
+from unittest import mock
+
+import lxml.html
+
+import weblinx as wl
+from weblinx.processing import dom
+from weblinx.processing.dom import clean_and_prune_tree, get_tree_repr_simple, parse_html
+from benchmarks.bench_snapshot import build_synthetic_page
+
+UID_KEY = "data-webtasks-id"
+
+
+def build_page(num_nodes, variant):
+    counter = iter(range(10**9))
+    page = build_synthetic_page(num_nodes).replace("synthetic", f"synthetic {variant}")
+    return re.sub(r"<(div|span|a|p|button|label)([ >])", lambda m: f'<{m[1]} {UID_KEY}="uid-{next(counter)}"{m[2]}', page)
+
+
+def consume(turn, candidates, parse):
+    root = parse(turn.html)
+    uids = [elem.attrib[UID_KEY] for elem in root.xpath(f"//*[@{UID_KEY}]")]
+    pruned = clean_and_prune_tree(parse(turn.html), cands_turn=candidates)
+    xpaths = turn.get_xpaths_dict(uid_key=UID_KEY)
+    return len(uids), get_tree_repr_simple(pruned), len(xpaths)
+
+
+def run(turns, candidates, use_cache):
+    counts = {"parses": 0, "parse_seconds": 0.0}
+    fromstring = lxml.html.fromstring
+
+    def counting_fromstring(*args, **kwargs):
+        counts["parses"] += 1
+        return fromstring(*args, **kwargs)
+
+    def timed(fn):
+        def wrapper(html, parser=None, copy=True):
+            start = time.perf_counter()
+            root = fn(html)
+            counts["parse_seconds"] += time.perf_counter() - start
+            return root
+
+        return wrapper
+
+    if use_cache:
+        dom.set_parsed_tree_cache_size(128 * 1024**2)
+        dom.parsed_tree_cache.clear()
+        parse = timed(lambda html: parse_html(html, copy=False))
+    else:
+        # Every consumer parses the page itself, as before the cache
+        parse = timed(lambda html: lxml.html.fromstring(html))
+
+    with mock.patch.object(lxml.html, "fromstring", counting_fromstring), mock.patch.object(dom, "parse_html", parse):
+        start = time.perf_counter()
+        outputs = [consume(turn, candidates, parse) for turn in turns]
+        counts["seconds"] = time.perf_counter() - start
+    return outputs, counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--turns", type=int, default=30)
+    parser.add_argument("--unique-pages", type=int, default=10)
+    parser.add_argument("--nodes", type=int, default=5000)
+    args = parser.parse_args()
+
+    pages = [build_page(args.nodes, i) for i in range(args.unique_pages)]
+    turns = []
+    for i in range(args.turns):
+        turn = wl.Turn({"type": "browser", "timestamp": i}, index=i, demo_name="synthetic", base_dir=".")
+        turn.__dict__["html"] = pages[i * args.unique_pages // args.turns]
+        turns.append(turn)
+    candidates = [{"uid": f"uid-{i}"} for i in range(0, args.nodes, args.nodes // 10)]
+
+    baseline, baseline_counts = run(turns, candidates, use_cache=False)
+    cached, cached_counts = run(turns, candidates, use_cache=True)
+    for name, counts in [("no cache", baseline_counts), ("cache", cached_counts)]:
+        print(
+            f"{name:<8} | {args.turns} turns, {args.unique_pages} pages | parses={counts['parses']:>3} | "
+            f"parsing={counts['parse_seconds'] / args.turns * 1000:.2f}ms/turn | total={counts['seconds'] / args.turns * 1000:.1f}ms/turn"
+        )
+    print(f"same_output={baseline == cached} | cache stats: {dom.parsed_tree_cache.stats()}")
+
+    start = time.perf_counter()
+    lxml.html.fromstring(pages[0])
+    parse_time = time.perf_counter() - start
+    start = time.perf_counter()
+    parse_html(pages[0], copy=True)
+    copy_time = time.perf_counter() - start
+    print(f"one page: parse={parse_time * 1000:.1f}ms | copy of the cached tree={copy_time * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
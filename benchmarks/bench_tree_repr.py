@@ -0,0 +1,156 @@
+"""
+Compares the previous `get_tree_repr_simple` of weblinx.processing.dom (a copy of the tree,
+then regular expressions and replacements over the serialized HTML) with the current one, on
+full and pruned pages. Before timing, it checks that both give the same representation on a
+corpus: synthetic WebLINX-shaped pages (see bench_prune_tree), variants of them with the
+constructs that need the original conversion ("<" or ">" in scripts, styles and comments,
+`<text>` elements, newlines in attributes) or that stress it (entities, runs of parentheses,
+boolean and URL attributes), and the real pages given with --pages-dir. It also checks that the offsets
+returned with `return_offsets=True` point at the elements.
+
+Usage (from the repository root):
+
+    python -m benchmarks.bench_tree_repr --sizes 1000 10000 --repeat 10
+    python -m benchmarks.bench_tree_repr --pages-dir wl_data/demonstrations --max-pages 500
+"""
+import argparse
+import random
+import re
+import time
+from copy import deepcopy
+from pathlib import Path
+
+import lxml.html
+
+from weblinx.processing.dom import clean_and_prune_tree, get_tree_repr_simple
+from weblinx.utils.html import open_html_with_encodings
+from benchmarks.bench_prune_tree import build_webtasks_page
+
+
+def legacy_get_tree_repr_simple(tree, keep_html_brackets=False, copy=True, postfix="\nAbove are the pruned HTML contents of the page."):
+    if tree is None:
+        return None
+    if copy:
+        tree = deepcopy(tree)
+    tree_repr = lxml.html.tostring(tree, encoding="unicode")
+    tree_repr = re.sub(r"<text>(.*?)</text>", r"\1", tree_repr)
+    if not keep_html_brackets:
+        tree_repr = tree_repr.replace("/>", "$/$>")
+        tree_repr = re.sub(r"</(.+?)>", r")", tree_repr)
+        tree_repr = re.sub(r"<(.+?)>", r"(\1", tree_repr)
+        tree_repr = tree_repr.replace("$/$", ")")
+    html_escape_table = [
+        ("&quot;", '"'), ("&amp;", "&"), ("&lt;", "<"), ("&gt;", ">"), ("&nbsp;", " "), ("&ndash;", "-"),
+        ("&rsquo;", "'"), ("&lsquo;", "'"), ("&ldquo;", '"'), ("&rdquo;", '"'), ("&#39;", "'"), ("&#40;", "("),
+        ("&#41;", ")"),
+    ]
+    for k, v in html_escape_table:
+        tree_repr = tree_repr.replace(k, v)
+    tree_repr = re.sub(r"\s+", " ", tree_repr).strip()
+    tree_repr = re.sub(r"\) +\)", r"))", tree_repr)
+    tree_repr = re.sub(r"\( +\(", r"((", tree_repr)
+    if postfix is not None:
+        tree_repr = tree_repr + postfix
+    return tree_repr
+
+
+VARIANTS = {
+    "plain": lambda html: html,
+    "script": lambda html: html.replace("</body>", '<script>if (a < b && c > d) x = "</p>";</script></body>'),
+    "style": lambda html: html.replace("</head>", "<style>a > b { color: red }</style></head>"),
+    "comment": lambda html: html.replace("<p ", "<!-- a > comment --><p ", 3),
+    "comment-multiline": lambda html: html.replace("<p ", "<!-- a\ncomment --><p ", 3),
+    "text-tags": lambda html: html.replace("<label ", "<text ").replace("</label>", "</text>").replace("<span>", "<text>"),
+    "newline-attr": lambda html: html.replace('class="c1 row"', 'class="c1\nrow"'),
+    "dollar": lambda html: html.replace("menu", "$/$ menu"),
+    "parens": lambda html: html.replace("(1)", ") ) ) ( ( (").replace("search", "&#41; &#41; &#40;"),
+    "entities": lambda html: html.replace("price", "&amp;lt;b&amp;gt; &ndash; &rsquo;x&lsquo; &ldquo;&rdquo; \xa0 caf\xe9"),
+    "attrs": lambda html: html.replace('<input ', '<input disabled value="" checked="checked" ')
+    .replace('href="/page/', 'href="  /p q?x=\xe9&amp;y=&quot;\'')
+    .replace("<img ", '<img alt="say &quot;hi&quot;" '),
+    "uppercase": lambda html: html.replace("<button ", "<BUTTON ").replace("</button>", "</BUTTON>"),
+}
+
+
+def build_corpus(num_pages, pages_dir=None, max_pages=None):
+    rng = random.Random(0)
+    corpus = []
+    for seed in range(num_pages):
+        html = build_webtasks_page(rng.choice([100, 500, 2000]), seed=seed)
+        for name, variant in VARIANTS.items():
+            root = lxml.html.fromstring(variant(html))
+            corpus.append((f"synthetic-{seed}-{name}", root))
+            uids = [n.get("data-webtasks-id") for n in root.iter() if isinstance(n.tag, str) and n.get("data-webtasks-id")]
+            cands = [{"uid": uid} for uid in rng.sample(uids, min(20, len(uids)))]
+            corpus.append((f"synthetic-{seed}-{name}-pruned", clean_and_prune_tree(root, cands)))
+
+    if pages_dir is not None:
+        paths = sorted(Path(pages_dir).glob("**/pages/*.html"))[:max_pages]
+        for path in paths:
+            html = open_html_with_encodings(path, raise_error=False)
+            if html:
+                corpus.append((str(path), lxml.html.fromstring(html)))
+    return corpus
+
+
+def check_offsets(tree, tree_repr, offsets):
+    if offsets is None:
+        return True
+    for element, (start, end) in offsets.items():
+        if not tree_repr.startswith("(" + element.tag, start) or end < start:
+            return False
+    return len(offsets) == sum(1 for _ in tree.iter(lxml.etree.Element))
+
+
+def check_equivalence(corpus):
+    mismatches = []
+    for name, tree in corpus:
+        for keep_html_brackets in [False, True]:
+            expected = legacy_get_tree_repr_simple(tree, keep_html_brackets=keep_html_brackets)
+            if get_tree_repr_simple(tree, keep_html_brackets=keep_html_brackets) != expected:
+                mismatches.append((name, keep_html_brackets))
+        tree_repr, offsets = get_tree_repr_simple(tree, return_offsets=True)
+        if tree_repr != legacy_get_tree_repr_simple(tree) or not check_offsets(tree, tree_repr, offsets):
+            mismatches.append((name, "offsets"))
+    return mismatches
+
+
+def time_calls(fn, tree, repeat, **kwargs):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(tree, **kwargs)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--check-pages", type=int, default=10, help="Number of synthetic pages in the corpus")
+    parser.add_argument("--pages-dir", help="Directory of demonstrations whose pages are added to the corpus")
+    parser.add_argument("--max-pages", type=int, default=500)
+    args = parser.parse_args()
+
+    corpus = build_corpus(args.check_pages, args.pages_dir, args.max_pages)
+    mismatches = check_equivalence(corpus)
+    print(f"equivalence: {len(corpus)} trees, {len(mismatches)} mismatches {mismatches[:5]}")
+
+    rng = random.Random(0)
+    for size in args.sizes:
+        root = lxml.html.fromstring(build_webtasks_page(size))
+        uids = [n.get("data-webtasks-id") for n in root.iter() if isinstance(n.tag, str) and n.get("data-webtasks-id")]
+        pruned = clean_and_prune_tree(root, [{"uid": uid} for uid in rng.sample(uids, 20)])
+        for name, tree in [("full", root), ("pruned", pruned)]:
+            legacy = time_calls(legacy_get_tree_repr_simple, tree, args.repeat)
+            current = time_calls(get_tree_repr_simple, tree, args.repeat)
+            with_offsets = time_calls(get_tree_repr_simple, tree, args.repeat, return_offsets=True)
+            print(
+                f"{size:>6} nodes {name:<6} | before={legacy * 1000:8.2f}ms | after={current * 1000:7.2f}ms"
+                f" | speedup={legacy / current:5.1f}x | with offsets={with_offsets * 1000:7.2f}ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
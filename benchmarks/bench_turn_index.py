@@ -0,0 +1,90 @@
+"""
+Compares the filters of Replay answered from its TurnIndex with the previous implementation,
+which tests every turn with a lambda, on long synthetic demonstrations: finding the instructor
+chat turns before every turn (as done to build the prompt of each turn, so quadratic in the
+number of turns before), filtering by intents and HTML pages, and listing intents. Also checks
+that both give the same turns.
+
+Usage (from the repository root):
+
+    python -m benchmarks.bench_turn_index --turns 500 1000 2000
+"""
+import argparse
+import random
+import time
+
+import weblinx as wl
+from weblinx.processing.prompt import find_turns_with_instructor_chat
+
+INTENTS = ["click", "scroll", "textInput", "change", "load", "submit", "hover", "tabswitch"]
+PROMPT_INTENTS = ["click", "change", "textInput", "scroll", "load", "say", "submit"]
+
+
+def build_replay(num_turns, seed=0):
+    rng = random.Random(seed)
+    data = []
+    for i in range(num_turns):
+        if rng.random() < 0.2:
+            speaker = rng.choice(["instructor", "navigator"])
+            data.append({"type": "chat", "speaker": speaker, "utterance": f"utterance {i}", "timestamp": i})
+        else:
+            state = {"page": f"page-{i}-0.html"} if rng.random() < 0.7 else None
+            data.append({"type": "browser", "timestamp": i, "action": {"intent": rng.choice(INTENTS)}, "state": state})
+    return wl.Replay({"data": data}, demo_name="synthetic", base_dir=".")
+
+
+def run_baseline(replay):
+    # The filters as they were before the TurnIndex: every turn is tested
+    results = []
+    for turn in replay:
+        start_index = max(0, turn.index - 5)
+        results.append(replay.filter_turns(lambda t: t.get("speaker") == "instructor" and t.index < start_index))
+    intents = set(PROMPT_INTENTS)
+    results.append(replay.filter_turns(lambda t: t.intent in intents or t.type == "chat"))
+    results.append(replay.filter_turns(lambda t: t.has_html()))
+    results.append(replay.filter_turns(lambda t: t.type == "chat"))
+    results.append(sorted(set(t.intent for t in replay), key=str))
+    return results
+
+
+def run_indexed(replay):
+    results = []
+    for turn in replay:
+        results.append(find_turns_with_instructor_chat(replay, turn, num_prev_turns=5))
+    results.append(replay.filter_by_intents(PROMPT_INTENTS))
+    results.append(replay.filter_if_html_page())
+    results.append(replay.filter_by_type("chat"))
+    results.append(sorted(replay.list_intents(), key=str))
+    return results
+
+
+def as_indices(results):
+    return [[t.index for t in r] if r and isinstance(r[0], wl.Turn) else r for r in results]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--turns", type=int, nargs="+", default=[500, 1000, 2000])
+    args = parser.parse_args()
+
+    for num_turns in args.turns:
+        replay = build_replay(num_turns)
+
+        start = time.perf_counter()
+        baseline = run_baseline(replay)
+        baseline_time = time.perf_counter() - start
+
+        # A fresh replay, so the time includes building the index
+        replay = build_replay(num_turns)
+        start = time.perf_counter()
+        indexed = run_indexed(replay)
+        indexed_time = time.perf_counter() - start
+
+        print(
+            f"{num_turns:>5} turns | lambda filters={baseline_time:.3f}s | turn index={indexed_time:.3f}s | "
+            f"speedup={baseline_time / indexed_time:.1f}x | same_turns={as_indices(baseline) == as_indices(indexed)}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -3,10 +3,128 @@ from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.common.by import By 
 from selenium.webdriver.common.keys import Keys 
 from selenium.webdriver.chrome.options import Options 
+from selenium.common.exceptions import WebDriverException
 import time  
+import hashlib
+import io
 import json
+import logging
+import threading
 import uuid
 import os
+import weakref
+
+# Runs inside the page: assigns missing uids, collects every bbox and serializes the
+# document in a single WebDriver round-trip. The rects are made absolute with the
+# scroll offsets, which is what WebDriver's element.rect returns, and the source is
+# serialized the same way chromedriver does for driver.page_source.
+SNAPSHOT_SCRIPT = """
+var uidKey = arguments[0];
+function makeUid() {
+    if (window.crypto && window.crypto.randomUUID) {
+        return window.crypto.randomUUID().slice(0, 18);
+    }
+    return 'xxxxxxxx-xxxx-4xxx'.replace(/x/g, function () {
+        return (Math.random() * 16 | 0).toString(16);
+    });
+}
+var scrollX = window.scrollX || window.pageXOffset || 0;
+var scrollY = window.scrollY || window.pageYOffset || 0;
+var elements = document.getElementsByTagName('*');
+var bboxes = [];
+for (var i = 0; i < elements.length; i++) {
+    var element = elements[i];
+    var uid = element.getAttribute(uidKey);
+    if (!uid) {
+        uid = makeUid();
+        element.setAttribute(uidKey, uid);
+    }
+    var rect = element.getBoundingClientRect();
+    bboxes.push([uid, rect.x + scrollX, rect.y + scrollY, rect.width, rect.height]);
+}
+return {html: new XMLSerializer().serializeToString(document), bboxes: bboxes};
+"""
+
+# Installs (once per document) a monitor of DOM mutations, pending fetch/XHR requests and
+# navigations. Registered to run before the scripts of every new document, and injected in
+# the current one before an action, so the activity started by the action is seen.
+SETTLE_INSTALL_SCRIPT = """
+if (!window.__weblinxSettle) {
+    var monitor = {installedAt: performance.now(), pending: 0, navigating: false};
+    monitor.lastMutation = monitor.installedAt;
+    monitor.lastNetwork = monitor.installedAt;
+    window.__weblinxSettle = monitor;
+
+    // Fired when a navigation starts, while the old document is still shown
+    window.addEventListener('beforeunload', function () {
+        monitor.navigating = true;
+    });
+
+    new MutationObserver(function () {
+        monitor.lastMutation = performance.now();
+    }).observe(document, {subtree: true, childList: true, attributes: true, characterData: true});
+
+    var requestStarted = function () {
+        monitor.pending += 1;
+        monitor.lastNetwork = performance.now();
+    };
+    var requestDone = function () {
+        monitor.pending = Math.max(0, monitor.pending - 1);
+        monitor.lastNetwork = performance.now();
+    };
+    if (window.fetch) {
+        var originalFetch = window.fetch;
+        window.fetch = function () {
+            requestStarted();
+            return originalFetch.apply(this, arguments).then(
+                function (response) { requestDone(); return response; },
+                function (error) { requestDone(); throw error; }
+            );
+        };
+    }
+    var originalSend = XMLHttpRequest.prototype.send;
+    XMLHttpRequest.prototype.send = function () {
+        requestStarted();
+        this.addEventListener('loadend', requestDone);
+        return originalSend.apply(this, arguments);
+    };
+    if (window.PerformanceObserver) {
+        try {
+            new PerformanceObserver(function () {
+                monitor.lastNetwork = performance.now();
+            }).observe({entryTypes: ['resource']});
+        } catch (e) {}
+    }
+}
+"""
+
+# Restarts the quiet periods of the monitor when an action is about to be performed, so
+# that the page only settles once the activity that follows the action is over.
+SETTLE_START_SCRIPT = SETTLE_INSTALL_SCRIPT + """
+var monitor = window.__weblinxSettle;
+monitor.lastMutation = monitor.lastNetwork = performance.now();
+monitor.navigating = false;
+"""
+
+# Returns the current state of the page (installing the monitor if the document has none).
+# Used by wait_for_settle to poll the page.
+SETTLE_MONITOR_SCRIPT = SETTLE_INSTALL_SCRIPT + """
+var monitor = window.__weblinxSettle;
+var now = performance.now();
+return {
+    readyState: document.readyState,
+    sinceMutation: (now - monitor.lastMutation) / 1000,
+    sinceNetwork: (now - monitor.lastNetwork) / 1000,
+    pending: monitor.pending,
+    navigating: monitor.navigating
+};
+"""
+
+SETTLE_STRATEGIES = ("ready_state", "network_idle", "dom_quiescence")
+
+# The tab of each browser where the settle monitor is registered for new documents (reset_browser
+# replaces the tab)
+_settle_monitor_tabs = weakref.WeakKeyDictionary()
 
 def initialize_browser(viewport_width, viewport_height): 
     chrome_options = Options()
@@ -17,37 +135,414 @@ def initialize_browser(viewport_width, viewport_height):
     return driver
 
 
-def save_pages_bbox(driver, html_and_bboxes_index, file_path):
+def encode_screenshot(png, image_format="png", quality=80, max_width=None):
+    """
+    Converts a PNG screenshot to `image_format` ("png", "jpeg" or "webp"), downscaled to
+    `max_width` pixels if it is wider. Requires Pillow unless the PNG is returned as is.
+    """
+    if image_format not in ("png", "jpeg", "webp"):
+        raise ValueError(f"Invalid image format '{image_format}'. Must be either 'png', 'jpeg' or 'webp'")
+
+    if image_format == "png" and max_width is None:
+        return png
+
+    try:
+        from PIL import Image
+    except ImportError:
+        logging.warning("Pillow is not installed, the screenshot is kept as a full-size PNG")
+        return png
+
+    image = Image.open(io.BytesIO(png))
+    if max_width is not None and image.width > max_width:
+        height = round(image.height * max_width / image.width)
+        image = image.resize((max_width, height), Image.BILINEAR)
+
+    output = io.BytesIO()
+    if image_format == "jpeg":
+        image.convert("RGB").save(output, format="JPEG", quality=quality)
+    elif image_format == "webp":
+        image.save(output, format="WEBP", quality=quality)
+    else:
+        image.save(output, format="PNG")
+    return output.getvalue()
+
+
+def capture_screenshot(driver, image_format="png", quality=80, max_width=None, previous_hash=None):
+    """
+    Captures the viewport in memory. Returns the encoded image (see `encode_screenshot`) and a
+    hash of the raw capture. If the hash equals `previous_hash`, the page looks exactly the
+    same as in the previous capture, so the image is not encoded again and None is returned.
+    """
+    png = driver.get_screenshot_as_png()
+    digest = hashlib.blake2b(png, digest_size=16).hexdigest()
+    if digest == previous_hash:
+        return None, digest
+    return encode_screenshot(png, image_format, quality, max_width), digest
+
+
+def is_browser_healthy(driver):
+    try:
+        driver.execute_script("return 1;")
+        return True
+    except WebDriverException:
+        return False
+
+
+def reset_browser(driver, viewport_width, viewport_height):
+    """
+    Brings a browser back to a blank state before it is leased again: the windows of the
+    previous session are replaced by a new one (with their history and sessionStorage), and
+    the cookies, cache and storages of every origin are cleared with the DevTools protocol,
+    not only those of the current page. Raises WebDriverException if the profile cannot be
+    cleared, in which case the browser must not be reused.
+    """
+    if not hasattr(driver, "execute_cdp_cmd"):
+        raise WebDriverException("The browser does not support the DevTools protocol, its profile cannot be cleared")
+
+    handles = driver.window_handles
+    driver.switch_to.new_window("tab")
+    new_handle = driver.current_window_handle
+    for handle in handles:
+        driver.switch_to.window(handle)
+        driver.close()
+    driver.switch_to.window(new_handle)
+
+    driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+    driver.execute_cdp_cmd("Network.clearBrowserCache", {})
+    # Local and session storages, IndexedDB, cache storage, service workers... of all origins
+    driver.execute_cdp_cmd("Storage.clearDataForOrigin", {"origin": "*", "storageTypes": "all"})
+    driver.get("about:blank")
+    driver.set_window_size(viewport_width, viewport_height)
+
+
+class BrowserPool:
+    """
+    Pool of headless browsers shared by the sessions of the app. `size` browsers are started in
+    the background when the pool is created and kept ready, so a new session does not wait for
+    Chrome to start. Up to `max_size` browsers can be leased at the same time; `lease` waits for
+    one to be returned when all of them are in use. Browsers are health-checked before being
+    leased and reset when they are returned; the ones that fail, or whose profile cannot be
+    cleared, are replaced by new ones. Sessions can end without returning their browser (e.g.
+    a closed tab), so with `lease_ttl`, a lease that has not been renewed with `touch` for
+    `lease_ttl` seconds expires: its `on_expire` callback is called and the browser is reset
+    and returned to the pool, when another session needs one.
+    """
+    def __init__(self, viewport_width, viewport_height, size=2, max_size=8, launch_fn=None, lease_ttl=None):
+        self.viewport_width = viewport_width
+        self.viewport_height = viewport_height
+        self.size = size
+        self.max_size = max_size
+        self.launch_fn = launch_fn or initialize_browser
+        self.lease_ttl = lease_ttl
+        self.idle = []
+        # Leased browsers by id: the browser, the time of its last activity and its on_expire
+        self.leases = {}
+        # Browsers that are leased, idle or being started
+        self.num_browsers = 0
+        self.num_starting = 0
+        self.closed = False
+        self.condition = threading.Condition()
+
+        for _ in range(size):
+            self._start_in_background()
+
+    def _launch(self):
+        return self.launch_fn(self.viewport_width, self.viewport_height)
+
+    def _start_in_background(self):
+        with self.condition:
+            if self.num_browsers >= self.max_size:
+                return
+            self.num_browsers += 1
+            self.num_starting += 1
+        threading.Thread(target=self._warm_up, daemon=True).start()
+
+    def _warm_up(self):
+        try:
+            driver = self._launch()
+        except Exception as e:
+            logging.warning(f"Could not start a browser for the pool: {e}")
+            with self.condition:
+                self.num_starting -= 1
+                self.num_browsers -= 1
+                self.condition.notify()
+            return
+        with self.condition:
+            self.num_starting -= 1
+        self._add_idle(driver)
+
+    def _add_idle(self, driver):
+        with self.condition:
+            if self.closed:
+                self.num_browsers -= 1
+                driver.quit()
+                return
+            self.idle.append(driver)
+            self.condition.notify()
+
+    def _discard(self, driver):
+        with self.condition:
+            self.num_browsers -= 1
+            self.condition.notify()
+        try:
+            driver.quit()
+        except WebDriverException:
+            pass
+
+    def lease(self, timeout=None, on_expire=None):
+        """
+        Returns a healthy browser. Raises TimeoutError if none is available within `timeout`
+        seconds (None waits forever). `on_expire` is called without arguments if the lease
+        expires (see `lease_ttl`), after which the browser must no longer be used.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            self.reclaim_expired()
+            with self.condition:
+                if not self.idle and self.num_browsers >= self.max_size:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise TimeoutError(f"No browser available in the pool after {timeout}s")
+                    if self.lease_ttl is not None:
+                        # Wakes up to reclaim the leases that expire in the meantime
+                        remaining = min(remaining or 1.0, 1.0)
+                    self.condition.wait(remaining)
+                    continue
+
+                if self.idle:
+                    driver = self.idle.pop()
+                else:
+                    # No idle browser but room for one more: start it in this thread
+                    self.num_browsers += 1
+                    driver = None
+
+            if driver is None:
+                try:
+                    driver = self._launch()
+                except Exception:
+                    with self.condition:
+                        self.num_browsers -= 1
+                        self.condition.notify()
+                    raise
+            elif not is_browser_healthy(driver):
+                logging.warning("Discarding an unhealthy browser from the pool")
+                self._discard(driver)
+                continue
+
+            # Keep `size` browsers ready for the next sessions
+            with self.condition:
+                self.leases[id(driver)] = [driver, time.monotonic(), on_expire]
+                num_missing = self.size - len(self.idle) - self.num_starting
+            for _ in range(num_missing):
+                self._start_in_background()
+            return driver
+
+    def touch(self, driver):
+        """
+        Renews the lease of `driver`. Returns False if the browser is not leased anymore,
+        e.g. because its lease expired.
+        """
+        with self.condition:
+            entry = self.leases.get(id(driver))
+            if entry is None or entry[0] is not driver:
+                return False
+            entry[1] = time.monotonic()
+            return True
+
+    def reclaim_expired(self):
+        """
+        Ends the leases that were not renewed for `lease_ttl` seconds and returns their
+        browsers to the pool. Returns the number of leases ended.
+        """
+        if self.lease_ttl is None:
+            return 0
+
+        now = time.monotonic()
+        with self.condition:
+            expired = [entry for entry in self.leases.values() if now - entry[1] > self.lease_ttl]
+            for driver, _, _ in expired:
+                del self.leases[id(driver)]
+
+        for driver, last_active, on_expire in expired:
+            logging.warning(f"Reclaiming a browser whose lease was idle for {now - last_active:.0f}s")
+            if on_expire is not None:
+                try:
+                    on_expire()
+                except Exception as e:
+                    logging.warning(f"The expiry callback of a lease failed: {e}")
+            self._reset_and_add_idle(driver)
+        return len(expired)
+
+    def release(self, driver):
+        """
+        Returns a leased browser to the pool, after resetting it. Browsers whose lease
+        expired were already returned, so they are ignored.
+        """
+        with self.condition:
+            entry = self.leases.get(id(driver))
+            if entry is None or entry[0] is not driver:
+                logging.warning("Ignoring the release of a browser that is not leased")
+                return
+            del self.leases[id(driver)]
+        self._reset_and_add_idle(driver)
+
+    def _reset_and_add_idle(self, driver):
+        try:
+            reset_browser(driver, self.viewport_width, self.viewport_height)
+        except WebDriverException as e:
+            logging.warning(f"Could not reset the browser, discarding it: {e}")
+            self._discard(driver)
+            return
+        self._add_idle(driver)
+
+    def stats(self):
+        with self.condition:
+            return {"idle": len(self.idle), "leased": len(self.leases), "browsers": self.num_browsers, "max_size": self.max_size}
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            idle, self.idle = self.idle, []
+            self.num_browsers -= len(idle)
+        for driver in idle:
+            driver.quit()
+
+
+def format_bbox(x, y, width, height):
+    return {
+        "x": x,
+        "y": y,
+        "width": width,
+        "height": height,
+        "top": y,
+        "right": x + width,
+        "bottom": y + height,
+        "left": x
+    }
+
+
+def snapshot_page_with_script(driver, uid_key='data-webtasks-id'):
+    snapshot = driver.execute_script(SNAPSHOT_SCRIPT, uid_key)
+    element_data = {}
+    for uid, x, y, width, height in snapshot['bboxes']:
+        element_data[uid] = format_bbox(x, y, width, height)
+    return snapshot['html'], element_data
+
+
+def snapshot_page_with_webdriver(driver, uid_key='data-webtasks-id'):
     elements = driver.find_elements(By.XPATH, "//*")
     element_data = {}
     for element in elements:
-        uid = element.get_attribute('data-webtasks-id')
+        uid = element.get_attribute(uid_key)
         if not uid:
             uid = str(uuid.uuid4())[:18]
-            driver.execute_script("arguments[0].setAttribute('data-webtasks-id', arguments[1]);", element, uid)
+            driver.execute_script("arguments[0].setAttribute(arguments[1], arguments[2]);", element, uid_key, uid)
                 
         # Obtain the bounding rectangle of the element
         rect = element.rect
-        element_data[uid] = {
-            "x": rect['x'],
-            "y": rect['y'],
-            "width": rect['width'],
-            "height": rect['height'],
-            "top": rect['y'],
-            "right": rect['x'] + rect['width'],
-            "bottom": rect['y'] + rect['height'],
-            "left": rect['x']
-        }
+        element_data[uid] = format_bbox(rect['x'], rect['y'], rect['width'], rect['height'])
+    return driver.page_source, element_data
+
+
+def save_pages_bbox(driver, html_and_bboxes_index, file_path, mode="script", page_store=None):
+    """
+    Snapshots the current page and saves it to pages/page-N-0.html, along with the
+    bounding boxes of every element to bboxes/bboxes-N.json. With mode="script", the
+    snapshot is taken in a single call inside the page; mode="webdriver" is the
+    original element-by-element path. If a weblinx.utils.store.PageStore of the pages
+    directory is given, the page is written to it, compressed and deduplicated, instead
+    of as a raw file. Returns the html and the bounding boxes.
+    """
+    if mode == "script":
+        html, element_data = snapshot_page_with_script(driver)
+    elif mode == "webdriver":
+        html, element_data = snapshot_page_with_webdriver(driver)
+    else:
+        raise ValueError(f"Invalid snapshot mode '{mode}'. Must be either 'script' or 'webdriver'")
+
     pages_directory = os.path.join(file_path, 'pages')
     bboxes_directory = os.path.join(file_path, 'bboxes')
     html_file_path = os.path.join(pages_directory, f'page-{html_and_bboxes_index}-{0}.html')
     bboxes_file_path = os.path.join(bboxes_directory, f'bboxes-{html_and_bboxes_index}.json')
     # Save HTML content to pages folder
-    with open(html_file_path, 'w') as f:
-        f.write(driver.page_source)
+    if page_store is not None:
+        page_store.put(os.path.basename(html_file_path), html)
+        # A raw file left by an earlier snapshot would be read instead of the store
+        if os.path.exists(html_file_path):
+            os.remove(html_file_path)
+    else:
+        with open(html_file_path, 'w') as f:
+            f.write(html)
     # Save the bounding boxes to bboxes folder
     with open(bboxes_file_path, 'w') as f:
         json.dump(element_data, f)
+    return html, element_data
+
+def start_settle_monitor(driver):
+    """
+    Prepares `wait_for_settle` for an action on the page, and must be called right before it.
+    Installs the settle monitor in the current document, restarting its quiet periods, and,
+    once per tab, registers it with CDP to run before the scripts of the documents loaded
+    next, so the requests of a page loaded by the action are seen from its start.
+    """
+    handle = driver.current_window_handle
+    if _settle_monitor_tabs.get(driver) != handle and hasattr(driver, "execute_cdp_cmd"):
+        driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {"source": SETTLE_INSTALL_SCRIPT})
+        _settle_monitor_tabs[driver] = handle
+    driver.execute_script(SETTLE_START_SCRIPT)
+
+
+def is_page_settled(status, strategies, quiet_period):
+    # The old document is still shown until the navigation started by the action commits
+    if status.get('navigating'):
+        return False
+    for strategy in strategies:
+        if strategy == "ready_state":
+            if status['readyState'] != "complete":
+                return False
+        elif strategy == "network_idle":
+            if status['pending'] > 0 or status['sinceNetwork'] < quiet_period:
+                return False
+        elif strategy == "dom_quiescence":
+            if status['sinceMutation'] < quiet_period:
+                return False
+        else:
+            raise ValueError(f"Invalid settle strategy '{strategy}'. Must be one of: {SETTLE_STRATEGIES}")
+    return True
+
+
+def wait_for_settle(driver, strategies=SETTLE_STRATEGIES, timeout=10.0, quiet_period=0.3, poll_interval=0.05, min_wait=0.0):
+    """
+    Waits until the page is stable according to every strategy in `strategies`:
+    - "ready_state": document.readyState is "complete"
+    - "network_idle": no fetch/XHR in flight and no request finished for `quiet_period` seconds
+    - "dom_quiescence": no DOM mutation for `quiet_period` seconds
+    It returns as soon as the page is settled, or after `timeout` seconds, and always waits at
+    least `min_wait` seconds (e.g. to let a navigation start). Call `start_settle_monitor` before
+    the action, otherwise the requests started by the action are missed and a navigation can be
+    reported as settled on the old document. Returns the time waited in seconds.
+    """
+    start = time.perf_counter()
+    if min_wait > 0:
+        time.sleep(min_wait)
+
+    while True:
+        elapsed = time.perf_counter() - start
+        try:
+            status = driver.execute_script(SETTLE_MONITOR_SCRIPT)
+        except WebDriverException:
+            # The document can be swapped out while we poll it during a navigation
+            status = None
+
+        if status is not None and is_page_settled(status, strategies, quiet_period):
+            return elapsed
+
+        if elapsed >= timeout:
+            logging.warning(f"Page did not settle ({', '.join(strategies)}) within {timeout}s")
+            return elapsed
+
+        time.sleep(poll_interval)
+
 
 def get_element_rect_and_attr(driver, uid):
     # Obtain the bounding rectangle of the target element                
@@ -60,14 +555,5 @@ def get_element_rect_and_attr(driver, uid):
             attrs_dict[attr] = target_element.get_attribute(attr)
     attrs_dict["data-webtasks-id"] = uid
     rect = target_element.rect
-    bbox = {
-        "x": rect['x'],
-        "y": rect['y'],
-        "width": rect['width'],
-        "height": rect['height'],
-        "top": rect['y'],
-        "right": rect['x'] + rect['width'],
-        "bottom": rect['y'] + rect['height'],
-        "left": rect['x']
-    }
+    bbox = format_bbox(rect['x'], rect['y'], rect['width'], rect['height'])
     return target_element, attrs_dict, bbox
@@ -0,0 +1,101 @@
+import asyncio
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import requests
+from requests.adapters import HTTPAdapter
+
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# Shared by every client, so the DMR and action endpoints can be queried at the same time
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="endpoint")
+
+
+class EndpointError(Exception):
+    pass
+
+
+class EndpointClient:
+    """
+    Client for a single JSON inference endpoint. Connections are kept alive in a pool and
+    reused across turns, every request is bounded by `timeout` (a float, or a tuple of
+    connect and read timeouts in seconds), and connection errors, timeouts and the status
+    codes in `retry_statuses` are retried up to `max_retries` times with jittered
+    exponential backoff.
+    """
+    def __init__(self, url, headers=None, timeout=(3.05, 60), max_retries=2, backoff=0.5, max_backoff=8.0, pool_size=4, retry_statuses=RETRY_STATUS_CODES):
+        self.url = url
+        self.headers = headers or {}
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retry_statuses = tuple(retry_statuses)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def get_backoff(self, attempt, retry_after=None):
+        if retry_after is not None:
+            try:
+                return min(float(retry_after), self.max_backoff)
+            except ValueError:
+                pass
+        # "Full jitter": spreads the retries of concurrent sessions instead of synchronizing them
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def request(self, payload, timeout=None, stream=False):
+        """
+        Posts `payload` as JSON and returns the response once its status is successful.
+        Raises EndpointError when the endpoint still fails after all the retries.
+        """
+        if self.url is None:
+            raise EndpointError("The endpoint URL is not set")
+
+        timeout = self.timeout if timeout is None else timeout
+        for attempt in range(self.max_retries + 1):
+            is_last_attempt = attempt == self.max_retries
+            try:
+                response = self.session.post(self.url, headers=self.headers, json=payload, timeout=timeout, stream=stream)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if is_last_attempt:
+                    raise EndpointError(f"Request to {self.url} failed after {attempt + 1} attempts: {e}") from e
+                delay = self.get_backoff(attempt)
+                logging.warning(f"Request to {self.url} failed ({e}), retrying in {delay:.2f}s")
+                time.sleep(delay)
+                continue
+
+            if response.status_code in self.retry_statuses and not is_last_attempt:
+                delay = self.get_backoff(attempt, response.headers.get("Retry-After"))
+                logging.warning(f"Request to {self.url} returned {response.status_code}, retrying in {delay:.2f}s")
+                response.close()
+                time.sleep(delay)
+                continue
+
+            if not response.ok:
+                response.close()
+                raise EndpointError(f"Request to {self.url} returned {response.status_code} after {attempt + 1} attempts")
+
+            return response
+
+    def post(self, payload, timeout=None):
+        response = self.request(payload, timeout=timeout)
+        return response.json()
+
+    def submit(self, payload, timeout=None):
+        """
+        Same as `post`, but runs in the background and returns a concurrent.futures.Future.
+        """
+        return _executor.submit(self.post, payload, timeout)
+
+    async def apost(self, payload, timeout=None):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_executor, partial(self.post, payload, timeout))
+
+    def close(self):
+        self.session.close()
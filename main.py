@@ -1,5 +1,6 @@
 import os
 import re
+import functools
 import datetime as dt
 import weblinx as wl
 import time
@@ -11,38 +12,67 @@ from typing import Dict, Any
 import replay_helper
 import model_helper
 import browser_helper
+import trace_helper
 
 # Constants
 DATA_DIR = './live_data'
 VIEWPORT_WIDTH = 1600
 VIEWPORT_HEIGHT = 900
-SCREENSHOT_PATH = './screenshot.png'
+# Screenshots are kept in memory, downscaled to the width of the page view
+SCREENSHOT_FORMAT = os.getenv("SCREENSHOT_FORMAT", "jpeg")
+SCREENSHOT_QUALITY = int(os.getenv("SCREENSHOT_QUALITY", 80))
+SCREENSHOT_MAX_WIDTH = int(os.getenv("SCREENSHOT_MAX_WIDTH", 1000))
+# Store the snapshots compressed and deduplicated by content (weblinx.utils.store) instead of raw files
+PAGE_STORE = os.getenv("PAGE_STORE", "0") == "1"
+# Also write the per-turn traces in the Chrome trace event format (chrome://tracing, Perfetto)
+CHROME_TRACE = os.getenv("CHROME_TRACE", "0") == "1"
+BROWSER_POOL_SIZE = int(os.getenv("BROWSER_POOL_SIZE", 2))
+BROWSER_POOL_MAX_SIZE = int(os.getenv("BROWSER_POOL_MAX_SIZE", 16))
+BROWSER_LEASE_TIMEOUT = float(os.getenv("BROWSER_LEASE_TIMEOUT", 60))
+BROWSER_LEASE_IDLE_TIMEOUT = float(os.getenv("BROWSER_LEASE_IDLE_TIMEOUT", 900))
+KEEP_SESSION_DATA = os.getenv("KEEP_SESSION_DATA", "0") == "1"
+# Actions that can navigate wait for the whole page to settle, in-page actions only for the DOM
+SETTLE_NAVIGATION = dict(strategies=("ready_state", "network_idle", "dom_quiescence"), timeout=10.0, quiet_period=0.3, min_wait=0.1)
+SETTLE_IN_PAGE = dict(strategies=("dom_quiescence",), timeout=2.0, quiet_period=0.1, min_wait=0.05)
 
 logging.basicConfig(level=logging.WARNING)
 
-def initialize_session_state():
-    if 'initialized' not in st.session_state:
-        os.makedirs(DATA_DIR, exist_ok=True)
-        os.makedirs(os.path.join(DATA_DIR, 'pages'), exist_ok=True)
-        os.makedirs(os.path.join(DATA_DIR, 'bboxes'), exist_ok=True)
-
-        for folder in ['pages', 'bboxes']:
-            full_path = os.path.join(DATA_DIR, folder)
-            for file in os.listdir(full_path):
-                os.remove(os.path.join(full_path, file))
+@st.cache_resource
+def get_browser_pool():
+    # Shared by all the sessions of the server
+    return browser_helper.BrowserPool(VIEWPORT_WIDTH, VIEWPORT_HEIGHT, size=BROWSER_POOL_SIZE, max_size=BROWSER_POOL_MAX_SIZE, lease_ttl=BROWSER_LEASE_IDLE_TIMEOUT)
 
-        if os.path.exists(SCREENSHOT_PATH):
-            os.remove(SCREENSHOT_PATH)
+def expire_session(lease_state, data_dir):
+    # Called by the pool, from another session, once the browser of an abandoned session
+    # (e.g. a closed tab) is reclaimed
+    lease_state["expired"] = True
+    if not KEEP_SESSION_DATA:
+        replay_helper.remove_session_dir(data_dir)
 
+def initialize_session_state():
+    if 'initialized' in st.session_state and st.session_state.lease_state["expired"]:
+        # The browser was given to another session: start a new session
+        del st.session_state.initialized
+        st.session_state.session_expired = True
+    if 'initialized' in st.session_state:
+        get_browser_pool().touch(st.session_state.driver)
+    else:
+        st.session_state.data_dir = replay_helper.create_session_dir(DATA_DIR)
+        st.session_state.tracer = trace_helper.TurnTracer(st.session_state.data_dir, chrome_trace=CHROME_TRACE)
+        st.session_state.page_store = wl.utils.store.PageStore(os.path.join(st.session_state.data_dir, 'pages')) if PAGE_STORE else None
         st.session_state.initialized = True
+        for key in ['dmr_prefetch', 'screenshot', 'screenshot_hash', 'last_turn_trace']:
+            st.session_state.pop(key, None)
         st.session_state.messages = []
         st.session_state.turn_index = -1
         st.session_state.html_and_bboxes_index = 0
         st.session_state.initial_timestamp = dt.datetime.now().strftime("%H:%M:%S")
-        st.session_state.driver = browser_helper.initialize_browser(VIEWPORT_WIDTH, VIEWPORT_HEIGHT)
+        st.session_state.lease_state = lease_state = {"expired": False}
+        on_expire = functools.partial(expire_session, lease_state, st.session_state.data_dir)
+        st.session_state.driver = get_browser_pool().lease(timeout=BROWSER_LEASE_TIMEOUT, on_expire=on_expire)
         st.session_state.replay_data = {"data": []}
-        with open(os.path.join(DATA_DIR, 'replay.json'), 'w') as f:
-            f.write('{"data": []}\n')
+        replay_helper.reset_replay(get_replay_file_path())
+        st.session_state.replay = replay_helper.LiveReplay(st.session_state.replay_data, demo_name=st.session_state.data_dir, base_dir='.')
         st.session_state.format_intent_input, st.session_state.format_intent, st.session_state.build_prompt_records_fn, st.session_state.tokenizer, st.session_state.template_tokenizer = model_helper.load_formatters()
 
 def handle_user_input(user_chat: str):
@@ -55,8 +85,15 @@ def handle_quit():
     replay_helper.add_temporary_action_to_replay(get_replay_file_path(), None, VIEWPORT_HEIGHT, VIEWPORT_WIDTH, st.session_state.initial_timestamp, st.session_state.replay_data)
     st.session_state.turn_index += 1
     replay_helper.add_say_to_replay(get_replay_file_path(), "instructor", "That's all", st.session_state.initial_timestamp, st.session_state.replay_data)
-    st.session_state.driver.quit()
+    get_browser_pool().release(st.session_state.driver)
+    # The replay is only compacted when it is kept, the session directory is removed otherwise
+    if KEEP_SESSION_DATA:
+        replay_helper.compact_replay(get_replay_file_path())
+    else:
+        replay_helper.remove_session_dir(st.session_state.data_dir)
     st.session_state.messages = []
+    # The next message starts a new session, with a new browser and data directory
+    del st.session_state.initialized
 
 def handle_new_message(user_chat: str):
     st.session_state.messages.append({"role": "user", "content": user_chat})
@@ -69,17 +106,24 @@ def handle_continue():
     process_model_response()
 
 def process_model_response():
+    tracer = st.session_state.tracer
+    tracer.start_turn(st.session_state.turn_index + 1)
     state = get_current_state()
-    replay_helper.add_temporary_action_to_replay(get_replay_file_path(), state, VIEWPORT_WIDTH, VIEWPORT_HEIGHT, st.session_state.initial_timestamp, st.session_state.replay_data)
+    with trace("replay"):
+        replay_helper.add_temporary_action_to_replay(get_replay_file_path(), state, VIEWPORT_WIDTH, VIEWPORT_HEIGHT, st.session_state.initial_timestamp, st.session_state.replay_data)
     st.session_state.turn_index += 1
 
-    demo = wl.Demonstration(DATA_DIR, base_dir='.')
-    replay = wl.Replay.from_demonstration(demo)
+    replay = st.session_state.replay
     current_turn = wl.Turn.from_replay(replay, st.session_state.turn_index)
 
-    answer = model_helper.predict_answer(state, current_turn, replay, st.session_state.format_intent_input, st.session_state.format_intent, st.session_state.build_prompt_records_fn, st.session_state.tokenizer, st.session_state.template_tokenizer)
+    prefetched = st.session_state.pop('dmr_prefetch', None)
+    answer = model_helper.predict_answer(state, current_turn, replay, st.session_state.format_intent_input, st.session_state.format_intent, st.session_state.build_prompt_records_fn, st.session_state.tokenizer, st.session_state.template_tokenizer, prefetched=prefetched, tracer=tracer)
     
     handle_model_action(answer)
+    st.session_state.last_turn_trace = tracer.end_turn()
+    # A turn can take long: renew the lease from its end, not its start
+    get_browser_pool().touch(st.session_state.driver)
+    logging.info(trace_helper.format_turn_breakdown(st.session_state.last_turn_trace))
 
 def handle_model_action(answer: str):
     action_handlers = {
@@ -97,89 +141,149 @@ def handle_model_action(answer: str):
 
     if handler:
         handler(answer)
+        if action_type != 'say':
+            prefetch_next_turn()
     else:
         raise ValueError(f"Invalid action: {answer}")
 
 def handle_say_action(answer: str):
     utterance = re.findall('utterance="([^"]*)"', answer)[0]
-    replay_helper.add_say_to_replay(get_replay_file_path(), "navigator", utterance, st.session_state.initial_timestamp, st.session_state.replay_data)
+    with trace("replay"):
+        replay_helper.add_say_to_replay(get_replay_file_path(), "navigator", utterance, st.session_state.initial_timestamp, st.session_state.replay_data)
     st.session_state.messages.append({"role": "assistant", "content": utterance})
 
 def handle_load_action(answer: str):
     url = re.findall('url="([^"]*)"', answer)[0]
-    st.session_state.driver.get(url)
-    time.sleep(2)
-    browser_helper.save_pages_bbox(st.session_state.driver, st.session_state.html_and_bboxes_index, DATA_DIR)
-    replay_helper.add_load_to_replay(get_replay_file_path(), get_current_state(), url, VIEWPORT_WIDTH, VIEWPORT_HEIGHT, st.session_state.initial_timestamp, st.session_state.replay_data)
+    with trace("execute_action"):
+        browser_helper.start_settle_monitor(st.session_state.driver)
+        st.session_state.driver.get(url)
+    wait_for_settle(SETTLE_NAVIGATION)
+    save_snapshot()
+    with trace("replay"):
+        replay_helper.add_load_to_replay(get_replay_file_path(), get_current_state(), url, VIEWPORT_WIDTH, VIEWPORT_HEIGHT, st.session_state.initial_timestamp, st.session_state.replay_data)
     st.session_state.html_and_bboxes_index += 1
-    st.session_state.driver.save_screenshot(SCREENSHOT_PATH)
+    update_screenshot()
     st.session_state.messages.append({"role": "assistant", "content": answer})
 
 def handle_click_action(answer: str):
     uid = re.findall('uid="([^"]*)"', answer)[0]
-    target_element, attrs_dict, bbox = browser_helper.get_element_rect_and_attr(st.session_state.driver, uid)
-    replay_helper.add_click_to_replay(get_replay_file_path(), get_current_state(), st.session_state.driver.current_url, VIEWPORT_WIDTH, VIEWPORT_HEIGHT, st.session_state.initial_timestamp, round(bbox["x"]), round(bbox["y"]), attrs_dict, bbox, target_element.tag_name, st.session_state.replay_data)
-    target_element.click()
-    time.sleep(2)
-    browser_helper.save_pages_bbox(st.session_state.driver, st.session_state.html_and_bboxes_index, DATA_DIR)
+    with trace("locate_element"):
+        target_element, attrs_dict, bbox = browser_helper.get_element_rect_and_attr(st.session_state.driver, uid)
+    with trace("replay"):
+        replay_helper.add_click_to_replay(get_replay_file_path(), get_current_state(), st.session_state.driver.current_url, VIEWPORT_WIDTH, VIEWPORT_HEIGHT, st.session_state.initial_timestamp, round(bbox["x"]), round(bbox["y"]), attrs_dict, bbox, target_element.tag_name, st.session_state.replay_data)
+    with trace("execute_action"):
+        browser_helper.start_settle_monitor(st.session_state.driver)
+        target_element.click()
+    wait_for_settle(SETTLE_NAVIGATION)
+    save_snapshot()
     st.session_state.html_and_bboxes_index += 1
-    st.session_state.driver.save_screenshot(SCREENSHOT_PATH)
+    update_screenshot()
     st.session_state.messages.append({"role": "assistant", "content": answer})
 
 def handle_text_input_action(answer: str):
     text, uid = re.findall('text="([^"]*)"', answer)[0], re.findall('uid="([^"]*)"', answer)[0]
-    target_element, attrs_dict, bbox = browser_helper.get_element_rect_and_attr(st.session_state.driver, uid)
-    replay_helper.add_textInput_to_replay(get_replay_file_path(), get_current_state(), st.session_state.driver.current_url, VIEWPORT_WIDTH, VIEWPORT_HEIGHT, st.session_state.initial_timestamp, round(bbox["x"]), round(bbox["y"]), attrs_dict, bbox, target_element.tag_name, text, st.session_state.replay_data)
-    target_element.send_keys(text)
-    time.sleep(2)
-    browser_helper.save_pages_bbox(st.session_state.driver, st.session_state.html_and_bboxes_index, DATA_DIR)
+    with trace("locate_element"):
+        target_element, attrs_dict, bbox = browser_helper.get_element_rect_and_attr(st.session_state.driver, uid)
+    with trace("replay"):
+        replay_helper.add_textInput_to_replay(get_replay_file_path(), get_current_state(), st.session_state.driver.current_url, VIEWPORT_WIDTH, VIEWPORT_HEIGHT, st.session_state.initial_timestamp, round(bbox["x"]), round(bbox["y"]), attrs_dict, bbox, target_element.tag_name, text, st.session_state.replay_data)
+    with trace("execute_action"):
+        browser_helper.start_settle_monitor(st.session_state.driver)
+        target_element.send_keys(text)
+    wait_for_settle(SETTLE_IN_PAGE)
+    save_snapshot()
     st.session_state.html_and_bboxes_index += 1
-    st.session_state.driver.save_screenshot(SCREENSHOT_PATH)
+    update_screenshot()
     st.session_state.messages.append({"role": "assistant", "content": answer})
 
 def handle_scroll_action(answer: str):
     scrollX, scrollY = re.findall('x="([^"]*)"', answer)[0], re.findall('y="([^"]*)"', answer)[0]
-    st.session_state.driver.execute_script(f"window.scrollTo({scrollX}, {scrollY});")
-    time.sleep(2)
-    replay_helper.add_scroll_to_replay(get_replay_file_path(), get_current_state(), st.session_state.driver.current_url, VIEWPORT_WIDTH, VIEWPORT_HEIGHT, st.session_state.initial_timestamp, scrollX, scrollY, st.session_state.replay_data)
-    browser_helper.save_pages_bbox(st.session_state.driver, st.session_state.html_and_bboxes_index, DATA_DIR)
+    with trace("execute_action"):
+        browser_helper.start_settle_monitor(st.session_state.driver)
+        st.session_state.driver.execute_script(f"window.scrollTo({scrollX}, {scrollY});")
+    wait_for_settle(SETTLE_IN_PAGE)
+    with trace("replay"):
+        replay_helper.add_scroll_to_replay(get_replay_file_path(), get_current_state(), st.session_state.driver.current_url, VIEWPORT_WIDTH, VIEWPORT_HEIGHT, st.session_state.initial_timestamp, scrollX, scrollY, st.session_state.replay_data)
+    save_snapshot()
     st.session_state.html_and_bboxes_index += 1
-    st.session_state.driver.save_screenshot(SCREENSHOT_PATH)
+    update_screenshot()
     st.session_state.messages.append({"role": "assistant", "content": answer})
 
 def handle_submit_action(answer: str):
     uid = re.findall('uid="([^"]*)"', answer)[0]
-    target_element, attrs_dict, bbox = browser_helper.get_element_rect_and_attr(st.session_state.driver, uid)
-    replay_helper.add_submit_to_replay(get_replay_file_path(), get_current_state(), st.session_state.driver.current_url, VIEWPORT_WIDTH, VIEWPORT_HEIGHT, st.session_state.initial_timestamp, round(bbox["x"]), round(bbox["y"]), attrs_dict, bbox, target_element.tag_name, st.session_state.replay_data)
-    target_element.submit()
-    time.sleep(2)
-    browser_helper.save_pages_bbox(st.session_state.driver, st.session_state.html_and_bboxes_index, DATA_DIR)
+    with trace("locate_element"):
+        target_element, attrs_dict, bbox = browser_helper.get_element_rect_and_attr(st.session_state.driver, uid)
+    with trace("replay"):
+        replay_helper.add_submit_to_replay(get_replay_file_path(), get_current_state(), st.session_state.driver.current_url, VIEWPORT_WIDTH, VIEWPORT_HEIGHT, st.session_state.initial_timestamp, round(bbox["x"]), round(bbox["y"]), attrs_dict, bbox, target_element.tag_name, st.session_state.replay_data)
+    with trace("execute_action"):
+        browser_helper.start_settle_monitor(st.session_state.driver)
+        target_element.submit()
+    wait_for_settle(SETTLE_NAVIGATION)
+    save_snapshot()
     st.session_state.html_and_bboxes_index += 1
-    st.session_state.driver.save_screenshot(SCREENSHOT_PATH)
+    update_screenshot()
     st.session_state.messages.append({"role": "assistant", "content": answer})
 
 def handle_change_action(answer: str):
     value, uid = re.findall('value="([^"]*)"', answer)[0], re.findall('uid="([^"]*)"', answer)[0]
-    target_element, attrs_dict, bbox = browser_helper.get_element_rect_and_attr(st.session_state.driver, uid)
-    replay_helper.add_change_to_replay(get_replay_file_path(), get_current_state(), st.session_state.driver.current_url, VIEWPORT_WIDTH, VIEWPORT_HEIGHT, st.session_state.initial_timestamp, round(bbox["x"]), round(bbox["y"]), attrs_dict, bbox, target_element.tag_name, value, st.session_state.replay_data)
-    target_element.send_keys(value)
-    time.sleep(2)
-    browser_helper.save_pages_bbox(st.session_state.driver, st.session_state.html_and_bboxes_index, DATA_DIR)
+    with trace("locate_element"):
+        target_element, attrs_dict, bbox = browser_helper.get_element_rect_and_attr(st.session_state.driver, uid)
+    with trace("replay"):
+        replay_helper.add_change_to_replay(get_replay_file_path(), get_current_state(), st.session_state.driver.current_url, VIEWPORT_WIDTH, VIEWPORT_HEIGHT, st.session_state.initial_timestamp, round(bbox["x"]), round(bbox["y"]), attrs_dict, bbox, target_element.tag_name, value, st.session_state.replay_data)
+    with trace("execute_action"):
+        browser_helper.start_settle_monitor(st.session_state.driver)
+        target_element.send_keys(value)
+    wait_for_settle(SETTLE_IN_PAGE)
+    save_snapshot()
     st.session_state.html_and_bboxes_index += 1
-    st.session_state.driver.save_screenshot(SCREENSHOT_PATH)
+    update_screenshot()
     st.session_state.messages.append({"role": "assistant", "content": answer})
 
+def prefetch_next_turn():
+    # Start scoring the candidates of the next turn as soon as the new page is saved, so the
+    # DMR request is (often) done by the time the user clicks Continue
+    state = get_current_state()
+    temporary_action = replay_helper.build_temporary_action(state, VIEWPORT_WIDTH, VIEWPORT_HEIGHT, st.session_state.initial_timestamp)
+    pending_replay = st.session_state.replay.with_pending_turn(temporary_action)
+    next_turn = wl.Turn.from_replay(pending_replay, len(pending_replay) - 1)
+    st.session_state.dmr_prefetch = model_helper.prefetch_candidates(state, next_turn, pending_replay, st.session_state.format_intent_input, tracer=st.session_state.tracer.for_turn(next_turn.index))
+
+def trace(stage):
+    return st.session_state.tracer.stage(stage)
+
+def wait_for_settle(settle_config):
+    with trace("settle"):
+        settle_time = browser_helper.wait_for_settle(st.session_state.driver, **settle_config)
+    st.session_state.last_settle_time = settle_time
+    logging.info(f"Page settled in {settle_time:.2f}s")
+    return settle_time
+
+def update_screenshot():
+    with trace("screenshot"):
+        image, digest = browser_helper.capture_screenshot(st.session_state.driver, SCREENSHOT_FORMAT, SCREENSHOT_QUALITY, SCREENSHOT_MAX_WIDTH, st.session_state.get('screenshot_hash'))
+    if image is not None:
+        st.session_state.screenshot = image
+        st.session_state.screenshot_hash = digest
+
+def save_snapshot():
+    index = st.session_state.html_and_bboxes_index
+    with trace("snapshot"):
+        html, bboxes = browser_helper.save_pages_bbox(st.session_state.driver, index, st.session_state.data_dir, page_store=st.session_state.page_store)
+    st.session_state.replay.add_snapshot(f"page-{index}-{0}.html", html, bboxes)
+
 def get_current_state() -> str:
     return f"page-{st.session_state.html_and_bboxes_index - 1}-{0}.html" if st.session_state.html_and_bboxes_index > 0 else None
 
 def get_replay_file_path() -> str:
-    return os.path.join(DATA_DIR, 'replay.json')
+    return os.path.join(st.session_state.data_dir, 'replay.json')
+
 
 def main():
     st.set_page_config(layout="wide")
     st.title("WebLINX Chatbot")
 
     initialize_session_state()
+    if st.session_state.pop('session_expired', False):
+        st.sidebar.info("The previous session was idle for too long, a new one was started.")
 
     st.sidebar.write("""
     This chatbot can help you navigate the web by performing actions such as clicking buttons, scrolling,
@@ -195,6 +299,10 @@ def main():
         if st.button("Continue"):
             handle_continue()
 
+        if 'last_turn_trace' in st.session_state:
+            with st.expander("Latency breakdown"):
+                st.markdown(trace_helper.format_turn_breakdown(st.session_state.last_turn_trace))
+
     col1, col2 = st.columns([2, 3])
 
     with col1:
@@ -205,8 +313,10 @@ def main():
 
     with col2:
         st.header("Web Page View")
-        if os.path.exists(SCREENSHOT_PATH):
-            st.image(SCREENSHOT_PATH, caption="Current Web Page", use_column_width=True)
+        if 'initialized' in st.session_state and 'screenshot' in st.session_state:
+            st.image(st.session_state.screenshot, caption="Current Web Page", use_column_width=True)
+            if 'last_settle_time' in st.session_state:
+                st.caption(f"Page settled in {st.session_state.last_settle_time:.2f}s after the last action")
         else:
             st.image('microphonecat.png', caption="No Screenshot Available", use_column_width=True)
 
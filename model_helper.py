@@ -1,13 +1,20 @@
-import torch
+# torch, transformers and sentence-transformers are imported when first needed, so the app
+# starts without loading them
+import copy
 from functools import partial
-from transformers import AutoTokenizer
 from weblinx.processing import group_record_to_dict
+from weblinx.processing.dom import parse_html, set_parsed_tree_cache_size
+from weblinx.processing.outputs import has_complete_action
 from weblinx.processing.prompt import build_input_records_from_selected_turns, select_candidates_for_turn
-from modeling.dmr.processing import build_records_for_single_turn, build_formatters
-from modeling.dmr.eval import verify_queries_are_all_the_same, run_model_and_update_groups, get_ranks_from_scores
-from modeling.llama.processing import build_prompt_records_for_llama_truncated, build_formatter_for_multichoice, insert_formatted_chat_into_records
+from modeling.dmr.processing import build_records_for_single_turn, build_formatters, format_turn_for_input, verify_queries_are_all_the_same, get_ranks_from_scores
+from modeling.llama.processing import build_prompt_records_for_llama_truncated, build_prompt_context_for_llama, build_formatter_for_multichoice, insert_formatted_chat_into_records
 import re
-import requests
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http_helper import EndpointClient, EndpointError
+from trace_helper import TurnTracer
 from dotenv import load_dotenv
 import os
 load_dotenv()
@@ -23,18 +30,125 @@ headers_action = {
     "Content-Type": "application/json" 
 }
 
+# (connect, read) timeouts in seconds, generation can take much longer than scoring
+dmr_client = EndpointClient(API_URL_DMR, headers=headers_dmr, timeout=(3.05, float(os.getenv("DMR_TIMEOUT", 30))), max_retries=int(os.getenv("ENDPOINT_MAX_RETRIES", 2)))
+action_client = EndpointClient(API_URL_ACTION, headers=headers_action, timeout=(3.05, float(os.getenv("ACTION_TIMEOUT", 120))), max_retries=int(os.getenv("ENDPOINT_MAX_RETRIES", 2)))
+
+# The page of a turn is not parsed again for the prompt if it did not change since a previous
+# turn (e.g. after a scroll)
+set_parsed_tree_cache_size(int(os.getenv("PARSED_TREE_CACHE_CHARS", 16 * 1024**2)))
+
+# Stream the action model's output and stop at the first complete action
+ACTION_STREAMING = os.getenv("ACTION_STREAMING", "1") == "1"
+ACTION_PATTERN = r'\w+\([^)]*\)'
+
+TOKENIZER_NAME = os.getenv("TOKENIZER_NAME", "McGill-NLP/Llama-2-7b-chat-weblinx")
+# Loaded once per process, each session gets its own copies, see get_tokenizer
+_tokenizers = {}
+_tokenizers_lock = threading.Lock()
+
+# "remote" scores the candidates with the DMR endpoint, "local" with an in-process model
+# that caches the embeddings of the element docs across turns
+DMR_BACKEND = os.getenv("DMR_BACKEND", "remote")
+DMR_MODEL = os.getenv("DMR_MODEL", "McGill-NLP/MiniLM-L6-dmr")
+DMR_CACHE_SIZE = int(os.getenv("DMR_CACHE_SIZE", 50_000))
+_local_dmr_scorer = None
+_local_dmr_scorer_lock = threading.Lock()
+
+# Runs the stages of a turn that do not depend on each other, and the DMR prefetches
+_pipeline_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="turn-pipeline")
+
 def query_dmr(payload):
-	response = requests.post(API_URL_DMR, headers=headers_dmr, json=payload)
-	return response.json()
+	return dmr_client.post(payload)
 
 def query_action(payload):
-    response = requests.post(API_URL_ACTION, headers=headers_action, json=payload)
-    return response.json()
+    return action_client.post(payload)
+
+def iter_stream_events(response):
+    # Server-sent events, as sent by text-generation-inference: one "data: {...}" line per token
+    for line in response.iter_lines(decode_unicode=True):
+        if line and line.startswith("data:"):
+            event = json.loads(line[len("data:"):])
+            if "error" in event:
+                raise EndpointError(f"Generation failed: {event['error']}")
+            yield event
+
+def generate_action_text(payload):
+    """
+    Returns the text generated by the action model for `payload`. With ACTION_STREAMING, the
+    tokens are read as they are generated and the request is cancelled as soon as the text
+    contains a complete action, instead of waiting for max_new_tokens. Endpoints that do not
+    stream answer with the usual JSON, which is used as is.
+    """
+    if not ACTION_STREAMING:
+        return query_action(payload)[0]['generated_text']
+
+    response = action_client.request(dict(payload, stream=True), stream=True)
+    try:
+        if "text/event-stream" not in response.headers.get("Content-Type", ""):
+            return response.json()[0]['generated_text']
+
+        text = ""
+        for event in iter_stream_events(response):
+            if event.get("generated_text") is not None:
+                return event["generated_text"]
+            if event["token"].get("special"):
+                continue
+            text += event["token"]["text"]
+            if has_complete_action(text) and re.search(ACTION_PATTERN, text):
+                break
+        return text
+    finally:
+        # Closing the connection before the end of the stream cancels the generation
+        response.close()
+
+def get_local_dmr_scorer():
+    global _local_dmr_scorer
+    with _local_dmr_scorer_lock:
+        if _local_dmr_scorer is None:
+            import torch
+            from sentence_transformers import SentenceTransformer
+            from modeling.dmr.eval import CachedDocScorer
+            model = SentenceTransformer(DMR_MODEL, device="cuda" if torch.cuda.is_available() else "cpu")
+            _local_dmr_scorer = CachedDocScorer(model, max_size=DMR_CACHE_SIZE)
+    return _local_dmr_scorer
+
+def score_docs(query, docs):
+    if DMR_BACKEND == "local":
+        return get_local_dmr_scorer().score(query, docs)
+    elif DMR_BACKEND == "remote":
+        return query_dmr({
+            "inputs": {
+                "sentences": docs,
+                "source_sentence": query,
+                "parameters": {}
+            }
+        })["similarities"]
+    else:
+        raise ValueError(f"Invalid DMR_BACKEND '{DMR_BACKEND}'. Must be either 'remote' or 'local'")
+
+def get_tokenizer(name, **variant):
+    """
+    Returns a copy of the tokenizer `name`, which is only loaded once per process, with the
+    attributes of `variant` (e.g. padding_side="left") set. The copy has its own backend: calls
+    with truncation or padding change the settings of the backend, so a tokenizer used by
+    several threads at once fails with "Already borrowed" (or truncates with the settings of
+    another call). Each session gets its own tokenizers from `load_formatters`, and must not
+    use them from several threads at once.
+    """
+    with _tokenizers_lock:
+        if name not in _tokenizers:
+            from transformers import AutoTokenizer
+            _tokenizers[name] = AutoTokenizer.from_pretrained(name)
+    # The loaded tokenizer is never used, so it can be copied while other sessions copy it
+    tokenizer = copy.deepcopy(_tokenizers[name])
+    for attr, value in variant.items():
+        setattr(tokenizer, attr, value)
+    return tokenizer
 
 def load_formatters():
-    tokenizer = AutoTokenizer.from_pretrained("McGill-NLP/Llama-2-7b-chat-weblinx", padding_side="left")
-    tokenizer.pad_token = tokenizer.eos_token
-    template_tokenizer = AutoTokenizer.from_pretrained("McGill-NLP/Llama-2-7b-chat-weblinx")
+    template_tokenizer = get_tokenizer(TOKENIZER_NAME)
+    tokenizer = get_tokenizer(TOKENIZER_NAME, padding_side="left", pad_token=template_tokenizer.eos_token)
 
     format_intent_input, _ = build_formatters()
     format_intent = build_formatter_for_multichoice()
@@ -47,8 +161,15 @@ def load_formatters():
     return format_intent_input, format_intent, build_prompt_records_fn, tokenizer, template_tokenizer
 
 
-def predict_answer(state, current_turn, replay, format_intent_input, format_intent, build_prompt_records_fn, tokenizer, template_tokenizer):
-    if state is not None:
+def score_candidates(current_turn, replay, format_intent_input, tracer=None):
+    """
+    Builds the DMR records of the turn, scores them with the DMR endpoint and ranks them.
+    Returns the records grouped by (demo_name, turn_index).
+    """
+    if tracer is None:
+        tracer = TurnTracer()
+
+    with tracer.stage("build_dmr_records"):
         demo_record = build_records_for_single_turn(
             turn=current_turn,
             replay=replay,
@@ -58,35 +179,90 @@ def predict_answer(state, current_turn, replay, format_intent_input, format_inte
             only_allow_valid_uid=False,
             num_utterances=5
         )
-        input_grouped = group_record_to_dict(
-            demo_record, keys=["demo_name", "turn_index"], remove_keys=False
-        )
-        # Verify that queries are all the same within each group
-        error_msg = "Queries are not all the same within each group"
-        assert verify_queries_are_all_the_same(input_grouped), error_msg
-
-        for k, group in input_grouped.items():
-            group = input_grouped[k]
-            query = group[0]["query"]
-            docs = [r["doc"] for r in group]
-
-            scores = query_dmr({
-                "inputs": {
-                    "sentences": docs,
-                    "source_sentence": query,
-                    "parameters": {}
-                }
-            })["similarities"]
-
-            for i, r in enumerate(group):
-                r["score"] = scores[i]
-
-            for group in input_grouped.values():
-                scores = {r["uid"]: r["score"] for r in group}
-                ranks = get_ranks_from_scores(scores)
-                for r in group:
-                    r["rank"] = ranks[r["uid"]]
+    input_grouped = group_record_to_dict(
+        demo_record, keys=["demo_name", "turn_index"], remove_keys=False
+    )
+    # Verify that queries are all the same within each group
+    error_msg = "Queries are not all the same within each group"
+    assert verify_queries_are_all_the_same(input_grouped), error_msg
+
+    for k, group in input_grouped.items():
+        group = input_grouped[k]
+        query = group[0]["query"]
+        docs = [r["doc"] for r in group]
+
+        with tracer.stage("dmr"):
+            scores = score_docs(query, docs)
+
+        for i, r in enumerate(group):
+            r["score"] = scores[i]
+
+        for group in input_grouped.values():
+            scores = {r["uid"]: r["score"] for r in group}
+            ranks = get_ranks_from_scores(scores)
+            for r in group:
+                r["rank"] = ranks[r["uid"]]
+
+    return input_grouped
+
+
+def get_dmr_query(current_turn, replay, format_intent_input):
+    return format_turn_for_input(replay, current_turn, format_intent=format_intent_input, num_utterances=5)
+
+
+def prefetch_candidates(state, current_turn, replay, format_intent_input, tracer=None):
+    """
+    Starts scoring the candidates of a turn that is not in the session yet (see
+    LiveReplay.with_pending_turn), so DMR runs while the user reads the last action.
+    Returns a prefetch that `predict_answer` uses if its turn turns out to be the same.
+    """
+    query = get_dmr_query(current_turn, replay, format_intent_input)
+    future = _pipeline_executor.submit(score_candidates, current_turn, replay, format_intent_input, tracer)
+    return {"key": (state, current_turn.index, query), "future": future}
+
+
+def take_prefetched_candidates(prefetched, state, current_turn, replay, format_intent_input):
+    if prefetched is None:
+        return None
+    key = (state, current_turn.index, get_dmr_query(current_turn, replay, format_intent_input))
+    if prefetched["key"] != key:
+        # The session moved on (e.g. a new user message), the prefetched scores are stale
+        prefetched["future"].cancel()
+        return None
+    return prefetched["future"]
+
+
+def predict_answer(state, current_turn, replay, format_intent_input, format_intent, build_prompt_records_fn, tokenizer, template_tokenizer, prefetched=None, tracer=None):
+    """
+    Predicts the next action. When the turn has a page, the DMR scoring (or the prefetched one,
+    see `prefetch_candidates`), the prompt context and the parsing of the page run concurrently.
+    The stages are recorded in `tracer` (a trace_helper.TurnTracer), if given.
+    """
+    if tracer is None:
+        tracer = TurnTracer()
+
+    def timed(stage, fn, *args, **kwargs):
+        with tracer.stage(stage):
+            return fn(*args, **kwargs)
+
+    if state is not None:
+        dmr_future = take_prefetched_candidates(prefetched, state, current_turn, replay, format_intent_input)
+        is_prefetched = dmr_future is not None
+        tracer.annotate("dmr_prefetched", is_prefetched)
+        if dmr_future is None:
+            dmr_future = _pipeline_executor.submit(score_candidates, current_turn, replay, format_intent_input, tracer)
+        context_future = _pipeline_executor.submit(timed, "prompt_context", build_prompt_context_for_llama, replay=replay, turn=current_turn, format_intent=format_intent, tokenizer=tokenizer)
+        dom_future = _pipeline_executor.submit(timed, "parse_dom", parse_html, current_turn.html, copy=False)
 
+        try:
+            input_grouped = timed("wait_dmr", dmr_future.result)
+        except Exception as e:
+            if not is_prefetched:
+                raise
+            logging.warning(f"Prefetched DMR scoring failed ({e}), scoring again")
+            input_grouped = score_candidates(current_turn, replay, format_intent_input, tracer)
+        if DMR_BACKEND == "local":
+            tracer.annotate("dmr_cache", get_local_dmr_scorer().stats())
         cands_turn = select_candidates_for_turn(
             candidates=input_grouped,
             turn=current_turn,
@@ -97,6 +273,7 @@ def predict_answer(state, current_turn, replay, format_intent_input, format_inte
             turn=current_turn,
             cands_turn=cands_turn,
         )]
+        build_prompt_records_fn = partial(build_prompt_records_fn, prompt_context=context_future.result(), dom_tree=dom_future.result())
     else:
         selected_turns = [dict(
             replay=replay,
@@ -104,25 +281,29 @@ def predict_answer(state, current_turn, replay, format_intent_input, format_inte
             cands_turn=None,
         )]
 
-    input_records = build_input_records_from_selected_turns(
+    input_records = timed(
+        "build_prompt",
+        build_input_records_from_selected_turns,
         selected_turns=selected_turns,
         format_intent=format_intent,
         build_prompt_records_fn=build_prompt_records_fn,
         format_prompt_records_fn=None,
     )
-    insert_formatted_chat_into_records(
+    timed(
+        "chat_template",
+        insert_formatted_chat_into_records,
         records=input_records,
         tokenizer=template_tokenizer,
         include_output_target=False,
     )
-    out = query_action({
+    out = timed("action_model", generate_action_text, {
         "inputs": input_records[0]['text'],
         "parameters": {
             "max_new_tokens": 256,
             "return_full_text": False,
             "pad_token_id": tokenizer.eos_token_id
         }
-    })[0]['generated_text']
+    })
 
-    answer = re.findall('\w+\([^)]*\)', out)[0] 
+    answer = re.findall(ACTION_PATTERN, out)[0] 
     return answer
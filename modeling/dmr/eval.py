@@ -1,5 +1,8 @@
+from functools import partial
 import json
 import logging
+import threading
+from collections import OrderedDict
 from pathlib import Path
 from typing import List, Dict, Any
 
@@ -11,10 +14,17 @@ from sentence_transformers import SentenceTransformer
 from sentence_transformers.util import cos_sim, dot_score
 import weblinx as wl
 from weblinx.processing import group_record_to_dict
+from weblinx.utils import hash_str
 from weblinx.utils.recs import ungroup_dict_to_records
 from weblinx.utils.hydra import save_path_to_hydra_logs
+from weblinx.utils.parallel import parallel_map
 
-from .processing import build_records_for_single_demo, build_formatters
+from .processing import (
+    build_records_for_single_demo,
+    build_formatters,
+    get_ranks_from_scores,
+    verify_queries_are_all_the_same,
+)
 
 
 def recall_at_k(input_records, k, label_key="label", rank_key="rank"):
@@ -49,18 +59,6 @@ def mean_reciprocal_rank(input_records, label_key="label", rank_key="rank", k=No
     return mrr
 
 
-def verify_queries_are_all_the_same(grouped_records: dict) -> bool:
-    """
-    Given a dictionary of grouped records, this function verifies that all
-    queries are the same within each group.
-    """
-    for k, v in grouped_records.items():
-        first_query = v[0]["query"]
-        if not all(r["query"] == first_query for r in v):
-            return False
-    return True
-
-
 def run_model_and_update_groups(
     model, input_grouped: Dict[Any, List[dict]], batch_size, sim_method="cos_sim"
 ):
@@ -88,16 +86,108 @@ def run_model_and_update_groups(
             r["score"] = scores[i]
 
 
-def build_target_uids_dict(demos, uid_key="data-webtasks-id"):
+class CachedDocScorer:
+    """
+    Scores docs against a query with a SentenceTransformer model, like
+    `run_model_and_update_groups`, but keeps the doc embeddings in a size-bounded LRU cache
+    keyed by a hash of the doc string. Between consecutive snapshots of a page most element
+    docs are unchanged, so only the query and the new or changed docs need to be encoded.
+    """
+
+    def __init__(self, model, max_size=50_000, batch_size=64, sim_method="cos_sim"):
+        if sim_method == "cos_sim":
+            self.sim_func = cos_sim
+        elif sim_method == "dot_product":
+            self.sim_func = dot_score
+        else:
+            raise ValueError(f"Unknown similarity function: {sim_method}")
+
+        self.model = model
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def encode(self, texts):
+        return self.model.encode(
+            texts,
+            batch_size=self.batch_size,
+            show_progress_bar=False,
+            convert_to_tensor=True,
+        ).cpu()
+
+    def score(self, query, docs) -> List[float]:
+        keys = [hash_str(doc) for doc in docs]
+
+        with self.lock:
+            vectors = {}
+            missing = {}
+            for key, doc in zip(keys, docs):
+                if key in self.cache:
+                    self.cache.move_to_end(key)
+                    vectors[key] = self.cache[key]
+                    self.hits += 1
+                elif key not in missing:
+                    missing[key] = doc
+                    self.misses += 1
+                else:
+                    # Duplicate doc within the same call, it will be encoded once
+                    self.hits += 1
+
+        # The query is encoded in the same batch as the missing docs
+        encoded = self.encode([query] + list(missing.values()))
+        query_vector = encoded[0]
+        new_vectors = dict(zip(missing.keys(), encoded[1:]))
+        vectors.update(new_vectors)
+
+        with self.lock:
+            self.cache.update(new_vectors)
+            while len(self.cache) > self.max_size:
+                self.cache.popitem(last=False)
+
+        if len(docs) == 0:
+            return []
+
+        doc_vectors = torch.stack([vectors[key] for key in keys])
+        scores = self.sim_func(query_vector, doc_vectors).squeeze().tolist()
+        if isinstance(scores, float):
+            scores = [scores]
+        return scores
+
+    def update_groups(self, input_grouped: Dict[Any, List[dict]]):
+        """
+        Same as `run_model_and_update_groups`, using the cache.
+        """
+        for group in input_grouped.values():
+            scores = self.score(group[0]["query"], [r["doc"] for r in group])
+            for i, r in enumerate(group):
+                r["score"] = scores[i]
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total > 0 else 0.0,
+            "size": len(self.cache),
+        }
+
+
+def build_target_uids_dict(demos, uid_key="data-webtasks-id", num_workers=8):
     """
     Given a list of demonstrations, build a dictionary mapping
     `(demo_name, turn_index) -> uid`. This is used to determine the
     target element for a given demo turn, which labels the element
-    as positive or negative.
+    as positive or negative. The replays are loaded with `num_workers` threads.
     """
+    replays = wl.Replay.from_demonstrations(
+        demos, num_workers=num_workers, progress=True
+    )
     target_uids_dict = {}
-    for demo in tqdm(demos, desc="Creating dict of target uids"):
-        for turn in wl.Replay.from_demonstration(demo):
+    for demo, replay in zip(demos, replays):
+        for turn in replay:
             if turn.element is None or "attributes" not in turn.element:
                 continue
             if uid_key not in turn.element["attributes"]:
@@ -109,17 +199,6 @@ def build_target_uids_dict(demos, uid_key="data-webtasks-id"):
     return target_uids_dict
 
 
-def get_ranks_from_scores(scores: Dict[Any, float], starts_at=1) -> Dict[Any, int]:
-    """
-    Given a dictionary of key -> scores, return a dictionary of key -> ranks.
-    """
-    # Get sorted keys
-    keys = sorted(scores.keys(), key=lambda k: scores[k], reverse=True)
-    ranks = {k: i + starts_at for i, k in enumerate(keys)}
-
-    return ranks
-
-
 @hydra.main(version_base=None, config_path="conf", config_name="config")
 def main(cfg):
     torch.manual_seed(cfg.seed)
@@ -148,15 +227,23 @@ def main(cfg):
     format_intent_input, _ = build_formatters()
     input_records: List[dict] = []
     logging.info(f"Number of demos: {len(demos)}. Starting building records.")
-    for demo in tqdm(demos, desc="Building input records"):
-        demo_records = build_records_for_single_demo(
-            demo=demo,
+    # Parsing the pages is CPU-bound, so the demos are processed in a pool of processes
+    records_by_demo = parallel_map(
+        partial(
+            build_records_for_single_demo,
             format_intent_input=format_intent_input,
             max_neg_per_turn=None,
             # For eval, we want to include all elements in the demo
             # not just the ones with valid uids
             only_allow_valid_uid=False,
-        )
+        ),
+        demos,
+        num_workers=cfg.data.num_workers,
+        use_processes=True,
+        progress=True,
+        desc="Building input records",
+    )
+    for demo_records in records_by_demo:
         input_records.extend(demo_records)
     logging.info(f"Completed. Number of input records: {len(input_records)}")
 
@@ -1,13 +1,16 @@
 from collections import defaultdict
 from copy import deepcopy
 import random
+import re
 from typing import Any, Dict, List
 from functools import partial
 
-import lxml.html
+import lxml.etree
+
 import weblinx as wl
 import weblinx.utils.html as wh
 import weblinx.utils.format as wf
+from weblinx.processing.dom import _LIBXML2_BOOLEAN_ATTRS, parse_html
 from weblinx.processing.prompt import (
     format_prev_turns,
     find_turns_with_instructor_chat,
@@ -157,11 +160,13 @@ def build_formatters():
     return format_intent_input, format_intent_out
 
 
-def turn_has_valid_uid(turn, paths, uid_key="data-webtasks-id"):
+def turn_has_valid_uid(turn, paths=None, uid_key="data-webtasks-id", uids=None):
     """
-    Given a turn an lxml tree, return True if the turn's uid is in the tree.
+    Given a turn an lxml tree, return True if the turn's uid is in the tree. The uids of the
+    tree are taken from the elements in `paths`, or given directly as `uids`.
     """
-    uids = [p.attrib[uid_key] for p in paths]
+    if uids is None:
+        uids = [p.attrib[uid_key] for p in paths]
     if turn.element is None or uid_key not in turn.element["attributes"]:
         return False
 
@@ -237,24 +242,39 @@ def represent_element_as_dict(
     - attributes: the attributes of the element, truncated to `max_attr_length`
     - children: the children of the element, truncated to `max_attr_length`
     """
-    # Get the tag name
-    tag = element.tag
-    xpath = root_tree.getpath(element)
-    children = element.getchildren()
-    text = element.text if element.text is not None else ""
+    element_dict = _represent_element(
+        element, bbox, max_text_length, max_attr_length, max_child_depth
+    )
+    element_dict["xpath"] = root_tree.getpath(element)
+
+    return element_dict
+
+
+def _represent_element(element, bbox, max_text_length, max_attr_length, max_child_depth):
+    # represent_element_as_dict without the xpath, which is left to the caller
+    children = element.getchildren()[:max_child_depth]
+    return _format_element(
+        element.tag,
+        element.text if element.text is not None else "",
+        element.attrib.items(),
+        # Comments and processing instructions count as children, but have no tag
+        [c.tag if isinstance(c.tag, str) else None for c in children],
+        bbox,
+        max_text_length,
+        max_attr_length,
+    )
 
+
+def _format_element(tag, text, attributes, child_tags, bbox, max_text_length, max_attr_length):
     # Shorten the text and attributes
     text = shorten(text, max_text_length)
-    attrs = {k: shorten(v, max_attr_length) for k, v in element.attrib.items()}
+    attrs = {k: shorten(v, max_attr_length) for k, v in attributes}
 
     # Sort the attributes by length
     attrs = dict(sorted(attrs.items(), key=lambda x: len(x[1])))
 
-    # Truncate the children
-    children = children[:max_child_depth]
-
     # Format the children
-    children_str = " ".join([c.tag for c in children if isinstance(c.tag, str)])
+    children_str = " ".join([t for t in child_tags if t is not None])
     children_str = shorten(children_str, max_attr_length)
 
     # Format the attributes
@@ -268,7 +288,7 @@ def represent_element_as_dict(
     # format as a dict
     element_dict = {
         "tag": tag,
-        "xpath": xpath,
+        "xpath": None,
         "text": text,
         "bbox": bbox_str,
         "attributes": attrs_str,
@@ -278,6 +298,231 @@ def represent_element_as_dict(
     return element_dict
 
 
+# As lxml.html.fromstring, which parses anything else as a fragment
+_is_full_html = re.compile(r"^\s*<(?:html|!doctype)", re.I).match
+
+
+def _extract_elements_as_dicts_from_tree(
+    html, bboxes, uids, uid_key, max_text_length, max_attr_length, max_child_depth
+):
+    root = parse_html(html, copy=False)
+    root_tree = root.getroottree()
+    elements = root.xpath(f"//*[@{uid_key}]")
+    results = [
+        (
+            elem.attrib[uid_key],
+            represent_element_as_dict(
+                elem,
+                bboxes[elem.attrib[uid_key]],
+                root_tree,
+                max_text_length=max_text_length,
+                max_attr_length=max_attr_length,
+                max_child_depth=max_child_depth,
+            ),
+        )
+        for elem in elements
+        if elem.attrib[uid_key] in uids
+    ]
+    return results, {elem.attrib[uid_key] for elem in elements}
+
+
+def _resolve_xpath(node):
+    # A node is (parent node, sibling counts of the parent, tag, index among the siblings
+    # with the same tag); as getpath, the index is only written if there are several
+    steps = []
+    while node is not None:
+        node, counts, tag, index = node
+        steps.append(tag if counts[tag] == 1 else f"{tag}[{index}]")
+    return "/" + "/".join(reversed(steps))
+
+
+# A boolean attribute without a value, e.g. `<input disabled>`, in the source of a start tag
+_bare_boolean_attr = re.compile(
+    r"\s(" + "|".join(sorted(_LIBXML2_BOOLEAN_ATTRS)) + r")(?=[\s/>])(?!\s*=)", re.I
+)
+
+
+def _find_bare_boolean_attrs(html, uid_key, uid):
+    """
+    Returns the names of the boolean attributes written without a value in the start tag of
+    the element `uid`. The tree of libxml2 gives them their name as value, but parser targets
+    receive them as empty, like `disabled=""`. The start tag is found from its uid attribute,
+    quoted as browsers serialize it; if it is not found, no attribute is considered bare.
+    """
+    for quote in "\"'":
+        needle = f"{uid_key}={quote}{uid}{quote}"
+        pos = html.find(needle)
+        while pos != -1:
+            tag_start = html.rfind("<", 0, pos)
+            # In a start tag, rather than in text or a script
+            if tag_start > html.rfind(">", 0, pos):
+                tag = html[tag_start : html.find(">", pos) + 1]
+                return {name.lower() for name in _bare_boolean_attr.findall(tag)}
+            pos = html.find(needle, pos + 1)
+    return set()
+
+
+class _ElementTarget:
+    """
+    The parser target of `extract_elements_as_dicts`: receives the events of libxml2's HTML
+    parser without any tree being built, and represents the elements whose uid is in `uids`
+    from their tag, attributes, text and first children.
+    """
+
+    def __init__(self, html, bboxes, uids, uid_key, max_text_length, max_attr_length, max_child_depth):
+        self.html = html
+        self.bboxes = bboxes
+        self.uids = uids
+        self.uid_key = uid_key
+        self.max_text_length = max_text_length
+        self.max_attr_length = max_attr_length
+        self.max_child_depth = max_child_depth
+        self.all_uids = set()
+        # (uid, dict or None until the end of the element, node)
+        self.represented = []
+        # The sibling counts of the document, then an _OpenElement per open element
+        self.stack = [_OpenElement({}, None, None)]
+
+    def _add_child(self, tag):
+        parent = self.stack[-1]
+        if parent.slot is None:
+            return
+        # The text of an element is the text before its first child, as element.text
+        parent.in_text = False
+        if self.max_child_depth is None or len(parent.child_tags) < self.max_child_depth:
+            parent.child_tags.append(tag)
+
+    def start(self, tag, attrib):
+        self._add_child(tag)
+        parent = self.stack[-1]
+        index = parent.counts[tag] = parent.counts.get(tag, 0) + 1
+        node = (parent.node, parent.counts, tag, index)
+        # The slot of the element in document order, filled at its end
+        slot = None
+        uid = attrib.get(self.uid_key)
+        if uid is not None:
+            self.all_uids.add(uid)
+            if uid in self.uids:
+                slot = len(self.represented)
+                self.represented.append((uid, None, node))
+        opened = _OpenElement({}, node, slot)
+        if slot is not None:
+            opened.tag = tag
+            opened.attributes = list(attrib.items())
+            if any(value == "" and key in _LIBXML2_BOOLEAN_ATTRS for key, value in opened.attributes):
+                bare = _find_bare_boolean_attrs(self.html, self.uid_key, uid)
+                opened.attributes = [
+                    (key, key if value == "" and key in bare else value) for key, value in opened.attributes
+                ]
+        self.stack.append(opened)
+
+    def end(self, tag):
+        opened = self.stack.pop()
+        if opened.slot is not None:
+            uid = self.represented[opened.slot][0]
+            elem_dict = _format_element(
+                opened.tag,
+                "".join(opened.text),
+                opened.attributes,
+                opened.child_tags,
+                self.bboxes[uid],
+                self.max_text_length,
+                self.max_attr_length,
+            )
+            self.represented[opened.slot] = (uid, elem_dict, opened.node)
+
+    def data(self, data):
+        opened = self.stack[-1]
+        if opened.in_text:
+            opened.text.append(data)
+
+    def comment(self, text):
+        self._add_child(None)
+
+    def pi(self, target, data=None):
+        self._add_child(None)
+
+    def close(self):
+        return self.represented, self.all_uids
+
+
+class _OpenElement:
+    __slots__ = ("counts", "node", "slot", "tag", "attributes", "text", "in_text", "child_tags")
+
+    def __init__(self, counts, node, slot):
+        self.counts = counts
+        self.node = node
+        self.slot = slot
+        self.text = []
+        self.in_text = slot is not None
+        self.child_tags = []
+
+
+def extract_elements_as_dicts(
+    html,
+    bboxes,
+    uids=None,
+    uid_key="data-webtasks-id",
+    max_text_length=200,
+    max_attr_length=100,
+    max_child_depth=2,
+):
+    """
+    Represents the elements of `html` whose uid is in `uids` as `represent_element_as_dict`
+    does, in one pass over the events of lxml's HTML parser, sent to a parser target: no tree
+    is built, only the elements that are open and the represented ones are kept. The xpaths
+    are built from a stack of sibling counts, and resolved once the page is parsed, instead of
+    with an xpath query and a getpath per element.
+
+    Parameters
+    ----------
+    html : str
+        The HTML of the page, a full document (starting with `<html` or a doctype).
+
+    bboxes : dict
+        The bounding boxes of the elements, by uid.
+
+    uids : set, optional
+        The uids of the elements to represent, e.g. the keys of the filtered bounding boxes.
+        Defaults to None, for every element with a uid and a bounding box.
+
+    Returns
+    -------
+    list of (str, dict)
+        The uid and the dict of each element represented, in document order.
+
+    set
+        The uids of all the elements of the page.
+
+    Note
+    ----
+    The result is the same as `represent_element_as_dict` on the tree of
+    `parse_html(html)`. Fragments, which lxml.html.fromstring wraps in other elements, are
+    parsed that way instead.
+    """
+    if uids is None:
+        uids = bboxes.keys()
+
+    if not _is_full_html(html):
+        return _extract_elements_as_dicts_from_tree(
+            html, bboxes, uids, uid_key, max_text_length, max_attr_length, max_child_depth
+        )
+
+    target = _ElementTarget(html, bboxes, uids, uid_key, max_text_length, max_attr_length, max_child_depth)
+    # The page is fed at once: libxml2's push parser misses the end tag of a script, style or
+    # textarea split between two chunks, and takes the rest of the page as its text
+    parser = lxml.etree.HTMLParser(target=target)
+    parser.feed(html)
+    represented, all_uids = parser.close()
+
+    results = []
+    for uid, elem_dict, node in represented:
+        elem_dict["xpath"] = _resolve_xpath(node)
+        results.append((uid, elem_dict))
+
+    return results, all_uids
+
+
 def convert_elem_dict_to_str_legacy(elem_dict: dict):
     """
     Convert an element dictionary to a string.
@@ -320,12 +565,12 @@ def build_records_for_single_turn(
         viewport_height=turn.viewport_height,
         viewport_width=turn.viewport_width,
     )
-    root = lxml.html.fromstring(turn.html)
-    root_tree = root.getroottree()
-    elements = root.xpath(f"//*[@{uid_key}]")
-    elements_filt = [p for p in elements if p.attrib[uid_key] in bboxes_filt]
+    # The elements in the filtered bboxes, represented while the page is parsed
+    elements_filt, page_uids = extract_elements_as_dicts(
+        turn.html, turn.bboxes, uids=bboxes_filt, uid_key=uid_key
+    )
 
-    has_valid_uid = turn_has_valid_uid(turn, paths=elements, uid_key=uid_key)
+    has_valid_uid = turn_has_valid_uid(turn, uid_key=uid_key, uids=page_uids)
     if only_allow_valid_uid and not has_valid_uid:
         return []
 
@@ -337,21 +582,19 @@ def build_records_for_single_turn(
     records_positive = []
     records_negative = []
 
-    for elem in elements_filt:
-        bbox = turn.bboxes[elem.attrib[uid_key]]
-        elem_dict = represent_element_as_dict(elem, bbox, root_tree)
+    for uid, elem_dict in elements_filt:
         elem_str = convert_elem_dict_to_str_legacy(elem_dict)
 
         record = {
             "query": query,
             "doc": elem_str,
-            "uid": elem.attrib[uid_key],
+            "uid": uid,
             "demo_name": turn.demo_name,
             "turn_index": turn.index,
             "elem_dict": elem_dict,
         }
 
-        if elem.attrib[uid_key] == target_uid:
+        if uid == target_uid:
             record["label"] = 1
             records_positive.append(record)
         else:
@@ -414,3 +657,26 @@ def build_records_for_single_demo(
             records_for_demo.extend(recs)
 
     return records_for_demo
+
+
+def verify_queries_are_all_the_same(grouped_records: dict) -> bool:
+    """
+    Given a dictionary of grouped records, this function verifies that all
+    queries are the same within each group.
+    """
+    for k, v in grouped_records.items():
+        first_query = v[0]["query"]
+        if not all(r["query"] == first_query for r in v):
+            return False
+    return True
+
+
+def get_ranks_from_scores(scores: Dict[Any, float], starts_at=1) -> Dict[Any, int]:
+    """
+    Given a dictionary of key -> scores, return a dictionary of key -> ranks.
+    """
+    # Get sorted keys
+    keys = sorted(scores.keys(), key=lambda k: scores[k], reverse=True)
+    ranks = {k: i + starts_at for i, k in enumerate(keys)}
+
+    return ranks
@@ -1,3 +1,4 @@
+from functools import partial
 import logging
 from pathlib import Path
 
@@ -10,6 +11,7 @@ import sentence_transformers.models as st_models
 from sentence_transformers.losses import CosineSimilarityLoss
 import transformers
 from weblinx.utils.hydra import save_path_to_hydra_logs
+from weblinx.utils.parallel import parallel_map
 import weblinx as wl
 
 from .processing import build_records_for_single_demo, build_formatters
@@ -65,18 +67,25 @@ def main(cfg):
     format_intent_input, _ = build_formatters()
     input_records = []
     logging.info(f"Number of demos: {len(demos)}. Starting building records.")
-    for demo in tqdm(demos, desc="Building input records"):
-        input_records.extend(
-            build_records_for_single_demo(
-                demo=demo,
-                format_intent_input=format_intent_input,
-                max_neg_per_turn=cfg.train.max_neg_per_turn,
-                random_state=cfg.seed,
-                # For training, we only want to include elements with valid uids
-                # otherwise, we will be training on a lot of negative examples
-                only_allow_valid_uid=True,
-            )
-        )
+    # Parsing the pages is CPU-bound, so the demos are processed in a pool of processes
+    records_by_demo = parallel_map(
+        partial(
+            build_records_for_single_demo,
+            format_intent_input=format_intent_input,
+            max_neg_per_turn=cfg.train.max_neg_per_turn,
+            random_state=cfg.seed,
+            # For training, we only want to include elements with valid uids
+            # otherwise, we will be training on a lot of negative examples
+            only_allow_valid_uid=True,
+        ),
+        demos,
+        num_workers=cfg.data.num_workers,
+        use_processes=True,
+        progress=True,
+        desc="Building input records",
+    )
+    for demo_records in records_by_demo:
+        input_records.extend(demo_records)
 
     logging.info(f"Number of input records: {len(input_records)}")
 
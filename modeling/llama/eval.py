@@ -48,8 +48,13 @@ def main(cfg):
     tokenizer.pad_token = tokenizer.eos_token
     
     # Data loading
-    demo_names = wl.utils.load_demo_names_in_split(split_path, split=split)
-    demos = [wl.Demonstration(name, base_dir=cfg.data.base_dir) for name in demo_names]
+    demos = wl.load_demos_in_split(
+        split_path,
+        split=split,
+        demo_base_dir=cfg.data.base_dir,
+        num_workers=cfg.data.num_proc,
+        progress=True,
+    )
 
     format_intent = build_formatter_for_multichoice()
     build_prompt_records_fn = partial(
@@ -1,10 +1,8 @@
 from functools import partial
 from typing import Callable
 
-import lxml.html
-
 import weblinx.utils.format as wlf
-from weblinx.processing.dom import clean_and_prune_tree
+from weblinx.processing.dom import clean_and_prune_tree, parse_html
 from weblinx.processing.prompt import (
     find_turns_with_instructor_chat,
     format_candidates,
@@ -114,6 +112,63 @@ def merge_prev_turns(prev_turns_text_list, final_user_message):
     return prev_turns_merged
 
 
+def build_prompt_context_for_llama(
+    replay,
+    turn,
+    format_intent,
+    tokenizer,
+    num_utterances=5,
+    num_prev_turns=5,
+    format_output_dict_fn: Callable = partial(
+        wlf.format_output_dictionary, function_key="intent"
+    ),
+    max_utterance_tokens=40 * 5,
+    max_prev_turns_tokens=50 * 5,
+    allow_iterative_reduction=False,
+):
+    """
+    Builds the parts of the llama prompt that do not depend on the candidates nor on the
+    HTML of the turn: the utterance context and the previous turns. This allows computing
+    them while the candidates are being scored, and passing them to
+    `build_prompt_records_for_llama_truncated` with `prompt_context`.
+
+    Returns
+    -------
+    dict
+        A dictionary with the keys "utterance_context" (str) and "prev_turns_text_list" (list of str).
+    """
+    instructor_chat_turns = find_turns_with_instructor_chat(
+        replay, turn, num_prev_turns=num_prev_turns
+    )
+    utterance_context = format_utterances_truncated(
+        instructor_chat_turns,
+        tokenizer=tokenizer,
+        max_tokens=max_utterance_tokens,
+        num_utterances=num_utterances,
+        format_utterances_fn=format_utterances,
+        allow_iterative_reduction=allow_iterative_reduction,
+    )
+
+    prev_turns_text_list = multi_attempt_format_prev_turns_truncated(
+        replay=replay,
+        turn=turn,
+        format_intent=partial(format_intent, return_as=dict),
+        tokenizer=tokenizer,
+        num_prev_turns=num_prev_turns,
+        turn_sep=None,  # output list
+        max_tokens=max_prev_turns_tokens,
+        max_attempts=5,
+        format_output_dict_fn=format_output_dict_fn,
+        warn_after_attempts=False,
+        allow_iterative_reduction=allow_iterative_reduction,
+    )
+
+    return {
+        "utterance_context": utterance_context,
+        "prev_turns_text_list": prev_turns_text_list,
+    }
+
+
 def build_prompt_records_for_llama_truncated(
     replay,
     turn,
@@ -140,11 +195,18 @@ def build_prompt_records_for_llama_truncated(
     add_unused_len_to_cands=True,
     allow_iterative_reduction=False,
     parser=None,
+    prompt_context=None,
+    dom_tree=None,
 ):
     """
     Parameters
     ----------
     ...
+    prompt_context : dict, optional
+        The output of `build_prompt_context_for_llama` for the same replay, turn and settings.
+        If None, it is computed here.
+    dom_tree : lxml.html.HtmlElement, optional
+        The parsed HTML of the turn. If None, `turn.html` is parsed here. It is not modified.
     allow_iterative_reduction : bool
         This arg is only relevant when truncate_at_center is used behind the scene (e.g. for
         multi_attempt_format_prev_turns_truncated or multi_attempt_truncate_dom_tree). If True,
@@ -163,31 +225,21 @@ def build_prompt_records_for_llama_truncated(
     if final_user_message is None:
         final_user_message = get_final_user_message()
 
-    instructor_chat_turns = find_turns_with_instructor_chat(
-        replay, turn, num_prev_turns=num_prev_turns
-    )
-    utterance_context = format_utterances_truncated(
-        instructor_chat_turns,
-        tokenizer=tokenizer,
-        max_tokens=max_utterance_tokens,
-        num_utterances=num_utterances,
-        format_utterances_fn=format_utterances,
-        allow_iterative_reduction=allow_iterative_reduction,
-    )
-
-    prev_turns_text_list = multi_attempt_format_prev_turns_truncated(
-        replay=replay,
-        turn=turn,
-        format_intent=partial(format_intent, return_as=dict),
-        tokenizer=tokenizer,
-        num_prev_turns=num_prev_turns,
-        turn_sep=None,  # output list
-        max_tokens=max_prev_turns_tokens,
-        max_attempts=5,
-        format_output_dict_fn=format_output_dict_fn,
-        warn_after_attempts=False,
-        allow_iterative_reduction=allow_iterative_reduction,
-    )
+    if prompt_context is None:
+        prompt_context = build_prompt_context_for_llama(
+            replay=replay,
+            turn=turn,
+            format_intent=format_intent,
+            tokenizer=tokenizer,
+            num_utterances=num_utterances,
+            num_prev_turns=num_prev_turns,
+            format_output_dict_fn=format_output_dict_fn,
+            max_utterance_tokens=max_utterance_tokens,
+            max_prev_turns_tokens=max_prev_turns_tokens,
+            allow_iterative_reduction=allow_iterative_reduction,
+        )
+    utterance_context = prompt_context["utterance_context"]
+    prev_turns_text_list = prompt_context["prev_turns_text_list"]
 
     prev_turns_merged = merge_prev_turns_fn(
         prev_turns_text_list=prev_turns_text_list, final_user_message=final_user_message
@@ -202,7 +254,11 @@ def build_prompt_records_for_llama_truncated(
     )
 
     if include_html and turn.html not in ["", None] and cands_turn is not None:
-        dom_tree_raw = lxml.html.fromstring(turn.html, parser=parser)
+        if dom_tree is None:
+            # Shared with the other consumers of the page, clean_and_prune_tree does not modify it
+            dom_tree_raw = parse_html(turn.html, parser=parser, copy=False)
+        else:
+            dom_tree_raw = dom_tree
         dom_tree_pruned = clean_and_prune_tree(dom_tree_raw, cands_turn=cands_turn)
         trunc = multi_attempt_truncate_dom_tree(
             dom_tree=dom_tree_pruned,
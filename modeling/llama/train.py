@@ -40,8 +40,13 @@ def main(cfg):
     model_save_dir.mkdir(exist_ok=True, parents=True)
     logging.info(OmegaConf.to_yaml(cfg))
 
-    demo_names = wl.utils.load_demo_names_in_split(split_path, split=cfg.train.split)
-    demos = [wl.Demonstration(demo_name, base_dir=cfg.data.base_dir) for demo_name in demo_names]
+    demos = wl.load_demos_in_split(
+        split_path,
+        split=cfg.train.split,
+        demo_base_dir=cfg.data.base_dir,
+        num_workers=cfg.data.num_proc,
+        progress=True,
+    )
     candidates = load_candidate_elements(path=cfg.candidates.train_path)
 
     tokenizer = AutoTokenizer.from_pretrained(cfg.model.tokenizer, padding_side="right")
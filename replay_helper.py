@@ -1,9 +1,134 @@
 import json
+import os
+import shutil
+import uuid
 import datetime as dt
 
+import weblinx as wl
 
-def add_temporary_action_to_replay(file_path, state, viewport_width, viewport_height, initial_timestamp, replay_data):
-    text_dict = {
+
+def get_journal_path(file_path):
+    return os.path.join(os.path.dirname(file_path), wl.REPLAY_JOURNAL_FILENAME)
+
+
+def append_to_journal(file_path, op, index, turn):
+    """
+    Persists a single change to the replay by appending one record to the journal next to
+    `file_path` (replay.json), instead of rewriting the whole replay. The record is flushed
+    and fsynced, so a crash loses at most the record being written.
+    """
+    record = {"op": op, "index": index, "turn": turn}
+    with open(get_journal_path(file_path), 'a') as f:
+        f.write(json.dumps(record) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def create_session_dir(root_dir, session_id=None):
+    """
+    Creates the data directory of a live session, `root_dir/<session_id>`, with its pages and
+    bboxes folders, so concurrent sessions never write to the same files. Returns its path.
+    """
+    if session_id is None:
+        session_id = uuid.uuid4().hex
+    session_dir = os.path.join(root_dir, session_id)
+    os.makedirs(os.path.join(session_dir, 'pages'), exist_ok=True)
+    os.makedirs(os.path.join(session_dir, 'bboxes'), exist_ok=True)
+    return session_dir
+
+
+def remove_session_dir(session_dir):
+    """
+    Removes the data directory of a live session created by `create_session_dir`, once the
+    session is over.
+    """
+    shutil.rmtree(session_dir, ignore_errors=True)
+
+
+def reset_replay(file_path):
+    """
+    Starts a new, empty replay at `file_path` and discards any leftover journal.
+    """
+    journal_path = get_journal_path(file_path)
+    if os.path.exists(journal_path):
+        os.remove(journal_path)
+    with open(file_path, 'w') as f:
+        f.write('{"data": []}\n')
+
+
+def compact_replay(file_path):
+    """
+    Folds the journal into `file_path` so that it becomes a regular replay.json, then removes
+    the journal. The new replay is written to a temporary file and atomically moved in place;
+    since journal records target absolute turn indices, replaying a journal that survived a
+    crash right after the move gives the same replay.
+    """
+    journal_path = get_journal_path(file_path)
+    if not os.path.exists(journal_path):
+        return
+
+    with open(file_path) as f:
+        replay_data = json.load(f)
+    records = wl.utils.read_replay_journal(journal_path)
+    wl.utils.apply_replay_journal(replay_data['data'], records)
+
+    tmp_path = file_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(replay_data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, file_path)
+    os.remove(journal_path)
+
+
+class LiveReplay(wl.Replay):
+    """
+    Replay of a live session, kept in memory for the whole session. It shares the `data` list
+    of `replay_data`, which the add_*_to_replay functions update, so it is extended in place as
+    turns are appended. Snapshots registered with `add_snapshot` are attached to the turns that
+    reference them, so their html and bboxes are not read back from disk.
+    """
+
+    def __init__(self, replay_data, demo_name, base_dir, encoding=None, max_snapshots=5):
+        # The snapshots are attached to new turns, so only `max_snapshots` pages are kept
+        super().__init__(replay_data, demo_name=demo_name, base_dir=base_dir, encoding=encoding, max_cached_turns=0)
+        self.snapshots = {}
+        self.max_snapshots = max_snapshots
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return super().__getitem__(key)
+
+        turn = super().__getitem__(key)
+        state = turn.get("state") or {}
+        snapshot = self.snapshots.get(state.get("page"))
+        if snapshot is not None:
+            # Fill the cached properties of the turn, as if they had been loaded from disk
+            turn.__dict__.setdefault("html", snapshot[0])
+            turn.__dict__.setdefault("bboxes", snapshot[1])
+        return turn
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def with_pending_turn(self, turn_dict):
+        """
+        Returns a copy of this replay with `turn_dict` appended, e.g. to prepare the next turn
+        before it is added to the session. The copy shares the snapshots of this replay.
+        """
+        pending = LiveReplay({"data": self.data_dict + [turn_dict]}, demo_name=self.demo_name, base_dir=self.base_dir, encoding=self.encoding, max_snapshots=self.max_snapshots)
+        pending.snapshots = self.snapshots
+        return pending
+
+    def add_snapshot(self, page, html, bboxes):
+        self.snapshots[page] = (html, bboxes)
+        # Only the most recent pages are needed to build the prompt of the next turns
+        while len(self.snapshots) > self.max_snapshots:
+            self.snapshots.pop(next(iter(self.snapshots)))
+
+
+def build_temporary_action(state, viewport_width, viewport_height, initial_timestamp):
+    return {
         "type": "browser",
         "timestamp": (dt.datetime.now() - dt.datetime.strptime(initial_timestamp, "%H:%M:%S")).seconds,
         "state": {
@@ -25,9 +150,11 @@ def add_temporary_action_to_replay(file_path, state, viewport_width, viewport_he
             }
         }
     }
+
+def add_temporary_action_to_replay(file_path, state, viewport_width, viewport_height, initial_timestamp, replay_data):
+    text_dict = build_temporary_action(state, viewport_width, viewport_height, initial_timestamp)
     replay_data['data'].append(text_dict)
-    with open(file_path, 'w') as f:
-        json.dump(replay_data, f)
+    append_to_journal(file_path, "append", len(replay_data['data']) - 1, text_dict)
 
 def add_say_to_replay(file_path, speaker, utterance, initial_timestamp, replay_data):
     text_dict = {
@@ -37,8 +164,7 @@ def add_say_to_replay(file_path, speaker, utterance, initial_timestamp, replay_d
         "type": "chat",
     }
     replay_data['data'][-1] = text_dict
-    with open(file_path, 'w') as f:
-        json.dump(replay_data, f)
+    append_to_journal(file_path, "replace_last", len(replay_data['data']) - 1, text_dict)
 
 
 def add_load_to_replay(file_path, state, url, viewport_width, viewport_height, initial_timestamp, replay_data):
@@ -65,8 +191,7 @@ def add_load_to_replay(file_path, state, url, viewport_width, viewport_height, i
         }
     }
     replay_data['data'][-1] = text_dict
-    with open(file_path, 'w') as f:
-        json.dump(replay_data, f)
+    append_to_journal(file_path, "replace_last", len(replay_data['data']) - 1, text_dict)
 
 def add_click_to_replay(file_path, state, url, viewport_width, viewport_height, initial_timestamp, mouseX, mouseY, attributes, bbox, tagName, replay_data):
     text_dict = {
@@ -95,8 +220,7 @@ def add_click_to_replay(file_path, state, url, viewport_width, viewport_height,
         }
     }
     replay_data['data'][-1] = text_dict
-    with open(file_path, 'w') as f:
-        json.dump(replay_data, f)
+    append_to_journal(file_path, "replace_last", len(replay_data['data']) - 1, text_dict)
 
 def add_textInput_to_replay(file_path, state, url, viewport_width, viewport_height, initial_timestamp, mouseX, mouseY, attributes, bbox, tagName, text, replay_data):
     text_dict = {
@@ -126,8 +250,7 @@ def add_textInput_to_replay(file_path, state, url, viewport_width, viewport_heig
         }
     }
     replay_data['data'][-1] = text_dict
-    with open(file_path, 'w') as f:
-        json.dump(replay_data, f)
+    append_to_journal(file_path, "replace_last", len(replay_data['data']) - 1, text_dict)
 
 def add_scroll_to_replay(file_path, state, url, viewport_width, viewport_height, initial_timestamp, scrollX, scrollY, replay_data):
     text_dict = {
@@ -150,8 +273,7 @@ def add_scroll_to_replay(file_path, state, url, viewport_width, viewport_height,
         }
     }
     replay_data['data'][-1] = text_dict
-    with open(file_path, 'w') as f:
-        json.dump(replay_data, f)
+    append_to_journal(file_path, "replace_last", len(replay_data['data']) - 1, text_dict)
 
 def add_submit_to_replay(file_path, state, url, viewport_width, viewport_height, initial_timestamp, mouseX, mouseY, attributes, bbox, tagName, replay_data):
     text_dict = {
@@ -180,8 +302,7 @@ def add_submit_to_replay(file_path, state, url, viewport_width, viewport_height,
         }
     }
     replay_data['data'][-1] = text_dict
-    with open(file_path, 'w') as f:
-        json.dump(replay_data, f)
+    append_to_journal(file_path, "replace_last", len(replay_data['data']) - 1, text_dict)
 
 def add_change_to_replay(file_path, state, url, viewport_width, viewport_height, initial_timestamp, mouseX, mouseY, attributes, bbox, tagName, value, replay_data):
     text_dict = {
@@ -211,5 +332,4 @@ def add_change_to_replay(file_path, state, url, viewport_width, viewport_height,
         }
     }
     replay_data['data'][-1] = text_dict
-    with open(file_path, 'w') as f:
-        json.dump(replay_data, f)
+    append_to_journal(file_path, "replace_last", len(replay_data['data']) - 1, text_dict)
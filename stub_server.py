@@ -0,0 +1,168 @@
+"""
+Local stand-in for the DMR and action endpoints, to run the chatbot and the benchmarks
+offline. POST /dmr returns {"similarities": [...]} (token overlap between the source
+sentence and each sentence), POST /action returns [{"generated_text": ...}], or streams
+the tokens as server-sent events (like text-generation-inference) when the payload has
+"stream": true. The action model outputs the action text followed by filler up to
+max_new_tokens, at --token-latency seconds per token.
+
+Usage:
+
+    python stub_server.py --port 8080 --latency 0.2 --failure-rate 0.1
+
+then set API_URL_DMR=http://localhost:8080/dmr and API_URL_ACTION=http://localhost:8080/action.
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_ACTION_TEXT = 'say(speaker="navigator", utterance="Hello, how can I help you?")'
+FILLER_TEXT = ' ; click(uid="filler-uid") ; scroll(x=0, y=100)'
+# Each stub token is a few characters of the output, roughly like a real tokenizer
+CHARS_PER_TOKEN = 4
+
+
+def generate_tokens(action_text, max_new_tokens):
+    text = action_text
+    while len(text) < max_new_tokens * CHARS_PER_TOKEN:
+        text += FILLER_TEXT
+    return [text[i:i + CHARS_PER_TOKEN] for i in range(0, max_new_tokens * CHARS_PER_TOKEN, CHARS_PER_TOKEN)]
+
+
+def score_sentences(source_sentence, sentences):
+    source_tokens = set(source_sentence.lower().split())
+    scores = []
+    for sentence in sentences:
+        tokens = set(sentence.lower().split())
+        union = source_tokens | tokens
+        scores.append(len(source_tokens & tokens) / len(union) if union else 0.0)
+    return scores
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # Keep-alive, like the real endpoints, so connection pooling can be measured
+    protocol_version = "HTTP/1.1"
+    # Send the headers and the body in one segment, otherwise delayed ACKs add ~40ms per request
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def stream_tokens(self, tokens, token_latency):
+        # Without a Content-Length, the end of the stream is the end of the connection
+        self.close_connection = True
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        try:
+            for i, token in enumerate(tokens):
+                time.sleep(token_latency)
+                is_last = i == len(tokens) - 1
+                event = {
+                    "token": {"id": i, "text": token, "special": False},
+                    "generated_text": "".join(tokens) if is_last else None,
+                }
+                self.wfile.write(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+                self.server.count("streamed_tokens")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped reading, like a real server we stop generating
+            self.server.count("cancelled_streams")
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        config = self.server.config
+
+        latency = config["latency"] + random.uniform(0, config["jitter"])
+        time.sleep(latency)
+
+        if random.random() < config["failure_rate"]:
+            self.send_json(503, {"error": "stub failure"})
+            return
+
+        if self.path == "/dmr":
+            inputs = payload["inputs"]
+            self.send_json(200, {"similarities": score_sentences(inputs["source_sentence"], inputs["sentences"])})
+        elif self.path == "/action":
+            max_new_tokens = payload.get("parameters", {}).get("max_new_tokens", 256)
+            tokens = generate_tokens(config["action_text"], max_new_tokens)
+            if payload.get("stream") and config["streaming"]:
+                self.stream_tokens(tokens, config["token_latency"])
+            else:
+                time.sleep(config["token_latency"] * len(tokens))
+                self.send_json(200, [{"generated_text": "".join(tokens)}])
+        else:
+            self.send_json(404, {"error": f"Unknown path {self.path}"})
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Updated by the handler threads, one per connection
+        self.stats = {"streamed_tokens": 0, "cancelled_streams": 0}
+        self.stats_lock = threading.Lock()
+
+    def count(self, key):
+        with self.stats_lock:
+            self.stats[key] += 1
+
+    def get_stats(self):
+        with self.stats_lock:
+            return dict(self.stats)
+
+    def handle_error(self, request, client_address):
+        # Clients cancel streams by closing the connection, which is expected
+        if not isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            super().handle_error(request, client_address)
+
+
+def start_stub_server(host="127.0.0.1", port=0, latency=0.0, jitter=0.0, failure_rate=0.0, action_text=DEFAULT_ACTION_TEXT, token_latency=0.0, streaming=True):
+    """
+    Starts the stub server in a background thread and returns it. Use port=0 to pick a free
+    port, available as `server.server_address[1]`. Stop it with `server.shutdown()`.
+    """
+    server = StubServer((host, port), StubHandler)
+    server.config = dict(latency=latency, jitter=jitter, failure_rate=failure_rate, action_text=action_text, token_latency=token_latency, streaming=streaming)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random extra latency, up to this many seconds")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Fraction of requests answered with a 503")
+    parser.add_argument("--action-text", default=DEFAULT_ACTION_TEXT)
+    parser.add_argument("--token-latency", type=float, default=0.0, help="Seconds to generate each token of the action model")
+    parser.add_argument("--no-streaming", action="store_true", help="Ignore \"stream\": true, like a non-streaming endpoint")
+    args = parser.parse_args()
+
+    server = start_stub_server(args.host, args.port, args.latency, args.jitter, args.failure_rate, args.action_text, args.token_latency, not args.no_streaming)
+    print(f"Stub endpoints listening on http://{args.host}:{server.server_address[1]} (/dmr, /action)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+TRACE_FILENAME = 'trace.jsonl'
+CHROME_TRACE_FILENAME = 'trace.chrome.json'
+
+
+class TurnTracer:
+    """
+    Times the stages of each turn of a live session. Stages are recorded with the `stage`
+    context manager, from any thread, and grouped into the turn opened with `start_turn`;
+    stages that run between two turns are attached to the next turn. Work done ahead for a
+    given turn (e.g. a prefetch) is recorded with `for_turn`, so it is attached to that turn
+    whichever turn is open meanwhile, and dropped if that turn never starts.
+
+    `end_turn` appends one JSON record per turn to `trace_dir/trace.jsonl` and, if
+    `chrome_trace` is True, the stages as trace events to `trace_dir/trace.chrome.json`, which
+    can be opened in chrome://tracing or Perfetto. With `trace_dir=None`, nothing is written.
+    """
+    def __init__(self, trace_dir=None, chrome_trace=False):
+        self.trace_dir = trace_dir
+        self.chrome_trace = chrome_trace
+        self.lock = threading.Lock()
+        self.turn_index = None
+        self.turn_start = None
+        self.spans = []
+        self.annotations = {}
+        self.last_turn = None
+
+    def start_turn(self, turn_index):
+        with self.lock:
+            self.turn_index = turn_index
+            self.turn_start = time.time()
+
+    def for_turn(self, turn_index):
+        """
+        Returns a tracer whose stages are recorded into the turn `turn_index`, rather than into
+        the turn open when they run.
+        """
+        return _TurnStages(self, turn_index)
+
+    @contextmanager
+    def stage(self, name, turn_index=None):
+        start = time.time()
+        try:
+            yield
+        finally:
+            span = {
+                "name": name,
+                "start": start,
+                "duration": time.time() - start,
+                "thread": threading.current_thread().name,
+                "thread_id": threading.get_ident(),
+                "turn_index": turn_index,
+            }
+            with self.lock:
+                self.spans.append(span)
+
+    def annotate(self, key, value):
+        with self.lock:
+            self.annotations[key] = value
+
+    def end_turn(self):
+        """
+        Closes the current turn, writes it to the trace files and returns its record.
+        """
+        with self.lock:
+            end = time.time()
+            turn_start = self.turn_start if self.turn_start is not None else end
+            spans = sorted(
+                (span for span in self.spans if span["turn_index"] in (None, self.turn_index)),
+                key=lambda span: span["start"],
+            )
+            record = {
+                "turn_index": self.turn_index,
+                "start": turn_start,
+                "total": end - turn_start,
+                "stages": [
+                    {**{k: v for k, v in span.items() if k != "turn_index"}, "offset": span["start"] - turn_start}
+                    for span in spans
+                ],
+                **self.annotations,
+            }
+            # The stages of a later turn wait for it, those of a turn that never started
+            # (e.g. a prefetch for a Continue replaced by a new message) are dropped
+            self.spans = [
+                span for span in self.spans
+                if span["turn_index"] is not None and (self.turn_index is None or span["turn_index"] > self.turn_index)
+            ]
+            self.turn_index = None
+            self.turn_start = None
+            self.annotations = {}
+            self.last_turn = record
+
+        if self.trace_dir is not None:
+            self.write(record)
+        return record
+
+    def write(self, record):
+        with open(os.path.join(self.trace_dir, TRACE_FILENAME), 'a') as f:
+            f.write(json.dumps(record) + "\n")
+
+        if not self.chrome_trace:
+            return
+
+        chrome_trace_path = os.path.join(self.trace_dir, CHROME_TRACE_FILENAME)
+        is_new = not os.path.exists(chrome_trace_path)
+        with open(chrome_trace_path, 'a') as f:
+            # The trace event format allows the closing bracket of the array to be omitted,
+            # so events can be appended turn after turn
+            if is_new:
+                f.write("[\n")
+            events = [{
+                "name": f"turn {record['turn_index']}",
+                "ph": "X",
+                "ts": record["start"] * 1e6,
+                "dur": record["total"] * 1e6,
+                "pid": 1,
+                "tid": 0,
+            }]
+            thread_names = {0: "turns"}
+            for span in record["stages"]:
+                thread_names[span["thread_id"]] = span["thread"]
+                events.append({
+                    "name": span["name"],
+                    "ph": "X",
+                    "ts": span["start"] * 1e6,
+                    "dur": span["duration"] * 1e6,
+                    "pid": 1,
+                    "tid": span["thread_id"],
+                })
+            for tid, thread_name in thread_names.items():
+                events.append({"name": "thread_name", "ph": "M", "pid": 1, "tid": tid, "args": {"name": thread_name}})
+            for event in events:
+                f.write(json.dumps(event) + ",\n")
+
+
+class _TurnStages:
+    """
+    The stages of a TurnTracer recorded into a given turn, see `TurnTracer.for_turn`.
+    """
+    def __init__(self, tracer, turn_index):
+        self.tracer = tracer
+        self.turn_index = turn_index
+
+    def stage(self, name):
+        return self.tracer.stage(name, turn_index=self.turn_index)
+
+
+def format_turn_breakdown(record):
+    """
+    Formats a turn record of TurnTracer as markdown lines, one per stage, in start order.
+    """
+    lines = [f"**Turn {record['turn_index']}: {record['total'] * 1000:.0f} ms**"]
+    for span in record["stages"]:
+        lines.append(
+            f"- {span['name']}: {span['duration'] * 1000:.0f} ms "
+            f"(at {span['offset'] * 1000:+.0f} ms, {span['thread']})"
+        )
+    return "\n".join(lines)
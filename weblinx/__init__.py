@@ -1,3 +1,6 @@
+from bisect import bisect_left
+from collections import OrderedDict
+import heapq
 import datetime as dt
 from functools import cached_property, lru_cache
 import hashlib
@@ -5,10 +8,14 @@ from pathlib import Path
 import json
 from typing import Callable, Iterator, List, Union
 import importlib
+import threading
 
 from .version import __version__
 from . import utils
 
+# Append-only journal written next to replay.json by live sessions, see `Demonstration.replay`
+REPLAY_JOURNAL_FILENAME = "replay.journal.jsonl"
+
 
 def format_repr(cls, *attributes, **kwargs):
     """
@@ -19,6 +26,8 @@ def format_repr(cls, *attributes, **kwargs):
     return f'{cls.__class__.__name__}({", ".join(attrs)})'
 
 
+# Called for every Turn, so the lookups of the optional backends are only done once
+@lru_cache()
 def _validate_json_backend(backend):
     if backend not in ["auto", "json", "orjson", "ujson"]:
         raise ValueError(
@@ -44,7 +53,9 @@ class Demonstration:
             Name of the demonstration directory
 
         base_dir: str
-            Base directory containing all demonstrations directories
+            Base directory containing all demonstrations directories, or an archive created
+            by `weblinx.utils.archive.pack_demonstrations`, in which case every file of the
+            demonstration is read from the archive.
 
         json_backend: str
             Backend to use to load JSON files. Can be either 'auto', 'json',
@@ -64,6 +75,7 @@ class Demonstration:
         self.path = Path(base_dir, name)
         self.jsons = {}
         self.encoding = encoding
+        self.archive = utils.archive.get_archive(base_dir)
 
     def __repr__(self):
         return format_repr(self, "name", "base_dir")
@@ -91,11 +103,26 @@ class Demonstration:
             - data: list of data points
             - version: version of the demonstration
 
+        If the demonstration has a replay journal (`replay.journal.jsonl`), its records
+        are applied on top of `replay.json`, so live sessions that have not been compacted
+        yet can be read like any other demonstration.
+
         Note
         ----
         If you want a `Replay` object, call `Replay.from_demonstration(demo)`.
         """
-        return self.load_json("replay.json")
+        if not self.has_file(REPLAY_JOURNAL_FILENAME):
+            return self.load_json("replay.json")
+
+        replay = self.load_json("replay.json", default={"data": []})
+        records = utils.read_replay_journal(
+            self.path / REPLAY_JOURNAL_FILENAME,
+            backend=self.json_backend,
+            encoding=self.encoding,
+        )
+        utils.apply_replay_journal(replay["data"], records)
+
+        return replay
 
     # @cached_property
     # def form(self) -> dict:
@@ -115,6 +142,9 @@ class Demonstration:
         """
         Check if a file exists in the demonstration directory
         """
+        if self.archive is not None:
+            return self.archive.has_file(self.name, filename)
+
         return Path(self.path, filename).exists()
 
     def is_valid(self, check_invalid_file=True) -> bool:
@@ -174,6 +204,9 @@ class Demonstration:
 
         _validate_json_backend(backend)
 
+        if self.archive is not None:
+            return self.archive.read_json(self.name, filename, backend=backend)
+
         results = utils.auto_read_json(self.path / filename, backend=backend, encoding=encoding)
 
         return results
@@ -278,11 +311,21 @@ class Demonstration:
 
     def list_all_html_pages(self, return_str=True) -> List[Union[str, Path]]:
         """
-        Returns a list of all HTML files (including ones not in the replay)
+        Returns a list of all HTML files (including ones not in the replay). Pages kept in the
+        page store (see `weblinx.utils.store`) are listed with the path they would have as a raw
+        file, which `Turn.get_html_path(materialize=True)` can create.
         """
-        globbed = self.path.joinpath("pages").glob("page-*.html")
+        pages_dir = self.path.joinpath("pages")
+        if self.archive is not None:
+            paths = {self.path.joinpath(name) for name in self.archive.list_files(self.name, "pages")}
+        else:
+            paths = set(pages_dir.glob("page-*.html"))
 
-        sorted_paths = list(sorted(globbed, key=utils.rank_paths))
+        page_store = utils.store.PageStore.open(pages_dir)
+        if page_store is not None:
+            paths.update(pages_dir.joinpath(name) for name in page_store.names())
+
+        sorted_paths = list(sorted(paths, key=utils.rank_paths))
 
         if return_str:
             sorted_paths = [str(path) for path in sorted_paths]
@@ -304,7 +347,25 @@ class Demonstration:
         return self.path.joinpath(*args)
 
 
+class _page_property(cached_property):
+    """
+    A cached_property for the pages of a turn (html and bboxes), except on the turns memoized
+    by a Replay, which would keep them alive as long as the replay: those read them again on
+    each access, from the bounded file cache (see `weblinx.utils.cache`). A value set in the
+    `__dict__` of the turn (e.g. a snapshot of a live session) is used in both cases.
+    """
+
+    def __get__(self, instance, owner=None):
+        if instance is not None and instance._memoized:
+            value = instance.__dict__.get(self.attrname)
+            return value if value is not None else self.func(instance)
+        return super().__get__(instance, owner)
+
+
 class Turn(dict):
+    # Set by the Replay that memoizes the turn, see `Replay.__getitem__`
+    _memoized = False
+
     def __init__(
         self,
         turn_dict: dict,
@@ -334,8 +395,13 @@ class Turn(dict):
         """
         Returns a Turn object from a replay and an index
         """
+        turn = replay[index]
+        if type(turn) is cls:
+            # The replay already built the turn, reuse it so that anything it cached is kept
+            return turn
+
         return cls(
-            turn_dict=replay[index],
+            turn_dict=turn,
             index=index,
             demo_name=replay.demo_name,
             base_dir=replay.base_dir,
@@ -595,7 +661,7 @@ class Turn(dict):
 
         return args.get("properties")
 
-    @cached_property
+    @_page_property
     def bboxes(self) -> dict:
         """
         This uses the path returned by `self.get_bboxes_path()` to load the bounding boxes of the turn,
@@ -622,11 +688,24 @@ class Turn(dict):
         if path is None:
             return None
 
-        bboxes = utils.auto_read_json(path, backend=self.json_backend, encoding=self.encoding)
+        if self.archive is not None:
+            return self.archive.read_cached(
+                self.demo_name,
+                self._get_archive_filename(path),
+                lambda demo_name, filename: self.archive.read_json(demo_name, filename, backend=self.json_backend),
+                kind=("bboxes", self.json_backend),
+            )
+
+        # Shared with the other turns of the same snapshot, see `weblinx.utils.cache`
+        bboxes = utils.cache.file_cache.get(
+            path,
+            lambda p: utils.auto_read_json(p, backend=self.json_backend, encoding=self.encoding),
+            kind=("bboxes", self.json_backend, self.encoding),
+        )
 
         return bboxes
 
-    @cached_property
+    @_page_property
     def html(self) -> str:
         """
         This uses the path returned by `self.get_html_path()` to load the HTML of the turn,
@@ -651,13 +730,35 @@ class Turn(dict):
         with open(turns[0].get_html_path(subdir="pages")) as f:
             html = f.read()
         ```
+
+        If the raw HTML file does not exist, the page is read from the page store of the
+        `pages` directory, if there is one (see `weblinx.utils.store`). Pages are shared
+        with the other turns that refer to the same file (see `weblinx.utils.cache`).
         """
         if not self.has_html():
             return None
 
-        return utils.html.open_html_with_encodings(
-            self.get_html_path(), raise_error=False
+        path = self.get_html_path()
+        if self.archive is not None:
+            filename = self._get_archive_filename(path)
+            if not self.archive.has_file(self.demo_name, filename):
+                return None
+            return self.archive.read_cached(
+                self.demo_name,
+                filename,
+                lambda demo_name, filename: self.archive.read_text(demo_name, filename, encoding=self.encoding),
+                kind=("html", self.encoding),
+            )
+
+        html = utils.cache.file_cache.get(
+            path,
+            lambda p: utils.html.open_html_with_encodings(p, raise_error=False),
+            kind="html",
         )
+        if html is None:
+            html = utils.store.read_page(path)
+
+        return html
 
     def format_text(self, max_length=50) -> str:
         """
@@ -767,6 +868,17 @@ class Turn(dict):
     #     """
     #     return self.get("state", {}).get("screenshot") is not None
 
+    @property
+    def archive(self) -> "utils.archive.DemoArchive":
+        """
+        The archive the turn is read from, if its `base_dir` is an archive created by
+        `weblinx.utils.archive.pack_demonstrations`, otherwise None.
+        """
+        return utils.archive.get_archive(self.base_dir)
+
+    def _get_archive_filename(self, path) -> str:
+        return Path(path).relative_to(Path(self.base_dir, self.demo_name)).as_posix()
+
     def has_html(self):
         """
         Returns True if the turn has an associated HTML page, False otherwise
@@ -822,7 +934,11 @@ class Turn(dict):
     #         return path
 
     def get_html_path(
-        self, subdir: str = "pages", return_str: bool = True, throw_error: bool = True
+        self,
+        subdir: str = "pages",
+        return_str: bool = True,
+        throw_error: bool = True,
+        materialize: bool = False,
     ) -> Union[Path, str]:
         """
         Returns the path to the HTML page of the turn.
@@ -837,6 +953,10 @@ class Turn(dict):
 
         throw_error: bool
             If True, throws an error if the turn does not have an HTML page, otherwise returns None
+
+        materialize: bool
+            If True and the page is only in the page store (see `weblinx.utils.store`), writes it
+            to the returned path, for code that needs to open the raw file.
         """
         if not self.has_html():
             if throw_error:
@@ -846,6 +966,12 @@ class Turn(dict):
 
         path = Path(self.base_dir, self.demo_name, subdir, self["state"]["page"])
 
+        if materialize and not path.exists():
+            html = utils.store.read_page(path)
+            if html is not None:
+                with open(path, "w", encoding="utf-8") as f:
+                    f.write(html)
+
         if return_str:
             return str(path)
         else:
@@ -885,7 +1011,12 @@ class Turn(dict):
 
         path = Path(self.base_dir, self.demo_name, subdir, f"bboxes-{index}.json")
 
-        if not path.exists():
+        if self.archive is not None:
+            exists = self.archive.has_file(self.demo_name, f"{subdir}/{path.name}")
+        else:
+            exists = path.exists()
+
+        if not exists:
             if throw_error:
                 raise ValueError(f"Turn {self.index} does not have bounding boxes")
             else:
@@ -917,9 +1048,11 @@ class Turn(dict):
     ):
         """
         Retrieves the XPaths for elements in the turn's HTML page that match a specified attribute name (uid_key).
-        If a cache directory is provided, it attempts to load cached XPaths before computing new ones. Newly computed
+        If the turn is read from an archive that includes the XPaths, they are used when no cache directory is
+        given. If a cache directory is provided, it attempts to load cached XPaths before computing new ones. Newly computed
         XPaths can be saved to the cache if `allow_save` is True. If `check_hash` is True, it validates the HTML hash
-        before using cached data.
+        before using cached data. Cached XPaths are only used if they were computed by the same parser backend, since
+        the backends can build different trees for the same page.
 
         Parameters
         ----------
@@ -931,8 +1064,9 @@ class Turn(dict):
             Whether to save newly computed XPaths to the cache directory.
         check_hash : bool
             Whether to validate the HTML hash before using cached XPaths.
-        parser : str
-            The parser backend to use for HTML parsing. Currently, only 'lxml' is supported.
+        parser : str or ParserBackend
+            The parser backend to use for HTML parsing, 'lxml' or 'selectolax' (see
+            `weblinx.processing.dom.get_parser_backend`).
         json_backend : str
             The backend to use for loading and saving JSON. If 'auto', chooses the best available option.
         encoding: str
@@ -947,8 +1081,20 @@ class Turn(dict):
         if encoding is None:
             encoding = self.encoding
         
-        if parser != "lxml":
-            raise ValueError(f"Invalid backend '{parser}'. Must be 'lxml'.")
+        from .processing.dom import get_parser_backend, get_xpaths_by_uid
+
+        # Raises a ValueError for an unknown backend
+        parser = get_parser_backend(parser)
+
+        archive_filename = f"xpaths/xpaths-{self.index}.json"
+        if cache_dir is None and self.archive is not None and self.archive.has_file(self.demo_name, archive_filename):
+            # The xpaths were packed with the demonstration
+            result = self.archive.read_json(self.demo_name, archive_filename, backend=json_backend)
+            # The files saved before the backends were added were computed with lxml
+            if result.get("parser", "lxml") == parser.name and (
+                not check_hash or result["md5"] == hashlib.md5(self.html.encode()).hexdigest()
+            ):
+                return result["xpaths"]
 
         if cache_dir is not None:
             cache_dir = Path(cache_dir, self.demo_name)
@@ -956,51 +1102,92 @@ class Turn(dict):
             if cache_path.exists():
                 result = utils.auto_read_json(cache_path, backend=json_backend, encoding=encoding)
                 # If the hash is different, then the HTML has changed, so we need to
-                # recompute the XPaths
-                if not check_hash:
-                    return result["xpaths"]
-
-                elif (
-                    check_hash
-                    and result["md5"] == hashlib.md5(self.html.encode()).hexdigest()
+                # recompute the XPaths, as with the XPaths of another backend
+                if result.get("parser", "lxml") == parser.name and (
+                    not check_hash or result["md5"] == hashlib.md5(self.html.encode()).hexdigest()
                 ):
                     return result["xpaths"]
 
-        try:
-            import lxml.html
-        except ImportError:
-            raise ImportError(
-                "The lxml package is required to use this function. Install it with `pip install lxml`."
-            )
-
         html = self.html
         if html is None:
             return {}
 
-        tree = lxml.html.fromstring(html).getroottree()
-
-        elems = tree.xpath(f"//*[@{uid_key}]")
-        if len(elems) == 0:
+        xpaths = get_xpaths_by_uid(html, uid_key=uid_key, backend=parser)
+        if len(xpaths) == 0:
             return {}
 
-        xpaths = {}
-
-        for elem in elems:
-            uid = elem.attrib[uid_key]
-            xpath = tree.getpath(elem)
-            xpaths[uid] = xpath
-
         if cache_dir is not None and allow_save:
             cache_dir.mkdir(parents=True, exist_ok=True)
             save_file = {
                 "xpaths": xpaths,
                 "md5": hashlib.md5(html.encode()).hexdigest(),
+                "parser": parser.name,
             }
             utils.auto_save_json(save_file, cache_path, backend=json_backend)
 
         return xpaths
 
 
+class TurnIndex:
+    """
+    A columnar index of the turns of a replay, built in one pass over the turn dictionaries
+    without creating Turn objects. It stores the type, intent, speaker, timestamp, whether the
+    turn has an HTML page and the index of that page, as one list per field, and the sorted
+    positions of the turns for each type, intent and speaker, so that filters are answered by
+    looking up the positions instead of testing every turn.
+
+    It is built and kept up to date by `Replay.get_turn_index`, which is what should be used
+    instead of creating it directly.
+    """
+
+    def __init__(self, data_dict: List[dict]):
+        self.types = []
+        self.intents = []
+        self.speakers = []
+        self.timestamps = []
+        self.has_html = []
+        self.page_indices = []
+
+        self.positions_by_type = {}
+        self.positions_by_intent = {}
+        self.positions_by_speaker = {}
+        self.html_positions = []
+
+        for i, turn_dict in enumerate(data_dict):
+            # Same as the properties of Turn with the same names
+            turn_type = turn_dict.get("type")
+            action = turn_dict.get("action", {})
+            intent = None if action is None else action.get("intent")
+            speaker = turn_dict.get("speaker")
+            state = turn_dict.get("state")
+            page = None if state is None else state.get("page")
+
+            page_index = None
+            if page is not None:
+                self.html_positions.append(i)
+                try:
+                    page_index = utils.get_nums_from_path(page)[0]
+                except ValueError:
+                    pass
+
+            self.types.append(turn_type)
+            self.intents.append(intent)
+            self.speakers.append(speaker)
+            self.timestamps.append(turn_dict.get("timestamp"))
+            self.has_html.append(page is not None)
+            self.page_indices.append(page_index)
+
+            self.positions_by_type.setdefault(turn_type, []).append(i)
+            self.positions_by_intent.setdefault(intent, []).append(i)
+            self.positions_by_speaker.setdefault(speaker, []).append(i)
+
+    def __len__(self):
+        return len(self.types)
+
+    def __repr__(self):
+        return format_repr(self, num_turns=len(self))
+
+
 class Replay:
     """
     A replay is one of the core components of a demonstration. It is a list of turns, each of
@@ -1010,7 +1197,14 @@ class Replay:
     then it will contain information about what was said in the chat.
     """
 
-    def __init__(self, replay_json: dict, demo_name: str, base_dir: str, encoding=None):
+    def __init__(
+        self,
+        replay_json: dict,
+        demo_name: str,
+        base_dir: str,
+        encoding=None,
+        max_cached_turns: int = 256,
+    ):
         """
         Represents a replay of a demonstration, encapsulating a sequence of turns (actions and states) within a web session.
 
@@ -1024,11 +1218,23 @@ class Replay:
             The base directory where the demonstration data is stored.
         encoding : str
             The encoding to use when reading files. If None, it will default to the system's default encoding.
+        max_cached_turns : int
+            The number of most recently accessed turns kept by the replay, so that accessing the same turn
+            again (e.g. the previous turns and instructor utterances formatted for every turn of a prompt)
+            returns the same Turn object instead of building a new one. If 0, a new Turn is built on each
+            access. The kept turns do not keep their HTML and bounding boxes, which they read from the
+            bounded file cache of `weblinx.utils.cache` on each access. Changes made to a kept Turn (e.g. to
+            its action) are seen by the next accesses of the same index.
         """
         self.data_dict = replay_json["data"]
         self.demo_name = demo_name
         self.base_dir = str(base_dir)
         self.encoding = encoding
+        self.max_cached_turns = max_cached_turns
+        self._turns = OrderedDict()
+        self._turns_lock = threading.Lock()
+        self._turn_index = None
+        self._turn_index_key = None
 
         created = replay_json.get("created", None)
         # TODO: check if this is the correct timestamp
@@ -1049,14 +1255,44 @@ class Replay:
                 f"Turn index {key} out of range. The replay has {len(self)} turns, so the last index is {len(self) - 1}."
             )
 
-        return Turn(
-            self.data_dict[key],
+        turn_dict = self.data_dict[key]
+
+        with self._turns_lock:
+            cached = self._turns.get(key)
+            # The turn at this index may have been replaced since, e.g. in a live session
+            if cached is not None and cached[0] is turn_dict:
+                self._turns.move_to_end(key)
+                return cached[1]
+
+        turn = Turn(
+            turn_dict,
             index=key,
             demo_name=self.demo_name,
             base_dir=self.base_dir,
             encoding=self.encoding,
         )
 
+        if self.max_cached_turns > 0:
+            turn._memoized = True
+            with self._turns_lock:
+                self._turns[key] = (turn_dict, turn)
+                self._turns.move_to_end(key)
+                while len(self._turns) > self.max_cached_turns:
+                    self._turns.popitem(last=False)
+
+        return turn
+
+    def __getstate__(self):
+        # The cached turns are not pickled, and the lock cannot be
+        state = self.__dict__.copy()
+        state["_turns"] = OrderedDict()
+        del state["_turns_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._turns_lock = threading.Lock()
+
     def __len__(self):
         return len(self.data_dict)
 
@@ -1074,13 +1310,10 @@ class Replay:
         )
 
     def __iter__(self) -> Iterator[Turn]:
-        return iter(
-            Turn(turn, index=i, demo_name=self.demo_name, base_dir=self.base_dir)
-            for i, turn in enumerate(self.data_dict)
-        )
+        return (self[i] for i in range(len(self)))
 
     @classmethod
-    def from_demonstration(cls, demonstration: Demonstration):
+    def from_demonstration(cls, demonstration: Demonstration, max_cached_turns: int = 256):
         """
         Returns a Replay object from a demonstration object.
 
@@ -1090,6 +1323,9 @@ class Replay:
             Demonstration object to create the replay from. It will use the replay.json file
             in the demonstration directory, as well as the name and base directory of the
             demonstration.
+
+        max_cached_turns: int
+            The number of most recently accessed turns kept by the replay, see `Replay`.
         """
         replay = demonstration.replay
         return cls(
@@ -1097,12 +1333,72 @@ class Replay:
             demo_name=demonstration.name,
             base_dir=demonstration.base_dir,
             encoding=demonstration.encoding,
+            max_cached_turns=max_cached_turns,
+        )
+
+    @classmethod
+    def from_demonstrations(
+        cls,
+        demonstrations: List[Demonstration],
+        num_workers: int = 8,
+        use_processes: bool = False,
+        progress: bool = False,
+    ) -> List["Replay"]:
+        """
+        Returns the Replay of each demonstration, in the same order, loading them concurrently
+        with `weblinx.utils.parallel.parallel_map`.
+
+        Parameters
+        ----------
+        demonstrations: list of Demonstration
+            The demonstrations to create the replays from.
+
+        num_workers: int
+            The number of threads (or processes) loading the replays. If 0 or 1, the replays
+            are loaded one after the other.
+
+        use_processes: bool
+            Whether to load the replays in a pool of processes instead of threads. This helps
+            when parsing the JSON, rather than reading it, is the bottleneck, at the cost of
+            sending the replays back to this process.
+
+        progress: bool
+            Whether to show a progress bar (requires tqdm).
+        """
+        return utils.parallel.parallel_map(
+            cls.from_demonstration,
+            demonstrations,
+            num_workers=num_workers,
+            use_processes=use_processes,
+            progress=progress,
+            desc="Loading replays",
         )
 
     @property
     def num_turns(self):
         return len(self)
 
+    def get_turn_index(self) -> TurnIndex:
+        """
+        Returns the TurnIndex of the replay, which is built on the first call. It is rebuilt if
+        turns were added to or replaced at the end of `data_dict` since, as in a live session.
+        """
+        num_turns = len(self.data_dict)
+        last_turn_dict = self.data_dict[-1] if num_turns > 0 else None
+        key = self._turn_index_key
+
+        if self._turn_index is None or key[0] != num_turns or key[1] is not last_turn_dict:
+            self._turn_index = TurnIndex(self.data_dict)
+            self._turn_index_key = (num_turns, last_turn_dict)
+
+        return self._turn_index
+
+    def get_turns_at(self, positions: List[int]) -> List[Turn]:
+        """
+        Returns the turns at the given positions of the replay.
+        """
+        return [self[i] for i in positions]
+
     def filter_turns(self, turn_filter: Callable[[Turn], bool]) -> List[Turn]:
         """
         Filter the turns in the replay by a custom filter function that takes as input a turn object
@@ -1131,16 +1427,29 @@ class Replay:
                 f"Invalid turn type: {turn_type}. Please choose one of: {valid_types}"
             )
 
-        return self.filter_turns(lambda turn: turn.type == turn_type)
+        positions = self.get_turn_index().positions_by_type.get(turn_type, [])
+        return self.get_turns_at(positions)
 
     def filter_by_intent(self, intent: str) -> List[Turn]:
         """
         Filter the turns in the replay by action intent
         """
+        index = self.get_turn_index()
         if intent == "say":
-            return self.filter_turns(lambda turn: turn.type == "chat")
+            positions = index.positions_by_type.get("chat", [])
         else:
-            return self.filter_turns(lambda turn: turn.intent == intent)
+            positions = index.positions_by_intent.get(intent, [])
+        return self.get_turns_at(positions)
+
+    def filter_by_speaker(self, speaker: str, end: int = None) -> List[Turn]:
+        """
+        Filter the chat turns in the replay by speaker (e.g. 'instructor' or 'navigator'). If
+        `end` is given, only the turns with an index lower than `end` are returned.
+        """
+        positions = self.get_turn_index().positions_by_speaker.get(speaker, [])
+        if end is not None:
+            positions = positions[: bisect_left(positions, end)]
+        return self.get_turns_at(positions)
 
     def filter_by_intents(self, intents: List[str], *args) -> List[Turn]:
         """
@@ -1161,15 +1470,18 @@ class Replay:
             # merge the intents with the args
             intents = list(intents) + list(args)
 
-        # Convert to set for faster lookup
-        intents = set(intents)
-
+        index = self.get_turn_index()
+        position_lists = [index.positions_by_intent.get(intent, []) for intent in set(intents)]
         if "say" in intents:
-            return self.filter_turns(
-                lambda turn: turn.intent in intents or turn.type == "chat"
-            )
-        else:
-            return self.filter_turns(lambda turn: turn.intent in intents)
+            position_lists.append(index.positions_by_type.get("chat", []))
+
+        # Each list is sorted, merge them in order and without duplicates
+        positions = []
+        for i in heapq.merge(*position_lists):
+            if not positions or positions[-1] != i:
+                positions.append(i)
+
+        return self.get_turns_at(positions)
 
     def validate_turns(self) -> List[bool]:
         """
@@ -1189,21 +1501,19 @@ class Replay:
         """
         Filter the turns in the replay by whether the turn contains an HTML page
         """
-        return self.filter_turns(lambda turn: turn.has_html())
+        return self.get_turns_at(self.get_turn_index().html_positions)
 
-    @lru_cache()
     def list_types(self) -> List[str]:
         """
         List all turn types in the current replay (may not be exhaustive)
         """
-        return list({turn.type for turn in self})
+        return list(self.get_turn_index().positions_by_type)
 
-    @lru_cache()
     def list_intents(self):
         """
         List all action intents in the current replay (may not be exhaustive)
         """
-        return list(set(turn.intent for turn in self))
+        return list(self.get_turn_index().positions_by_intent)
 
     # @lru_cache()
     # def list_screenshots(self, return_str: bool = True):
@@ -1331,6 +1641,11 @@ class Replay:
                         turn["state"] = {}
 
                     turn["state"]["page"] = prev_turn["state"]["page"]
+                    # The turn may be reused by the replay, so it must not keep a stale page
+                    turn.__dict__.pop("html", None)
+                    turn.__dict__.pop("bboxes", None)
+                    # The state may be shared with data_dict, whose index is now outdated
+                    self._turn_index = None
                     return turn["state"]["page"]
 
                 index -= 1
@@ -1347,18 +1662,26 @@ def list_demonstrations(
     Parameters
     ----------
     base_dir: str
-        Base directory containing all demonstrations
+        Base directory containing all demonstrations, or an archive created by
+        `weblinx.utils.archive.pack_demonstrations`
 
     valid_only: bool
         Whether to only return valid demonstrations. This will call `Demonstration.is_valid`
         with the default parameters.
     """
-    path = Path(base_dir)
-    demos = [
-        Demonstration(demo.name, base_dir=base_dir)
-        for demo in sorted(path.iterdir())
-        if demo.is_dir()
-    ]
+    archive = utils.archive.get_archive(base_dir)
+    if archive is not None:
+        demos = [
+            Demonstration(name, base_dir=base_dir)
+            for name in sorted(archive.list_demo_names())
+        ]
+    else:
+        path = Path(base_dir)
+        demos = [
+            Demonstration(demo.name, base_dir=base_dir)
+            for demo in sorted(path.iterdir())
+            if demo.is_dir()
+        ]
 
     if valid_only:
         demos = [demo for demo in demos if demo.is_valid()]
@@ -1381,6 +1704,8 @@ def load_demos_in_split(
     sample_size=None,
     random_state=42,
     demo_base_dir="./demonstrations",
+    num_workers=None,
+    progress=False,
 ):
     """
     Loads demos from a json file containing many splits. The json file should be a dictionary with
@@ -1403,6 +1728,18 @@ def load_demos_in_split(
     random_state : int
         The random state to use for sampling.
 
+    demo_base_dir : str or Path
+        The directory containing the demonstrations, or an archive created by
+        `weblinx.utils.archive.pack_demonstrations` (e.g. with `python -m weblinx pack`).
+
+    num_workers : int
+        If not None, the replay of every demo is read with this many threads, so that
+        `demo.replay` is already loaded when the function returns. By default, each replay
+        is read the first time it is accessed.
+
+    progress : bool
+        Whether to show a progress bar while reading the replays (requires tqdm).
+
     Returns
     -------
     demos : list of Demonstration
@@ -1414,9 +1751,21 @@ def load_demos_in_split(
     then apply wt.Demonstration to each demo name.
     """
 
-    return [
+    demos = [
         Demonstration(demo_name, base_dir=demo_base_dir)
         for demo_name in utils.load_demo_names_in_split(
             split_path, split, sample_size, random_state
         )
     ]
+
+    if num_workers is not None:
+        # Reading the replay fills the cached property of each demo
+        utils.parallel.parallel_map(
+            lambda demo: demo.replay,
+            demos,
+            num_workers=num_workers,
+            progress=progress,
+            desc="Loading demos",
+        )
+
+    return demos
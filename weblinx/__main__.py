@@ -0,0 +1,43 @@
+"""
+Command line tools of weblinx.
+
+Usage:
+
+    python -m weblinx pack --demos-dir ./demonstrations --split-path splits.json --split train -o train.wlpack
+"""
+import argparse
+
+from . import list_demonstrations, load_demos_in_split
+from .utils.archive import pack_demonstrations
+
+
+def pack(args):
+    if args.split_path is not None:
+        demos = load_demos_in_split(args.split_path, split=args.split, demo_base_dir=args.demos_dir)
+    else:
+        demos = list_demonstrations(args.demos_dir, valid_only=True)
+
+    path = pack_demonstrations(demos, args.output, xpaths_dir=args.xpaths_dir, progress=True)
+    print(f"Packed {len(demos)} demonstrations into {path} ({path.stat().st_size / 1e6:.1f}MB)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m weblinx")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    pack_parser = subparsers.add_parser(
+        "pack", help="Pack demonstrations into a single archive, see weblinx.utils.archive"
+    )
+    pack_parser.add_argument("--demos-dir", default="./demonstrations", help="Directory containing the demonstrations")
+    pack_parser.add_argument("--split-path", help="JSON file of the splits; all valid demonstrations are packed if omitted")
+    pack_parser.add_argument("--split", default="train", help="Name of the split to pack")
+    pack_parser.add_argument("--xpaths-dir", help="Cache directory of Turn.get_xpaths_dict, to pack the xpaths too")
+    pack_parser.add_argument("-o", "--output", required=True, help="Path of the archive to create")
+    pack_parser.set_defaults(func=pack)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -45,37 +45,41 @@ def run_evaluation(processed_results, metrics, num_turns=1):
     metrics_map = get_metrics_map()
     metrics: Metric = [metrics_map[metric]() for metric in metrics]
 
-    scores = []
-
-    for i, out in enumerate(processed_results):
-        score_item = {
+    scores = [
+        {
             "demo_name": out["demo_name"],
             "turn_index": out["turn_index"],
             "pred_intent": out["pred"]["intent"],
             "ref_intent": out["ref"]["intent"],
         }
-
-        # for each prediction, compute all the applicable metrics
-        pred = out["pred"]
-        for metric in metrics:
-            metric: Metric
-            best_score = None
-            # over all the future turns up to `num_turns`
+        for out in processed_results
+    ]
+
+    for metric in metrics:
+        metric: Metric
+        # for each prediction, find the applicable pairs over all the future
+        # turns up to `num_turns`, then score them all at once
+        pairs = []
+        for i, out in enumerate(processed_results):
             for out_next in processed_results[i : i + num_turns]:
                 if out["demo_name"] != out_next["demo_name"]:
                     break
 
-                ref = out_next["ref"]
                 # skip incompatible predictions
-                if metric.is_applicable(pred, ref):
-                    res = metric.score(pred, ref)
+                if metric.is_applicable(out["pred"], out_next["ref"]):
+                    pairs.append((i, out["pred"], out_next["ref"]))
 
-                    if best_score is None or res > best_score:
-                        best_score = res
+        results = metric.score_batch(
+            [pred for _, pred, _ in pairs], [ref for _, _, ref in pairs]
+        )
 
-            score_item[metric.name] = best_score
+        best_scores = [None] * len(processed_results)
+        for (i, _, _), res in zip(pairs, results):
+            if best_scores[i] is None or res > best_scores[i]:
+                best_scores[i] = res
 
-        scores.append(score_item)
+        for score_item, best_score in zip(scores, best_scores):
+            score_item[metric.name] = best_score
 
     return scores
 
@@ -187,7 +191,10 @@ def process_model_results(replays, model_results, model_name=None, verbose=True)
 
 
 def load_replays(
-    splits, base_dir="./wl_data/demonstrations/", split_file=default_split_file
+    splits,
+    base_dir="./wl_data/demonstrations/",
+    split_file=default_split_file,
+    num_workers=8,
 ):
     from weblinx import list_demonstrations, Replay
 
@@ -201,12 +208,11 @@ def load_replays(
     for split in splits:
         logger.info(f"Loading demonstrations for split {split}")
 
-        replays.update(
-            {
-                demo_name: Replay.from_demonstration(demo_map[demo_name])
-                for demo_name in demos_by_splits[split]
-            }
+        demo_names = demos_by_splits[split]
+        split_replays = Replay.from_demonstrations(
+            [demo_map[demo_name] for demo_name in demo_names], num_workers=num_workers
         )
+        replays.update(zip(demo_names, split_replays))
     logger.info(f"Loaded {len(replays)} demonstrations")
 
     return replays
@@ -15,6 +15,13 @@ class Metric(abc.ABC):
     def score(self, pred, ref, **kwargs):
         raise NotImplementedError
 
+    def score_batch(self, preds, refs, **kwargs):
+        """
+        Returns the score of each pair `(preds[i], refs[i])`. Metrics that can be computed on
+        arrays override this, the default calls `score` on each pair.
+        """
+        return [self.score(pred, ref, **kwargs) for pred, ref in zip(preds, refs)]
+
     @abc.abstractclassmethod
     def is_applicable(self, pred, ref):
         """
@@ -120,6 +127,36 @@ class IOUMetric(ElementMetric):
         
         return iou
 
+    def score_batch(self, preds, refs, **kwargs):
+        """
+        Computes the IOU of each pair `(preds[i], refs[i])` at once, with
+        `weblinx.utils.bboxes.compute_iou`. The scores are the same as the ones of `score`.
+        """
+        from ..utils.bboxes import compute_iou
+
+        scores = [0] * len(preds)
+        positions, bboxes_pred, bboxes_ref = [], [], []
+
+        for i, (pred, ref) in enumerate(zip(preds, refs)):
+            if not pred.get("element") or not ref.get("element"):
+                continue
+
+            bbox_pred = pred["element"].get("bbox")
+            bbox_ref = ref["element"].get("bbox")
+
+            if not bbox_pred or not bbox_ref:
+                continue
+
+            positions.append(i)
+            bboxes_pred.append(bbox_pred)
+            bboxes_ref.append(bbox_ref)
+
+        if positions:
+            for i, iou in zip(positions, compute_iou(bboxes_pred, bboxes_ref).tolist()):
+                scores[i] = iou
+
+        return scores
+
 
 class URLFMetric(LexicalMetric):
     def __init__(self, args={}):
@@ -1,17 +1,690 @@
 # Some imports for type checking
+from collections import OrderedDict
 from copy import deepcopy
+import hashlib
+from itertools import islice
 import re
+import threading
 from typing import TYPE_CHECKING
 
 if TYPE_CHECKING:
     import lxml.html
 
 
+class ParsedTreeCache:
+    """
+    A cache of the trees parsed by `lxml.html.fromstring`, keyed by the hash of the HTML and
+    the parser, so that a page is parsed once, however many turns and consumers use it. The
+    memory is bounded by the total length of the HTML of the cached trees, and the least
+    recently used trees are evicted first.
+
+    Parameters
+    ----------
+    max_chars : int, optional
+        The maximum total length of the HTML of the cached trees. A parsed tree takes a few
+        times more memory than its HTML. Defaults to 0, which disables the cache.
+
+    Example
+    -------
+    ```
+    from weblinx.processing.dom import parse_html, set_parsed_tree_cache_size
+
+    # The cache of parse_html is disabled until given a size, here 16 million characters
+    set_parsed_tree_cache_size(16 * 1024**2)
+
+    # Shared tree, must not be modified (e.g. for xpath queries, or prune_tree which copies it)
+    root = parse_html(turn.html, copy=False)
+    # Private copy, which can be modified
+    root = parse_html(turn.html)
+    ```
+    """
+
+    def __init__(self, max_chars: int = 0):
+        self.max_chars = max_chars
+        self.lock = threading.Lock()
+        self.trees = OrderedDict()
+        self.num_chars = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _evict(self):
+        while self.num_chars > self.max_chars and self.trees:
+            _, (_, num_chars) = self.trees.popitem(last=False)
+            self.num_chars -= num_chars
+            self.evictions += 1
+
+    def get(self, html: str, parser=None, copy=True) -> "lxml.html.HtmlElement":
+        """
+        Returns the root element of `html` parsed with `parser` (the default parser of
+        `lxml.html` if None). If `copy` is False, the cached tree is returned and must not
+        be modified; otherwise, the caller gets its own copy, which is cheaper than parsing.
+        """
+        try:
+            import lxml.html
+        except ImportError:
+            raise ImportError("Please install lxml to use this function")
+
+        digest = hashlib.blake2b(html.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+        # Parsers are compared by identity, so a parser should be reused to hit the cache
+        key = (digest, parser)
+
+        with self.lock:
+            cached = self.trees.get(key)
+            if cached is not None:
+                self.trees.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if cached is not None:
+            root = cached[0]
+        else:
+            root = lxml.html.fromstring(html, parser=parser)
+            if len(html) > self.max_chars:
+                # Not shared, so it is already the caller's own copy
+                return root
+            with self.lock:
+                # Another thread may have parsed the same page meanwhile: share its tree
+                if key in self.trees:
+                    root = self.trees[key][0]
+                else:
+                    self.trees[key] = (root, len(html))
+                    self.num_chars += len(html)
+                    self._evict()
+
+        return deepcopy(root) if copy else root
+
+    def resize(self, max_chars: int):
+        """
+        Changes the maximum total length of the HTML of the cached trees, evicting trees if needed.
+        """
+        with self.lock:
+            self.max_chars = max_chars
+            self._evict()
+
+    def clear(self):
+        """
+        Removes every tree and resets the statistics.
+        """
+        with self.lock:
+            self.trees.clear()
+            self.num_chars = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def stats(self) -> dict:
+        """
+        Returns the number of hits, misses (parses) and evictions, and the number of cached
+        trees and the total length of their HTML.
+        """
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "trees": len(self.trees),
+                "chars": self.num_chars,
+                "max_chars": self.max_chars,
+            }
+
+
+# Disabled by default, since every process (e.g. the workers of parallel_map) would keep its
+# own trees: enable it with set_parsed_tree_cache_size where the same pages are parsed again
+parsed_tree_cache = ParsedTreeCache()
+
+
+def parse_html(html: str, parser=None, copy=True) -> "lxml.html.HtmlElement":
+    """
+    Parses `html` with `lxml.html.fromstring`, reusing the tree of a previous call with the
+    same HTML and parser. See `ParsedTreeCache.get` for the meaning of `copy`.
+    """
+    return parsed_tree_cache.get(html, parser=parser, copy=copy)
+
+
+def set_parsed_tree_cache_size(max_chars: int):
+    """
+    Sets the maximum total length of the HTML of the trees kept by `parse_html`. Use 0 to
+    disable the cache.
+    """
+    parsed_tree_cache.resize(max_chars)
+
+
+class ParserBackend:
+    """
+    The read-only operations on a parsed page used to find elements by uid, extract their
+    tag, text and attributes, and compute their xpaths, independently of the HTML parser.
+    A backend is picked per call by the functions that take a `backend` argument, by name
+    (see `get_parser_backend`) or as an instance.
+
+    The results are those of lxml, which is the reference: the tag and attribute names are
+    lowercase, the text is the text before the first child, and the xpaths are those of
+    `getpath`. Other backends follow them as far as their parser allows; use
+    `compare_parser_backends` to measure how far on a given set of pages.
+    """
+
+    name = None
+
+    def __repr__(self):
+        return f"{type(self).__name__}()"
+
+    def parse(self, html: str):
+        """
+        Returns the document of `html`, passed to the other methods.
+        """
+        raise NotImplementedError
+
+    def iter_elements(self, document, attribute: str = None):
+        """
+        Iterates over the elements of `document` in document order, or only over those that
+        have the attribute `attribute` if it is given.
+        """
+        raise NotImplementedError
+
+    def get_tag(self, node) -> str:
+        raise NotImplementedError
+
+    def get_text(self, node) -> str:
+        """
+        Returns the text of `node` before its first child, or "" if there is none.
+        """
+        raise NotImplementedError
+
+    def get_attributes(self, node) -> dict:
+        raise NotImplementedError
+
+    def get_attribute(self, node, key: str) -> str:
+        return self.get_attributes(node).get(key)
+
+    def get_xpath(self, node) -> str:
+        raise NotImplementedError
+
+    def get_xpaths(self, nodes) -> list:
+        """
+        Returns the xpath of each node. Backends can share work between the nodes.
+        """
+        return [self.get_xpath(node) for node in nodes]
+
+
+class LxmlBackend(ParserBackend):
+    """
+    The default backend, with the trees of `parse_html`, which are shared with the other
+    consumers of the page.
+    """
+
+    name = "lxml"
+
+    def parse(self, html: str):
+        return parse_html(html, copy=False).getroottree()
+
+    def iter_elements(self, document, attribute: str = None):
+        if attribute is None:
+            import lxml.etree
+
+            return document.iter(lxml.etree.Element)
+        return document.xpath(f"//*[@{attribute}]")
+
+    def get_tag(self, node) -> str:
+        return node.tag
+
+    def get_text(self, node) -> str:
+        return node.text if node.text is not None else ""
+
+    def get_attributes(self, node) -> dict:
+        return dict(node.attrib)
+
+    def get_attribute(self, node, key: str) -> str:
+        return node.get(key)
+
+    def get_xpath(self, node) -> str:
+        return node.getroottree().getpath(node)
+
+
+# The attributes to which libxml2 gives their name as value when it is omitted, e.g.
+# `<input disabled>`; other attributes without a value are empty
+_LIBXML2_BOOLEAN_ATTRS = frozenset(
+    [
+        "checked", "compact", "declare", "defer", "disabled", "ismap", "multiple",
+        "nohref", "noresize", "noshade", "nowrap", "readonly", "selected",
+    ]
+)
+
+
+class SelectolaxBackend(ParserBackend):
+    """
+    A faster backend, based on the lexbor parser of selectolax (`pip install selectolax`).
+    Lexbor builds the tree of the HTML5 specification, which can differ from that of
+    libxml2 for malformed HTML and in the whitespace around `<head>` and `<body>`; the page
+    snapshots of WebLINX, serialized by the browser, mostly give the same elements.
+    """
+
+    name = "selectolax"
+
+    def parse(self, html: str):
+        try:
+            from selectolax.lexbor import LexborHTMLParser
+        except ImportError:
+            raise ImportError(
+                "Please install selectolax to use this backend: `pip install selectolax`"
+            )
+
+        return LexborHTMLParser(html)
+
+    def iter_elements(self, document, attribute: str = None):
+        if attribute is not None:
+            return document.css(f"[{attribute}]")
+
+        root = document.root
+        if root is None:
+            return iter(())
+        return (node for node in root.traverse(include_text=False) if node.is_element_node)
+
+    def get_tag(self, node) -> str:
+        # Lexbor keeps the case of SVG tags, such as clipPath
+        return node.tag.lower()
+
+    def get_text(self, node) -> str:
+        child = node.child
+        if child is not None and child.is_text_node:
+            return child.text_content
+        return ""
+
+    def get_attributes(self, node) -> dict:
+        return {
+            key.lower(): (
+                value
+                if value is not None
+                else (key.lower() if key.lower() in _LIBXML2_BOOLEAN_ATTRS else "")
+            )
+            for key, value in node.attributes.items()
+        }
+
+    def get_attribute(self, node, key: str) -> str:
+        value = node.attrs.get(key)
+        if value is None and key in node.attrs:
+            return self.get_attributes(node)[key.lower()]
+        return value
+
+    def _add_children_paths(self, parent, parent_path, paths):
+        # The paths of the element children of parent, with their index among the children
+        # with the same tag when there are several, as getpath writes them
+        children = [child for child in parent.iter(include_text=False) if child.is_element_node]
+        tags = [child.tag.lower() for child in children]
+        counts = {}
+        for tag in tags:
+            counts[tag] = counts.get(tag, 0) + 1
+        seen = {}
+        for child, tag in zip(children, tags):
+            index = seen[tag] = seen.get(tag, 0) + 1
+            step = tag if counts[tag] == 1 else f"{tag}[{index}]"
+            paths[child.mem_id] = f"{parent_path}/{step}"
+
+    def get_xpaths(self, nodes) -> list:
+        # The paths are computed once per parent, for all its children, from the path of
+        # the parent
+        paths = {}
+        xpaths = []
+        for node in nodes:
+            path = paths.get(node.mem_id)
+            if path is None:
+                # The ancestors whose path is not known yet, from the node upwards
+                ancestors = []
+                while node is not None and node.is_element_node and node.mem_id not in paths:
+                    ancestors.append(node)
+                    node = node.parent
+                for ancestor in reversed(ancestors):
+                    parent = ancestor.parent
+                    parent_path = paths.get(parent.mem_id, "") if parent.is_element_node else ""
+                    self._add_children_paths(parent, parent_path, paths)
+                path = paths[ancestors[0].mem_id]
+            xpaths.append(path)
+        return xpaths
+
+    def get_xpath(self, node) -> str:
+        return self.get_xpaths([node])[0]
+
+
+PARSER_BACKENDS = {"lxml": LxmlBackend, "selectolax": SelectolaxBackend}
+_parser_backend_instances = {}
+
+
+def register_parser_backend(name: str, backend_cls):
+    """
+    Registers a subclass of ParserBackend, so that it can be picked by `name`.
+    """
+    PARSER_BACKENDS[name] = backend_cls
+    _parser_backend_instances.pop(name, None)
+
+
+def get_parser_backend(backend="lxml") -> ParserBackend:
+    """
+    Returns the backend registered as `backend`, or `backend` itself if it is already a
+    ParserBackend instance.
+
+    Raises
+    ------
+    ValueError
+        If no backend is registered under that name.
+    """
+    if isinstance(backend, ParserBackend):
+        return backend
+
+    if backend not in PARSER_BACKENDS:
+        raise ValueError(
+            f"Invalid backend '{backend}'. Must be one of {list(PARSER_BACKENDS)}."
+        )
+
+    instance = _parser_backend_instances.get(backend)
+    if instance is None:
+        instance = _parser_backend_instances[backend] = PARSER_BACKENDS[backend]()
+    return instance
+
+
+def get_xpaths_by_uid(html: str, uid_key="data-webtasks-id", backend="lxml") -> dict:
+    """
+    Returns a dict mapping the uid of each element of `html` to its xpath. If several
+    elements have the same uid, the last one is kept.
+    """
+    backend = get_parser_backend(backend)
+    document = backend.parse(html)
+    nodes = list(backend.iter_elements(document, uid_key))
+    uids = [backend.get_attribute(node, uid_key) for node in nodes]
+    return dict(zip(uids, backend.get_xpaths(nodes)))
+
+
+def list_elements(
+    html: str, bboxes: dict = None, uid_key="data-webtasks-id", backend="lxml"
+) -> list:
+    """
+    Lists the elements of `html` that have a uid, in document order, as dicts with the keys
+    "uid", "tag", "xpath", "text", "attributes" and, if `bboxes` is given, "bbox". With
+    `bboxes`, only the elements that have a bounding box are listed.
+
+    Parameters
+    ----------
+    html : str
+        The HTML of the page.
+
+    bboxes : dict, optional
+        The bounding boxes of the elements, by uid, e.g. `turn.bboxes` or the result of
+        `weblinx.utils.html.filter_bboxes`.
+
+    uid_key : str, optional
+        The key to use as the unique identifier. Defaults to "data-webtasks-id".
+
+    backend : str or ParserBackend, optional
+        The parser backend, see `get_parser_backend`. Defaults to "lxml".
+    """
+    backend = get_parser_backend(backend)
+    document = backend.parse(html)
+
+    nodes = []
+    attributes = []
+    for node in backend.iter_elements(document, uid_key):
+        attrs = backend.get_attributes(node)
+        if bboxes is None or attrs[uid_key] in bboxes:
+            nodes.append(node)
+            attributes.append(attrs)
+
+    elements = []
+    for node, attrs, xpath in zip(nodes, attributes, backend.get_xpaths(nodes)):
+        element = {
+            "uid": attrs[uid_key],
+            "tag": backend.get_tag(node),
+            "xpath": xpath,
+            "text": backend.get_text(node),
+            "attributes": attrs,
+        }
+        if bboxes is not None:
+            element["bbox"] = bboxes[attrs[uid_key]]
+        elements.append(element)
+
+    return elements
+
+
+def compare_parser_backends(
+    html: str,
+    backend,
+    reference="lxml",
+    uid_key="data-webtasks-id",
+    normalize_whitespace=True,
+) -> dict:
+    """
+    Compares the elements listed by `list_elements` with `backend` and `reference` on `html`,
+    matched by uid. Returns a dict with the number of uids in the reference, the uids missing
+    from `backend` and the extra ones, and for each of "tag", "xpath", "text" and
+    "attributes", the uids where the two backends differ.
+
+    Parameters
+    ----------
+    normalize_whitespace : bool, optional
+        Whether to compare the texts with their runs of whitespace replaced by a single
+        space and stripped, as in the representations given to the models. Defaults to True.
+    """
+    expected = {e["uid"]: e for e in list_elements(html, uid_key=uid_key, backend=reference)}
+    result = {e["uid"]: e for e in list_elements(html, uid_key=uid_key, backend=backend)}
+
+    differences = {
+        "num_uids": len(expected),
+        "missing_uids": [uid for uid in expected if uid not in result],
+        "extra_uids": [uid for uid in result if uid not in expected],
+    }
+    for key in ["tag", "xpath", "text", "attributes"]:
+        differences[key] = []
+
+    for uid, element in expected.items():
+        if uid not in result:
+            continue
+        for key in ["tag", "xpath", "text", "attributes"]:
+            a, b = element[key], result[uid][key]
+            if key == "text" and normalize_whitespace:
+                a, b = " ".join(a.split()), " ".join(b.split())
+            if a != b:
+                differences[key].append(uid)
+
+    return differences
+
+
+HTML_ESCAPE_TABLE = [
+    ("&quot;", '"'),
+    ("&amp;", "&"),
+    ("&lt;", "<"),
+    ("&gt;", ">"),
+    ("&nbsp;", " "),
+    ("&ndash;", "-"),
+    ("&rsquo;", "'"),
+    ("&lsquo;", "'"),
+    ("&ldquo;", '"'),
+    ("&rdquo;", '"'),
+    ("&#39;", "'"),
+    ("&#40;", "("),
+    ("&#41;", ")"),
+]
+
+# A newline in a tag (in an attribute value), which the regular expressions of
+# `_convert_tree_repr` do not match across
+_NEWLINE_IN_TAG = re.compile(r"\n[^<>]*>")
+_END_TAG = re.compile(r"</[^>]+>")
+_TAG = re.compile(r"<(/?)([^\s>]+)[^>]*>")
+
+
+def _convert_tree_repr(tree_repr: str, keep_html_brackets=False) -> str:
+    """
+    The original conversion of the HTML serialized by lxml into the representation of
+    `get_tree_repr_simple`, used when `_convert_tree_repr_fast` does not apply.
+    """
+    tree_repr = re.sub(r"<text>(.*?)</text>", r"\1", tree_repr)
+    if not keep_html_brackets:
+        tree_repr = tree_repr.replace("/>", "$/$>")
+        tree_repr = re.sub(r"</(.+?)>", r")", tree_repr)
+        tree_repr = re.sub(r"<(.+?)>", r"(\1", tree_repr)
+        tree_repr = tree_repr.replace("$/$", ")")
+    for k, v in HTML_ESCAPE_TABLE:
+        tree_repr = tree_repr.replace(k, v)
+    tree_repr = re.sub(r"\s+", " ", tree_repr).strip()
+
+    # Replace all whitespace bewtween two ) ) with no space
+    tree_repr = re.sub(r"\) +\)", r"))", tree_repr)
+    # Replace all whitespace bewtween two ( ( with no space
+    tree_repr = re.sub(r"\( +\(", r"((", tree_repr)
+    return tree_repr
+
+
+def _supports_fast_tree_repr(tree, tree_repr: str) -> bool:
+    """
+    Whether every "<" and ">" of `tree_repr`, the HTML of `tree`, delimits a tag or a comment,
+    on a single line, and the conversion of `_convert_tree_repr` amounts to replacing the
+    brackets. lxml escapes them in text and attribute values, but not in scripts, styles and
+    comments, and `<text>` elements are unwrapped by the conversion.
+    """
+    import lxml.etree
+
+    for node in tree.iter(
+        lxml.etree.Comment,
+        lxml.etree.ProcessingInstruction,
+        "script",
+        "style",
+        "SCRIPT",
+        "STYLE",
+        "text",
+    ):
+        if node.tag == "text" or node.tag is lxml.etree.ProcessingInstruction:
+            return False
+        text = node.text or ""
+        if "<" in text or ">" in text or (node.tag is lxml.etree.Comment and "\n" in text):
+            return False
+    if "$" in tree_repr and "$/$" in tree_repr:
+        return False
+    if "\n" in tree_repr and _NEWLINE_IN_TAG.search(tree_repr):
+        return False
+    return True
+
+
+def _convert_tree_repr_fast(tree_repr: str, keep_html_brackets=False) -> str:
+    """
+    Same as `_convert_tree_repr` for the trees accepted by `_supports_fast_tree_repr`, with a
+    few passes of string methods instead of regular expressions over the whole string.
+    """
+    if not keep_html_brackets:
+        tree_repr = _END_TAG.sub(")", tree_repr)
+        tree_repr = tree_repr.replace("<", "(").replace(">", "")
+    if "&" in tree_repr:
+        for k, v in HTML_ESCAPE_TABLE:
+            if k in tree_repr:
+                tree_repr = tree_repr.replace(k, v)
+    # Collapses and strips the whitespace, which leaves single spaces between parentheses
+    tree_repr = " ".join(tree_repr.split())
+    return tree_repr.replace(") )", "))").replace("( (", "((")
+
+
+class _TreeReprWriter:
+    """
+    Writes the pieces of a tree representation one at a time, collapsing the whitespace as
+    `_convert_tree_repr` does over the whole string, and keeping track of the length written.
+    """
+
+    def __init__(self):
+        self.parts = []
+        self.length = 0
+        self.pending_space = False
+        self.last_char = None
+        # Whether the last character is the second parenthesis of a ") )" or "( (" whose
+        # space was removed, so it cannot start another one
+        self.last_merged = False
+
+    def write(self, piece: str) -> int:
+        """
+        Writes `piece` and returns the position of its first non-whitespace character.
+        """
+        if "&" in piece:
+            for k, v in HTML_ESCAPE_TABLE:
+                if k in piece:
+                    piece = piece.replace(k, v)
+
+        words = piece.split()
+        if not words:
+            self.pending_space = self.pending_space or bool(piece)
+            return self.length
+
+        if piece[0].isspace():
+            self.pending_space = True
+
+        first_position = None
+        for word in words:
+            merged = False
+            if self.pending_space and self.last_char is not None:
+                if word[0] == self.last_char and word[0] in "()" and not self.last_merged:
+                    merged = True
+                else:
+                    self.parts.append(" ")
+                    self.length += 1
+            if first_position is None:
+                first_position = self.length
+            self.parts.append(word)
+            self.length += len(word)
+            self.last_char = word[-1]
+            self.last_merged = merged and len(word) == 1
+            self.pending_space = True
+
+        self.pending_space = piece[-1].isspace()
+        return first_position
+
+    def getvalue(self) -> str:
+        return "".join(self.parts)
+
+
+def _get_tree_repr_with_offsets(tree, serialized: str):
+    """
+    Converts `serialized`, the HTML of `tree`, tag by tag, and returns the representation and
+    the (start, end) offsets of every element in it.
+    """
+    import lxml.etree
+
+    writer = _TreeReprWriter()
+    elements = tree.iter(lxml.etree.Element)
+    offsets = {}
+    # Elements whose end tag is not reached yet, with the end of their start tag
+    stack = []
+    position = 0
+
+    for match in _TAG.finditer(serialized):
+        writer.write(serialized[position : match.start()])
+        position = match.end()
+        is_end_tag, tag = match.group(1), match.group(2)
+
+        if tag.startswith("!--"):
+            writer.write("(" + match.group(0)[1:-1])
+            continue
+
+        if not is_end_tag:
+            element = next(elements)
+            start = writer.write("(" + match.group(0)[1:-1])
+            stack.append((element, start, writer.length))
+            continue
+
+        writer.write(")")
+        # Elements without end tag (e.g. <input>) end with their start tag
+        while stack:
+            element, start, start_tag_end = stack.pop()
+            if element.tag == tag:
+                offsets[element] = (start, writer.length)
+                break
+            offsets[element] = (start, start_tag_end)
+
+    writer.write(serialized[position:])
+    for element, start, start_tag_end in stack:
+        offsets[element] = (start, start_tag_end)
+
+    return writer.getvalue(), offsets
+
+
 def get_tree_repr_simple(
     tree: "lxml.html.HtmlElement",
     keep_html_brackets=False,
     copy=True,
     postfix="\nAbove are the pruned HTML contents of the page.",
+    return_offsets=False,
 ):
     """
     This will return a simple representation of the tree in a string format.
@@ -25,14 +698,21 @@ def get_tree_repr_simple(
     keep_html_brackets : bool, optional
         Whether to keep the HTML brackets or not. Defaults to False.
     copy : bool, optional
-        Whether to copy the tree or not. Defaults to True.
+        Kept for compatibility. The tree is only serialized, never modified, so it is not copied.
     postfix : str, optional
         A string to append to the end of the tree representation. Defaults to "\nAbove are the pruned HTML contents of the page.".
+    return_offsets : bool, optional
+        Whether to also return the character offsets of each element in the representation,
+        as a dict mapping each element to its (start, end) offsets, e.g. to find which part of
+        the representation an element produced. The offsets are None for the trees converted
+        with the original regular expressions (see Note). Requires `keep_html_brackets=False`.
+        Defaults to False.
 
     Returns
     -------
     str
-        The string representation of the tree.
+        The string representation of the tree, or a tuple of the representation and the
+        offsets if `return_offsets` is True.
 
     Raises
     ------
@@ -43,52 +723,38 @@ def get_tree_repr_simple(
     ----
     This function is based on the works of Mind2Web (@xiang-deng). Copyrights belong
     to the original author. The original code can be found here at osu-nlp-group/mind2web
+
+    The tree is serialized once by lxml, then converted with a few passes of string methods
+    instead of the regular expressions of the original function. These are only used for the
+    trees that need them: with `<text>` elements or processing instructions, "<" or ">" in
+    scripts, styles or comments, or newlines in attribute values. Both give the same result.
     """
     try:
         import lxml.html
     except ImportError:
         raise ImportError("Please install lxml to use this function")
 
-    if tree is None:
-        return None
+    if return_offsets and keep_html_brackets:
+        raise ValueError("return_offsets requires keep_html_brackets=False")
 
-    if copy:
-        tree = deepcopy(tree)
+    if tree is None:
+        return (None, None) if return_offsets else None
 
-    tree_repr = lxml.html.tostring(tree, encoding="unicode")
-    # tree_repr = tree_repr.replace('"', " ")
-    tree_repr = re.sub(r"<text>(.*?)</text>", r"\1", tree_repr)
-    if not keep_html_brackets:
-        tree_repr = tree_repr.replace("/>", "$/$>")
-        tree_repr = re.sub(r"</(.+?)>", r")", tree_repr)
-        tree_repr = re.sub(r"<(.+?)>", r"(\1", tree_repr)
-        tree_repr = tree_repr.replace("$/$", ")")
-    html_escape_table = [
-        ("&quot;", '"'),
-        ("&amp;", "&"),
-        ("&lt;", "<"),
-        ("&gt;", ">"),
-        ("&nbsp;", " "),
-        ("&ndash;", "-"),
-        ("&rsquo;", "'"),
-        ("&lsquo;", "'"),
-        ("&ldquo;", '"'),
-        ("&rdquo;", '"'),
-        ("&#39;", "'"),
-        ("&#40;", "("),
-        ("&#41;", ")"),
-    ]
-    for k, v in html_escape_table:
-        tree_repr = tree_repr.replace(k, v)
-    tree_repr = re.sub(r"\s+", " ", tree_repr).strip()
+    serialized = lxml.html.tostring(tree, encoding="unicode")
+    offsets = None
 
-    # Replace all whitespace bewtween two ) ) with no space
-    tree_repr = re.sub(r"\) +\)", r"))", tree_repr)
-    # Replace all whitespace bewtween two ( ( with no space
-    tree_repr = re.sub(r"\( +\(", r"((", tree_repr)
+    if not _supports_fast_tree_repr(tree, serialized):
+        tree_repr = _convert_tree_repr(serialized, keep_html_brackets=keep_html_brackets)
+    elif return_offsets:
+        tree_repr, offsets = _get_tree_repr_with_offsets(tree, serialized)
+    else:
+        tree_repr = _convert_tree_repr_fast(serialized, keep_html_brackets=keep_html_brackets)
 
     if postfix is not None:
         tree_repr = tree_repr + postfix
+
+    if return_offsets:
+        return tree_repr, offsets
     return tree_repr
 
 
@@ -142,34 +808,20 @@ def sanitize_elem_attributes(
     ImportError
         If the lxml library is not installed.
     """
-    for node in tree.iter():
-        if node.attrib is None:
-            continue
-
-        for k, v in node.attrib.items():
-            if remove_underscore_attrs and k.startswith("_"):
-                node.attrib.pop(k)
-
-            if remove_angular_attrs and k.startswith("ng"):
-                node.attrib.pop(k)
-
-            if remove_alpine_attrs and k.startswith("x-"):
-                node.attrib.pop(k)
-
-            if remove_xml_attrs and k.startswith("xml"):
-                node.attrib.pop(k)
-
-            if remove_google_attrs and k.startswith("js"):
-                node.attrib.pop(k)
-
-            if k == uid_key:
-                continue
-
-            if remove_data_attrs and k.startswith("data-"):
-                node.attrib.pop(k)
-
-            if remove_id_attrs and k == "id":
-                node.attrib.pop(k)
+    rules = CleaningRules(
+        attribute_rules=_get_sanitize_attribute_rules(
+            remove_data_attrs=remove_data_attrs,
+            remove_underscore_attrs=remove_underscore_attrs,
+            remove_angular_attrs=remove_angular_attrs,
+            remove_alpine_attrs=remove_alpine_attrs,
+            remove_xml_attrs=remove_xml_attrs,
+            remove_google_attrs=remove_google_attrs,
+            remove_id_attrs=remove_id_attrs,
+        ),
+        remove_comments=False,
+        uid_key=uid_key,
+    )
+    rules.clean(tree)
 
 
 def remove_uid_when_not_candidate(dom_tree, candidate_uids, uid_key="data-webtasks-id"):
@@ -223,6 +875,241 @@ def remove_html_comments(dom_tree):
             continue
 
 
+class AttributeRule:
+    """
+    A rule of `CleaningRules`, removing the attributes whose name is one of `names` or starts
+    with one of `prefixes`, from every element or only from the elements whose tag is in `tags`.
+
+    Parameters
+    ----------
+    prefixes : tuple of str, optional
+        The prefixes of the names of the attributes to remove.
+
+    names : tuple of str, optional
+        The names of the attributes to remove.
+
+    tags : tuple of str, optional
+        The tags of the elements the rule applies to. Defaults to None, for every element.
+
+    Example
+    -------
+    ```
+    # Inline event handlers, such as onclick
+    AttributeRule(prefixes=("on",))
+    # Path data of inline SVG
+    AttributeRule(names=("d",), tags=("path",))
+    ```
+    """
+
+    def __init__(self, prefixes=(), names=(), tags=None):
+        self.prefixes = tuple(prefixes)
+        self.names = frozenset(names)
+        self.tags = None if tags is None else frozenset(tags)
+
+    def __repr__(self):
+        return (
+            f"AttributeRule(prefixes={self.prefixes}, names={sorted(self.names)}, "
+            f"tags={None if self.tags is None else sorted(self.tags)})"
+        )
+
+    def matches(self, key: str) -> bool:
+        return key in self.names or key.startswith(self.prefixes)
+
+
+def _get_sanitize_attribute_rules(
+    remove_data_attrs=True,
+    remove_underscore_attrs=True,
+    remove_angular_attrs=True,
+    remove_alpine_attrs=True,
+    remove_xml_attrs=True,
+    remove_google_attrs=True,
+    remove_id_attrs=True,
+):
+    # The rules of sanitize_elem_attributes
+    flags_and_rules = [
+        (remove_underscore_attrs, AttributeRule(prefixes=("_",))),
+        (remove_angular_attrs, AttributeRule(prefixes=("ng",))),
+        (remove_alpine_attrs, AttributeRule(prefixes=("x-",))),
+        (remove_xml_attrs, AttributeRule(prefixes=("xml",))),
+        (remove_google_attrs, AttributeRule(prefixes=("js",))),
+        (remove_data_attrs, AttributeRule(prefixes=("data-",))),
+        (remove_id_attrs, AttributeRule(names=("id",))),
+    ]
+    return [rule for flag, rule in flags_and_rules if flag]
+
+
+class CleaningRules:
+    """
+    A set of rules to clean a tree in a single traversal: the HTML comments are removed, the
+    uids of the elements that are not candidates are removed, and so are the attributes
+    matched by any of the `attribute_rules`. Adding rules does not add traversals: the rules
+    that apply to every element are compiled into one prefix test, whose result is cached for
+    each attribute name.
+
+    Parameters
+    ----------
+    attribute_rules : list of AttributeRule, optional
+        The rules removing attributes. Defaults to None, for the rules of
+        `sanitize_elem_attributes` with its default arguments.
+
+    remove_comments : bool, optional
+        Whether to remove the HTML comments. Defaults to True.
+
+    uid_key : str, optional
+        The key to use as the unique identifier, which is never removed by the attribute
+        rules. Defaults to "data-webtasks-id".
+
+    Example
+    -------
+    ```
+    from weblinx.processing.dom import AttributeRule, CleaningRules, clean_and_prune_tree
+
+    rules = CleaningRules().with_rules(
+        AttributeRule(names=("style",)),
+        AttributeRule(prefixes=("on",)),
+        AttributeRule(names=("d",), tags=("path",)),
+    )
+    dom_tree = clean_and_prune_tree(dom_tree, cands_turn, rules=rules)
+    ```
+    """
+
+    # Bounds the cache of decisions, for pages generating attribute names
+    max_cached_names = 10000
+
+    def __init__(
+        self, attribute_rules=None, remove_comments=True, uid_key="data-webtasks-id"
+    ):
+        if attribute_rules is None:
+            attribute_rules = _get_sanitize_attribute_rules()
+
+        self.attribute_rules = list(attribute_rules)
+        self.remove_comments = remove_comments
+        self.uid_key = uid_key
+
+        global_rules = [rule for rule in self.attribute_rules if rule.tags is None]
+        self._rule = AttributeRule(
+            prefixes=[p for rule in global_rules for p in rule.prefixes],
+            names=[n for rule in global_rules for n in rule.names],
+        )
+        self._tag_rules = {}
+        for rule in self.attribute_rules:
+            for tag in rule.tags or ():
+                self._tag_rules.setdefault(tag, []).append(rule)
+        self._decisions = {uid_key: False}
+
+    def __repr__(self):
+        return (
+            f"CleaningRules(attribute_rules={self.attribute_rules}, "
+            f"remove_comments={self.remove_comments}, uid_key={self.uid_key!r})"
+        )
+
+    def with_rules(self, *attribute_rules) -> "CleaningRules":
+        """
+        Returns new rules, with `attribute_rules` added to these ones.
+        """
+        return CleaningRules(
+            attribute_rules=self.attribute_rules + list(attribute_rules),
+            remove_comments=self.remove_comments,
+            uid_key=self.uid_key,
+        )
+
+    def _remove_for_all_tags(self, key: str) -> bool:
+        decision = self._decisions.get(key)
+        if decision is None:
+            decision = self._rule.matches(key)
+            if len(self._decisions) >= self.max_cached_names:
+                self._decisions = {self.uid_key: False}
+            self._decisions[key] = decision
+        return decision
+
+    def removes_attribute(self, tag: str, key: str) -> bool:
+        """
+        Whether the attribute `key` of an element with the tag `tag` is removed.
+        """
+        if self._remove_for_all_tags(key):
+            return True
+        if key == self.uid_key:
+            return False
+        return any(rule.matches(key) for rule in self._tag_rules.get(tag, ()))
+
+    def clean(self, dom_tree, candidate_uids=None):
+        """
+        Cleans `dom_tree` in place. If `candidate_uids` is given, the uids that are not in it
+        are removed, as `remove_uid_when_not_candidate` does.
+
+        Raises
+        ------
+        ImportError
+            If the lxml library is not installed.
+        """
+        try:
+            import lxml.html
+        except ImportError:
+            raise ImportError("Please install lxml to use this function")
+
+        if candidate_uids is not None:
+            candidate_uids = set(candidate_uids)
+
+        uid_key = self.uid_key
+        tag_rules = self._tag_rules
+        remove_for_all_tags = self._remove_for_all_tags
+
+        # The iterator has found the next node before the current one is dropped
+        for node in dom_tree.iter():
+            tag = node.tag
+            if not isinstance(tag, str):
+                if self.remove_comments and isinstance(node, lxml.html.HtmlComment):
+                    node.drop_tree()
+                continue
+
+            keys = node.keys()
+            if not keys:
+                continue
+
+            if candidate_uids is not None:
+                uid = node.get(uid_key)
+                if uid is not None and uid not in candidate_uids:
+                    del node.attrib[uid_key]
+
+            # Collected first, instead of removed while iterating over the attributes
+            if tag in tag_rules:
+                keys = [k for k in keys if self.removes_attribute(tag, k)]
+            else:
+                keys = [k for k in keys if remove_for_all_tags(k)]
+            if keys:
+                attrib = node.attrib
+                for key in keys:
+                    del attrib[key]
+
+        return dom_tree
+
+
+def clean_tree(dom_tree, rules: CleaningRules = None, candidate_uids=None):
+    """
+    Cleans `dom_tree` in place with `rules`, in a single traversal, and returns it. This does
+    the same as `remove_uid_when_not_candidate` (if `candidate_uids` is given),
+    `remove_html_comments` and `sanitize_elem_attributes` one after the other.
+
+    Parameters
+    ----------
+    dom_tree : lxml.html.HtmlElement
+        The tree to clean.
+
+    rules : CleaningRules, optional
+        The rules to apply. Defaults to None, for `CleaningRules()`.
+
+    candidate_uids : list, optional
+        The uids to keep. Defaults to None, to keep every uid.
+    """
+    if rules is None:
+        rules = DEFAULT_CLEANING_RULES
+
+    return rules.clean(dom_tree, candidate_uids=candidate_uids)
+
+
+DEFAULT_CLEANING_RULES = CleaningRules()
+
+
 def get_descendants(node, max_depth, current_depth=0):
     """
     This function was originally written by @xiang-deng for the [mind2web repository](https://github.com/OSU-NLP-Group/Mind2Web/blob/3740087ab004fe98a117f6261cb1937dfc9fa66e/src/data_utils/dom_utils.py)
@@ -240,6 +1127,88 @@ def get_descendants(node, max_depth, current_depth=0):
     return descendants
 
 
+def _iter_descendants(node, max_depth, current_depth=0):
+    # Lazy version of get_descendants, in the same order
+    if current_depth > max_depth:
+        return
+
+    for child in node:
+        yield child
+        yield from _iter_descendants(child, max_depth, current_depth + 1)
+
+
+def _build_uid_index(dom_tree, uid_key):
+    """
+    Maps the uid of every element of the document of `dom_tree` to the first element with
+    this uid, in document order, as the first result of `//*[@uid_key="..."]`.
+    """
+    import lxml.etree
+
+    index = {}
+    for node in dom_tree.getroottree().iter(lxml.etree.Element):
+        uid = node.get(uid_key)
+        if uid is not None and uid not in index:
+            index[uid] = node
+    return index
+
+
+def _copy_node(node, parent_copy=None):
+    """
+    Copies `node` without its children, with its text and tail, appending it to `parent_copy`.
+    """
+    import lxml.html
+
+    node_copy = None
+    if isinstance(node.tag, str):
+        try:
+            if parent_copy is not None:
+                node_copy = parent_copy.makeelement(node.tag, node.attrib)
+            else:
+                # The root of a new document with the same parser, as with deepcopy
+                parser = node.getroottree().parser or lxml.html.html_parser
+                node_copy = parser.makeelement(node.tag, node.attrib)
+        except ValueError:
+            # Names accepted by the HTML parser but not by the API, e.g. `<foo:bar>`
+            pass
+
+    if node_copy is None:
+        # Comments, processing instructions and unusual names: copy the node, then drop
+        # the copies of its children
+        node_copy = deepcopy(node)
+        for child in list(node_copy):
+            node_copy.remove(child)
+    else:
+        node_copy.text = node.text
+
+    node_copy.tail = node.tail
+    if parent_copy is not None:
+        parent_copy.append(node_copy)
+    return node_copy
+
+
+def _copy_kept_nodes(dom_tree, nodes_to_keep, uid_key):
+    """
+    Copies the nodes of `dom_tree` that are not removed by `prune_tree`: the root, then every
+    node whose parent is copied and that is either not an element (a comment), an element
+    whose uid is in `nodes_to_keep`, or a "text" element whose parent's uid is.
+    """
+    new_tree = _copy_node(dom_tree)
+    stack = [(dom_tree, new_tree)]
+    while stack:
+        node, node_copy = stack.pop()
+        parent_is_keep = node.get(uid_key, "") in nodes_to_keep
+        for child in node:
+            if isinstance(child.tag, str):
+                if child.tag != "text":
+                    is_keep = child.get(uid_key, "") in nodes_to_keep
+                else:
+                    is_keep = parent_is_keep
+                if not is_keep:
+                    continue
+            stack.append((child, _copy_node(child, node_copy)))
+    return new_tree
+
+
 def prune_tree(
     dom_tree: "lxml.html.HtmlElement",
     candidate_set,
@@ -252,32 +1221,36 @@ def prune_tree(
     This function was originally written by @xiang-deng for the [mind2web repository](https://github.com/OSU-NLP-Group/Mind2Web/blob/3740087ab004fe98a117f6261cb1937dfc9fa66e/src/data_utils/dom_utils.py#L203)
 
     It was modified to allow uid_key to be specified. All rights belong to the original author.
+
+    The candidates are found with an index of the uids built in one traversal, instead of an
+    xpath query per candidate, and only the nodes that are kept are copied, instead of the
+    whole tree. The result is the same as the original function's. `dom_tree` is not modified.
     """
+    uid_index = _build_uid_index(dom_tree, uid_key)
+
     nodes_to_keep = set()
     for candidate_id in candidate_set:
-        try:
-            xpath = dom_tree.xpath(f'//*[@{uid_key}="{candidate_id}"]')
-        except:
+        candidate_id = f"{candidate_id}"
+        # The original xpath query failed for such ids, and the candidate was skipped
+        if '"' in candidate_id:
             continue
 
-        # If len(xpath) == 0, then the candidate node is not in the tree
-        # So we skip it
-        if len(xpath) <= 0:
+        # If the candidate is not in the index, then it is not in the tree, so we skip it
+        candidate_node = uid_index.get(candidate_id)
+        if candidate_node is None:
             continue
 
-        candidate_node = xpath[0]
         nodes_to_keep.add(candidate_node.attrib[uid_key])
         # get all ancestors
         nodes_to_keep.update(
-            [x.attrib.get(uid_key, "") for x in candidate_node.xpath("ancestor::*")]
+            [x.attrib.get(uid_key, "") for x in candidate_node.iterancestors()]
         )
         # get descendants with max depth
-        nodes_to_keep.update(
-            [
-                x.attrib.get(uid_key, "")
-                for x in get_descendants(candidate_node, max_depth)
-            ][:max_children]
-        )
+        if max_children is not None and max_children >= 0:
+            descendants = islice(_iter_descendants(candidate_node, max_depth), max_children)
+        else:
+            descendants = get_descendants(candidate_node, max_depth)[:max_children]
+        nodes_to_keep.update([x.attrib.get(uid_key, "") for x in descendants])
         # get siblings within range
         parent = candidate_node.getparent()
         if parent is not None:
@@ -296,39 +1269,34 @@ def prune_tree(
                     ]
                 ]
             )
-    # clone the tree
-    new_tree = deepcopy(dom_tree)
-    # remove nodes not in nodes_to_keep
+    # copy the nodes that are kept, i.e. the tree with the nodes not in nodes_to_keep removed
+    new_tree = _copy_kept_nodes(dom_tree, nodes_to_keep, uid_key)
     for node in new_tree.xpath("//*")[::-1]:
         node: "lxml.html.HtmlElement"
 
         if node.tag != "text":
-            is_keep = node.attrib.get(uid_key, "") in nodes_to_keep
             is_candidate = node.attrib.get(uid_key, "") in candidate_set
         else:
-            is_keep = node.getparent().attrib.get(uid_key, "") in nodes_to_keep
             is_candidate = node.getparent().attrib.get(uid_key, "") in candidate_set
-        if not is_keep and node.getparent() is not None:
+
+        if not is_candidate or node.tag == "text":
+            node.attrib.pop(uid_key, None)
+        if (
+            len(node.attrib) == 0
+            and not any([x.tag == "text" for x in node.getchildren()])
+            and node.getparent() is not None
+            and node.tag != "text"
+            and len(node.getchildren()) <= 1
+        ):
+            # insert all children into parent
+            for child in node.getchildren():
+                node.addprevious(child)
             node.getparent().remove(node)
-        else:
-            if not is_candidate or node.tag == "text":
-                node.attrib.pop(uid_key, None)
-            if (
-                len(node.attrib) == 0
-                and not any([x.tag == "text" for x in node.getchildren()])
-                and node.getparent() is not None
-                and node.tag != "text"
-                and len(node.getchildren()) <= 1
-            ):
-                # insert all children into parent
-                for child in node.getchildren():
-                    node.addprevious(child)
-                node.getparent().remove(node)
     return new_tree
 
 
 def clean_and_prune_tree(
-    dom_tree, cands_turn, max_depth=1, max_children=5, max_sibling=2
+    dom_tree, cands_turn, max_depth=1, max_children=5, max_sibling=2, rules=None
 ):
     """
     This function will clean and prune the tree based on the candidates in the cands_turn. This
@@ -352,6 +1320,11 @@ def clean_and_prune_tree(
     max_sibling : int, optional
         The maximum number of siblings to keep for each candidate. Defaults to 2.
 
+    rules : CleaningRules, optional
+        The rules to clean the pruned tree with, in a single traversal. Defaults to None,
+        for `CleaningRules()`, which removes the comments and the attributes removed by
+        `sanitize_elem_attributes`.
+
     Returns
     -------
     lxml.html.HtmlElement
@@ -376,9 +1349,7 @@ def clean_and_prune_tree(
             max_children=max_children,
             max_sibling=max_sibling,
         )
-        remove_uid_when_not_candidate(dom_tree, candidate_uids=candidate_uids)
 
-    remove_html_comments(dom_tree)
-    sanitize_elem_attributes(dom_tree)
+    clean_tree(dom_tree, rules=rules, candidate_uids=candidate_uids)
 
     return dom_tree
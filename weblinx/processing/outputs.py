@@ -149,6 +149,20 @@ def find_intent_and_raw_args(raw_output_string: str) -> dict:
     
     
 
+def has_complete_action(raw_output_string: str) -> bool:
+    """
+    Returns True if the string contains a complete action, i.e. an intent followed by its
+    arguments and the closing bracket, using the same quote-aware logic as
+    `find_intent_and_raw_args`. This allows stopping a generation as soon as an action is output.
+    """
+    intent, raw_args = find_intent_and_raw_args(raw_output_string)
+    if intent == "":
+        return False
+
+    ix_bracket_close = raw_output_string.find("(") + 1 + len(raw_args)
+    return ix_bracket_close < len(raw_output_string)
+
+
 def parse_predicted_output_string(raw_output_string: str) -> dict:
     """
     Given an output string, try to find a substring of format <intent>(<key1>=<value1>, <key2>=<value2>, ...) and return a dictionary of format:
@@ -231,11 +245,19 @@ def get_element_uid_by_coords(turn: "Turn", x, y):
     """
     Given (x,y) coordinates for an element, find the smallest non-zero-sized element that contains the coordinates using bboxes and return its id.
     """
+    from ..utils.bboxes import get_bbox_table
+
     bboxes = turn.bboxes
 
     if not bboxes:
         return None
 
+    # The table is built once the same bboxes dict is searched again (e.g. for another
+    # prediction, or another turn of the same snapshot), since a single loop is faster
+    table = get_bbox_table(bboxes, min_requests=2)
+    if table is not None:
+        return table.find_smallest_containing(x, y)
+
     # find the smallest element that contains the coordinates
     min_elem_size = None
     elem_uid = None
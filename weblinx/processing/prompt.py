@@ -353,9 +353,7 @@ def find_turns_with_instructor_chat(
     This output of this function should be used by format_utterances to display the utterances.
     """
     start_index = max(0, turn.index - num_prev_turns)
-    instructor_chat_turns = replay.filter_turns(
-        lambda turn: turn.get("speaker") == speaker and turn.index < start_index
-    )
+    instructor_chat_turns = replay.filter_by_speaker(speaker, end=start_index)
     return instructor_chat_turns
 
 
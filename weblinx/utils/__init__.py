@@ -7,7 +7,7 @@ import hashlib
 import json
 from importlib.util import find_spec
 
-from . import url, envs, html, recs
+from . import url, envs, html, recs, store, cache, archive, parallel
 
 
 def shorten_text(s, max_length=100):
@@ -250,6 +250,89 @@ def auto_save_json(data, path, backend="auto", indent=0):
         )
 
 
+def read_replay_journal(path, backend="auto", encoding=None):
+    """
+    Reads an append-only replay journal, which is a JSONL file where each line is a record
+    of the form `{"op": "append" | "replace_last", "index": int, "turn": dict}`. If the
+    last line is incomplete (e.g. the process crashed while writing it), it is ignored.
+
+    Parameters
+    ----------
+    path : str or Path
+        The path to the journal file.
+
+    backend : str, optional
+        The JSON backend to use, either 'auto', 'json', 'ujson', or 'orjson'. Defaults to 'auto'.
+
+    encoding : str, optional
+        The encoding to use when reading the file. Defaults to the system's default encoding.
+
+    Returns
+    -------
+    list of dict
+        The records of the journal, in the order they were written.
+    """
+    if backend in ["auto", "orjson"] and find_spec("orjson"):
+        import orjson as json_lib
+    elif backend in ["auto", "ujson"] and find_spec("ujson"):
+        import ujson as json_lib
+    else:
+        json_lib = json
+
+    with open(path, encoding=encoding) as f:
+        lines = f.read().split("\n")
+
+    records = []
+    for i, line in enumerate(lines):
+        if not line.strip():
+            continue
+        try:
+            records.append(json_lib.loads(line))
+        except ValueError:
+            # Only the last line can be partially written, anything else is corrupted
+            if i < len(lines) - 1 and any(l.strip() for l in lines[i + 1 :]):
+                raise
+    return records
+
+
+def apply_replay_journal(data: list, records: list) -> list:
+    """
+    Applies the records of a replay journal (see `read_replay_journal`) to the list of turns
+    of a replay, in place. Each record targets an absolute turn index, so applying the same
+    records twice gives the same result.
+
+    Parameters
+    ----------
+    data : list
+        The list of turns, i.e. the "data" key of a replay.json file.
+
+    records : list of dict
+        The records of the journal.
+
+    Returns
+    -------
+    list
+        The updated list of turns.
+    """
+    for record in records:
+        if record["op"] not in ["append", "replace_last"]:
+            raise ValueError(
+                f"Invalid journal op '{record['op']}'. Must be either 'append' or 'replace_last'"
+            )
+
+        index = record["index"]
+        if index < len(data):
+            data[index] = record["turn"]
+        elif index == len(data):
+            data.append(record["turn"])
+        else:
+            raise ValueError(
+                f"Journal record targets turn {index}, but the replay only has {len(data)} turns"
+            )
+
+    return data
+
+
 def save_results(results, result_dir, filename="results.json"):
     result_dir = Path(result_dir).expanduser()
     result_dir.mkdir(parents=True, exist_ok=True)
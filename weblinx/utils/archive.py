@@ -0,0 +1,266 @@
+"""
+A packed archive of demonstrations: their replays, HTML pages, bounding boxes and, optionally,
+the xpaths cached by `Turn.get_xpaths_dict`, in a single indexed file that is read by
+memory-mapping it. Loading a split from an archive opens one file instead of several per turn,
+which matters on network filesystems.
+
+An archive is created with `pack_demonstrations`, or from the command line:
+
+```
+python -m weblinx pack --demos-dir ./demonstrations --split-path splits.json --split train -o train.wlpack
+```
+
+and used wherever a demonstrations directory is expected, as the `base_dir` of `Demonstration`
+(or the `demo_base_dir` of `load_demos_in_split`):
+
+```
+demos = wl.load_demos_in_split("splits.json", split="train", demo_base_dir="train.wlpack")
+turn = wl.Replay.from_demonstration(demos[0])[10]
+turn.html, turn.bboxes  # read from the archive
+```
+
+The file starts with a magic string and the offset and length of the index, followed by the
+content of every file, then the index, a JSON object mapping each demonstration to its files
+and their (offset, length) in the archive.
+"""
+
+import json
+import mmap
+import os
+import struct
+import threading
+from functools import lru_cache
+from importlib.util import find_spec
+from pathlib import Path
+from typing import List, Union
+
+ARCHIVE_MAGIC = b"WLXPACK1"
+ARCHIVE_VERSION = 1
+HEADER_FORMAT = "<8sQQ"
+
+# DemoArchive instances shared by all the demonstrations read from the same file
+_open_archives = {}
+_open_archives_lock = threading.Lock()
+
+
+def _loads_json(data: bytes, backend="auto"):
+    if backend in ["auto", "orjson"] and find_spec("orjson"):
+        import orjson
+
+        return orjson.loads(data)
+    elif backend in ["auto", "ujson"] and find_spec("ujson"):
+        import ujson
+
+        return ujson.loads(data)
+    else:
+        return json.loads(data)
+
+
+def is_archive(path: Union[str, Path]) -> bool:
+    """
+    Returns True if `path` is a file that starts with the magic string of an archive.
+    """
+    return _is_archive(os.path.abspath(path))
+
+
+# Called for every file read by a turn, so each base directory is only checked once
+@lru_cache(maxsize=1024)
+def _is_archive(path: str) -> bool:
+    if not os.path.isfile(path):
+        return False
+    with open(path, "rb") as f:
+        return f.read(len(ARCHIVE_MAGIC)) == ARCHIVE_MAGIC
+
+
+class DemoArchive:
+    """
+    Reads an archive created by `pack_demonstrations`, by memory-mapping it. Files are
+    addressed by demonstration name and their path relative to the demonstration directory,
+    e.g. `archive.read_text("demo_name", "pages/page-3-0.html")`.
+
+    Parameters
+    ----------
+    path : str or Path
+        The path to the archive.
+
+    Note
+    ----
+    Use `DemoArchive.open` to share the archive with every demonstration read from it.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self._open()
+
+    def _open(self):
+        with open(self.path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, index_offset, index_length = struct.unpack_from(HEADER_FORMAT, self.mm, 0)
+        if magic != ARCHIVE_MAGIC:
+            raise ValueError(f"'{self.path}' is not a weblinx archive")
+
+        index = json.loads(self.mm[index_offset : index_offset + index_length])
+        if index["version"] != ARCHIVE_VERSION:
+            raise ValueError(
+                f"Unsupported archive version {index['version']} in '{self.path}', expected {ARCHIVE_VERSION}"
+            )
+        self.demos = index["demos"]
+
+    def __reduce__(self):
+        # The memory map is not pickled, the other process opens the archive itself
+        return (DemoArchive.open, (str(self.path),))
+
+    def __repr__(self):
+        return f"DemoArchive(path={self.path}, num_demos={len(self.demos)})"
+
+    @classmethod
+    def open(cls, path: Union[str, Path]) -> "DemoArchive":
+        """
+        Returns the DemoArchive of `path`, opened once per process.
+        """
+        key = os.path.abspath(path)
+        with _open_archives_lock:
+            if key not in _open_archives:
+                _open_archives[key] = cls(path)
+            return _open_archives[key]
+
+    def list_demo_names(self) -> List[str]:
+        return list(self.demos)
+
+    def list_files(self, demo_name: str, subdir: str = None) -> List[str]:
+        """
+        Returns the paths of the files of a demonstration, relative to its directory, and
+        only the ones in `subdir` if given.
+        """
+        files = self.demos.get(demo_name, {})
+        if subdir is None:
+            return list(files)
+        prefix = subdir.rstrip("/") + "/"
+        return [name for name in files if name.startswith(prefix)]
+
+    def has_file(self, demo_name: str, filename: str) -> bool:
+        return filename in self.demos.get(demo_name, {})
+
+    def get_file_size(self, demo_name: str, filename: str) -> int:
+        return self.demos[demo_name][filename][1]
+
+    def read_bytes(self, demo_name: str, filename: str) -> bytes:
+        try:
+            offset, length = self.demos[demo_name][filename]
+        except KeyError:
+            raise FileNotFoundError(f"File '{filename}' of '{demo_name}' not found in '{self.path}'")
+        return self.mm[offset : offset + length]
+
+    def read_text(self, demo_name: str, filename: str, encoding=None) -> str:
+        return self.read_bytes(demo_name, filename).decode(encoding or "utf-8")
+
+    def read_json(self, demo_name: str, filename: str, backend="auto"):
+        return _loads_json(self.read_bytes(demo_name, filename), backend=backend)
+
+    def read_cached(self, demo_name: str, filename: str, load_fn, kind=None):
+        """
+        Returns `load_fn(demo_name, filename)` (e.g. `self.read_json`) through the file
+        cache of `weblinx.utils.cache`, shared with the files read from directories.
+        """
+        from .cache import file_cache
+
+        return file_cache.get(
+            self.path,
+            lambda _: load_fn(demo_name, filename),
+            kind=(kind, demo_name, filename),
+            size=self.get_file_size(demo_name, filename),
+        )
+
+
+def get_archive(base_dir: Union[str, Path]) -> DemoArchive:
+    """
+    Returns the DemoArchive if `base_dir` is an archive rather than a directory of
+    demonstrations, otherwise None.
+    """
+    if base_dir is None or not is_archive(base_dir):
+        return None
+    return DemoArchive.open(base_dir)
+
+
+def pack_demonstrations(demos: list, output_path: Union[str, Path], xpaths_dir=None, progress=False) -> Path:
+    """
+    Packs demonstrations into a single archive, which can be used as the `base_dir` of
+    `Demonstration`. For each demonstration, this includes its replay (with its replay
+    journal applied), its other JSON files, its HTML pages (from the raw files or the page
+    store), its bounding boxes and, if `xpaths_dir` is given, the xpaths cached there by
+    `Turn.get_xpaths_dict(cache_dir=xpaths_dir)`.
+
+    Parameters
+    ----------
+    demos : list of Demonstration
+        The demonstrations to pack.
+
+    output_path : str or Path
+        The path of the archive to create. It is written to a temporary file first, so an
+        existing archive is only replaced once the new one is complete.
+
+    xpaths_dir : str or Path, optional
+        The cache directory of the xpaths, as given to `Turn.get_xpaths_dict`.
+
+    progress : bool, optional
+        Whether to show a progress bar (requires tqdm).
+
+    Returns
+    -------
+    Path
+        The path of the archive.
+    """
+    from .html import open_html_with_encodings
+    from .store import read_page
+
+    output_path = Path(output_path)
+    tmp_path = output_path.with_name(output_path.name + ".tmp")
+
+    if progress:
+        from tqdm import tqdm
+
+        demos = tqdm(demos, desc="Packing demonstrations")
+
+    index = {"version": ARCHIVE_VERSION, "demos": {}}
+
+    with open(tmp_path, "wb") as f:
+        f.write(struct.pack(HEADER_FORMAT, ARCHIVE_MAGIC, 0, 0))
+
+        for demo in demos:
+            files = index["demos"][demo.name] = {}
+
+            def add(filename, data):
+                files[filename] = [f.tell(), len(data)]
+                f.write(data)
+
+            add("replay.json", json.dumps(demo.replay).encode("utf-8"))
+            for path in sorted(demo.path.glob("*.json")):
+                if path.name != "replay.json":
+                    add(path.name, path.read_bytes())
+
+            for path in demo.list_all_html_pages(return_str=False):
+                html = open_html_with_encodings(path, raise_error=False)
+                if html is None:
+                    html = read_page(path)
+                add(f"pages/{path.name}", html.encode("utf-8"))
+
+            for path in sorted(demo.path.glob("bboxes/bboxes-*.json")):
+                add(f"bboxes/{path.name}", path.read_bytes())
+
+            if xpaths_dir is not None:
+                for path in sorted(Path(xpaths_dir, demo.name).glob("xpaths-*.json")):
+                    add(f"xpaths/{path.name}", path.read_bytes())
+
+        index_offset = f.tell()
+        index_data = json.dumps(index).encode("utf-8")
+        f.write(index_data)
+        f.seek(0)
+        f.write(struct.pack(HEADER_FORMAT, ARCHIVE_MAGIC, index_offset, len(index_data)))
+
+    os.replace(tmp_path, output_path)
+    # The path may have been checked, or opened as an older archive, by this process
+    _is_archive.cache_clear()
+    with _open_archives_lock:
+        _open_archives.pop(os.path.abspath(output_path), None)
+    return output_path
@@ -0,0 +1,250 @@
+"""
+A columnar view of the bounding boxes of a turn: the coordinates of every element are stored in
+NumPy arrays, indexed by uid, so that filtering the boxes by size and viewport, or finding the
+element under a point, is done with array operations instead of a Python loop over thousands
+of dicts.
+
+A table is built once per bounding boxes dict with `get_bbox_table`; since `Turn.bboxes` is
+shared by the turns of a snapshot (see `weblinx.utils.cache`), so is its table.
+
+Example
+-------
+```
+from weblinx.utils.bboxes import get_bbox_table
+
+table = get_bbox_table(turn.bboxes)
+visible = table.filter(viewport_height=turn.viewport_height, viewport_width=turn.viewport_width)
+uid = table.find_smallest_containing(120, 300)
+```
+"""
+
+import threading
+from collections import OrderedDict
+from functools import cached_property
+from itertools import chain
+from operator import itemgetter
+from typing import List
+
+import numpy as np
+
+# Bounding boxes dicts recently requested, keyed by id and validated by identity, with the
+# number of requests and their table once built. The entries keep their dict alive, so they are
+# bounded by the total number of boxes, not by the number of dicts
+_tables = OrderedDict()
+_tables_lock = threading.Lock()
+_num_boxes = 0
+MAX_TABLE_BOXES = 200_000
+
+
+def _read_columns(boxes: list, *keys) -> np.ndarray:
+    # One pass over the boxes, which is where most of the time to build a table goes
+    values = np.fromiter(
+        chain.from_iterable(map(itemgetter(*keys), boxes)),
+        dtype=np.float64,
+        count=len(boxes) * len(keys),
+    )
+    return values.reshape(len(boxes), len(keys)).T
+
+
+class BBoxTable:
+    """
+    The bounding boxes of a turn, as one array per coordinate.
+
+    Parameters
+    ----------
+    bboxes : dict
+        The bounding boxes of a turn, mapping each uid to a dict with the keys "x", "y",
+        "width", "height", "left", "top", "right" and "bottom". Boxes that are None are left
+        out of the table.
+
+    Attributes
+    ----------
+    uids : list of str
+        The uid of each row, in the order of `bboxes`.
+
+    x, y, width, height, left, top, right, bottom : np.ndarray
+        The coordinates of each row, as float64. They are read from `bboxes` the first
+        time they are used.
+
+    Note
+    ----
+    The table keeps a reference to `bboxes` and returns its boxes, so they must not be
+    modified in place.
+    """
+
+    def __init__(self, bboxes: dict):
+        self.bboxes = bboxes
+        self.uids = [uid for uid, box in bboxes.items() if box is not None]
+        if len(self.uids) == len(bboxes):
+            self.boxes = list(bboxes.values())
+        else:
+            self.boxes = [bboxes[uid] for uid in self.uids]
+
+    def __len__(self):
+        return len(self.uids)
+
+    def __contains__(self, uid):
+        return uid in self.rows
+
+    def __repr__(self):
+        return f"BBoxTable(num_boxes={len(self)})"
+
+    @cached_property
+    def rows(self) -> dict:
+        return {uid: i for i, uid in enumerate(self.uids)}
+
+    @cached_property
+    def _sizes(self):
+        return _read_columns(self.boxes, "x", "y", "width", "height")
+
+    @cached_property
+    def _edges(self):
+        return _read_columns(self.boxes, "left", "top", "right", "bottom")
+
+    x = property(lambda self: self._sizes[0])
+    y = property(lambda self: self._sizes[1])
+    width = property(lambda self: self._sizes[2])
+    height = property(lambda self: self._sizes[3])
+    left = property(lambda self: self._edges[0])
+    top = property(lambda self: self._edges[1])
+    right = property(lambda self: self._edges[2])
+    bottom = property(lambda self: self._edges[3])
+
+    @cached_property
+    def _pixel_edges(self):
+        # The edges rounded outwards, so that a point on the border of a pixel partly
+        # covered by a box is inside it
+        return np.floor(self.left), np.floor(self.top), np.ceil(self.right), np.ceil(self.bottom)
+
+    @cached_property
+    def area(self) -> np.ndarray:
+        return self.width * self.height
+
+    def filter_mask(
+        self, min_height=10, min_width=10, viewport_height=None, viewport_width=None
+    ) -> np.ndarray:
+        """
+        Returns the boolean mask of the rows kept by `filter`, see `weblinx.utils.html.filter_bboxes`
+        for the conditions.
+        """
+        # Written as the negation of the conditions that remove a box, as in filter_bboxes
+        remove = (self.width <= 0) | (self.height <= 0)
+        remove |= (self.width < min_width) & (self.height < min_height)
+        if viewport_height is not None:
+            remove |= self.y > viewport_height
+        if viewport_width is not None:
+            remove |= self.x > viewport_width
+        return ~remove
+
+    def filter(
+        self, min_height=10, min_width=10, viewport_height=None, viewport_width=None
+    ) -> dict:
+        """
+        Returns the boxes that are large enough and not outside the viewport, as a dict
+        mapping each uid to its box, in the original order.
+        """
+        mask = self.filter_mask(
+            min_height=min_height,
+            min_width=min_width,
+            viewport_height=viewport_height,
+            viewport_width=viewport_width,
+        )
+        uids, boxes = self.uids, self.boxes
+        return {uids[i]: boxes[i] for i in np.flatnonzero(mask).tolist()}
+
+    def find_smallest_containing(self, x, y) -> str:
+        """
+        Returns the uid of the smallest box of non-zero area that contains the point (x, y),
+        with its edges rounded outwards to whole pixels, or None if there is none. If several
+        boxes have the same area, the first one is returned.
+        """
+        if len(self) == 0:
+            return None
+
+        left, top, right, bottom = self._pixel_edges
+        mask = (left <= x) & (x <= right) & (top <= y) & (y <= bottom)
+        mask &= self.area != 0
+
+        candidates = np.flatnonzero(mask)
+        if candidates.size == 0:
+            return None
+
+        # argmin returns the first of the smallest, as the original loop over the dict
+        return self.uids[candidates[np.argmin(self.area[candidates])]]
+
+
+def get_bbox_table(bboxes: dict, min_requests: int = 1) -> BBoxTable:
+    """
+    Returns the BBoxTable of `bboxes`, built the first time it is requested for this dict.
+    The tables of the most recently used dicts are kept, up to MAX_TABLE_BOXES boxes in
+    total, so every turn sharing the same bboxes dict shares the same table.
+
+    Parameters
+    ----------
+    bboxes : dict
+        The bounding boxes of a turn.
+
+    min_requests : int, optional
+        The number of requests for this dict before its table is built, None being returned
+        until then. Building a table takes longer than a single loop over the boxes, so
+        callers that can do without it use 2, which only builds tables for dicts used more
+        than once. Defaults to 1.
+    """
+    global _num_boxes
+
+    if len(bboxes) > MAX_TABLE_BOXES:
+        return BBoxTable(bboxes) if min_requests <= 1 else None
+
+    key = id(bboxes)
+    with _tables_lock:
+        entry = _tables.get(key)
+        # The size guards against a dict modified since it was last requested
+        if entry is None or entry[0] is not bboxes or entry[1] != len(bboxes):
+            if entry is not None:
+                _num_boxes -= entry[1]
+            entry = _tables[key] = [bboxes, len(bboxes), 0, None]
+            _num_boxes += len(bboxes)
+        _tables.move_to_end(key)
+        while _num_boxes > MAX_TABLE_BOXES:
+            _, evicted = _tables.popitem(last=False)
+            _num_boxes -= evicted[1]
+
+        entry[2] += 1
+        if entry[3] is not None or entry[2] < min_requests:
+            return entry[3]
+
+    table = BBoxTable(bboxes)
+    with _tables_lock:
+        entry[3] = table
+    return table
+
+
+def compute_iou(boxes_a: List[dict], boxes_b: List[dict]) -> np.ndarray:
+    """
+    Computes the intersection over union of each pair of boxes `(boxes_a[i], boxes_b[i])`,
+    given as dicts with the keys "left", "top", "right" and "bottom". This performs the same
+    operations as `weblinx.eval.metrics.IOUMetric.score`, on arrays.
+
+    Raises
+    ------
+    ZeroDivisionError
+        If the union of a pair is empty, i.e. both boxes have an area of zero.
+    """
+    corners = itemgetter("left", "top", "right", "bottom")
+    a = np.array([corners(box) for box in boxes_a], dtype=np.float64).reshape(-1, 4)
+    b = np.array([corners(box) for box in boxes_b], dtype=np.float64).reshape(-1, 4)
+
+    max_left = np.maximum(a[:, 0], b[:, 0])
+    min_right = np.minimum(a[:, 2], b[:, 2])
+    max_top = np.maximum(a[:, 1], b[:, 1])
+    min_bottom = np.minimum(a[:, 3], b[:, 3])
+
+    intersection_area = np.maximum(0, min_right - max_left) * np.maximum(0, min_bottom - max_top)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    union_area = area_a + area_b - intersection_area
+
+    if np.any(union_area == 0):
+        raise ZeroDivisionError("division by zero")
+
+    return intersection_area / union_area
@@ -0,0 +1,142 @@
+"""
+A process-wide cache of the files read by turns (HTML pages and bounding boxes). Several turns
+often refer to the same file: `Replay.assign_html_path_to_turn` gives a turn the page of a
+previous turn, and `Turn.get_bboxes_path` maps every page of a snapshot to one bboxes file.
+With this cache, each file is read and parsed once, however many turns refer to it.
+
+Entries are keyed by the resolved path of the file, its modification time and its size, so a
+file that is rewritten is read again. The total size of the cached files is bounded, and the
+least recently used entries are evicted first.
+
+Example
+-------
+```
+import weblinx as wl
+
+wl.utils.cache.set_file_cache_size(2 * 1024**3)
+# ... build the records of a split ...
+print(wl.utils.cache.file_cache.stats())
+```
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+DEFAULT_MAX_BYTES = 512 * 1024**2
+
+
+class FileCache:
+    """
+    A cache of values loaded from files, bounded by the total size of the files on disk.
+
+    Parameters
+    ----------
+    max_bytes : int, optional
+        The maximum total size in bytes of the files whose values are kept, measured on disk.
+        The size of a loaded value is larger, e.g. for parsed JSON. Defaults to 512 MiB.
+
+    Note
+    ----
+    The cached values are shared by every caller, so they must not be modified in place.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.sizes = {}
+        self.num_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, path, load_fn: Callable[[str], Any], kind: Hashable = None, size: int = None) -> Any:
+        """
+        Returns `load_fn(path)`, from the cache if the file has not changed since it was
+        loaded. `kind` distinguishes the values loaded differently from the same file (e.g. with
+        another encoding, or another member of an archive). `size` is the size counted against
+        the budget, the size of the file by default. If the file does not exist, `load_fn` is
+        called and nothing is cached.
+        """
+        path = os.path.realpath(path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return load_fn(path)
+
+        key = (path, stat.st_mtime_ns, stat.st_size, kind)
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+
+        value = load_fn(path)
+        if size is None:
+            size = stat.st_size
+        if value is None or size > self.max_bytes:
+            return value
+
+        with self.lock:
+            if key not in self.entries:
+                self.entries[key] = value
+                self.sizes[key] = size
+                self.num_bytes += size
+                self._evict()
+        return value
+
+    def _evict(self):
+        while self.num_bytes > self.max_bytes:
+            evicted_key, _ = self.entries.popitem(last=False)
+            self.num_bytes -= self.sizes.pop(evicted_key)
+            self.evictions += 1
+
+    def resize(self, max_bytes: int):
+        """
+        Changes the maximum size of the cache, evicting entries if needed.
+        """
+        with self.lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def clear(self):
+        """
+        Removes every entry and resets the statistics.
+        """
+        with self.lock:
+            self.entries.clear()
+            self.sizes.clear()
+            self.num_bytes = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def stats(self) -> dict:
+        """
+        Returns the number of hits, misses and evictions since the cache was created or
+        cleared, and the current number of entries and their size in bytes.
+        """
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self.entries),
+                "bytes": self.num_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+# The cache used by Turn.html and Turn.bboxes
+file_cache = FileCache()
+
+
+def set_file_cache_size(max_bytes: int):
+    """
+    Sets the maximum size in bytes of the cache used by `Turn.html` and `Turn.bboxes`. Use 0 to
+    disable it.
+    """
+    file_cache.resize(max_bytes)
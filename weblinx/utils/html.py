@@ -107,6 +107,7 @@ def filter_bboxes(
 ):
     """
     Given the bboxes of a turn, filter out bboxes if:
+    - The width or height of the bbox is not positive
     - The bbox is smaller than the minimum height and minimum width (one of them must be satisfied)
     - The bbox is outside the viewport (if viewport_height or viewport_width is not None)
 
@@ -132,8 +133,26 @@ def filter_bboxes(
     Returns
     -------
     dict
-        The filtered bboxes that satisfy the conditions.s
+        The filtered bboxes that satisfy the conditions.
+
+    Note
+    ----
+    From the second call with the same bboxes dict, the bboxes are filtered with a
+    `weblinx.utils.bboxes.BBoxTable`, which requires numpy.
     """
+    from .bboxes import get_bbox_table
+
+    # The table is built once a bboxes dict is filtered again (e.g. by another turn of the
+    # same snapshot), since a single loop is faster than building it
+    table = get_bbox_table(bboxes, min_requests=2)
+    if table is not None:
+        return table.filter(
+            min_height=min_height,
+            min_width=min_width,
+            viewport_height=viewport_height,
+            viewport_width=viewport_width,
+        )
+
     remaining_bboxes = {}
 
     for wid, box in bboxes.items():
@@ -0,0 +1,104 @@
+"""
+Runs a function over many demonstrations concurrently, e.g. to load the replays of a split.
+Loading a demonstration is mostly I/O (reading `replay.json`, pages and bounding boxes), which
+threads overlap; parse-heavy work (e.g. building the records of a demonstration with lxml) can
+run in a pool of processes instead, to use every core.
+
+Example
+-------
+```
+import weblinx as wl
+from weblinx.utils.parallel import parallel_map
+
+demos = wl.load_demos_in_split("splits.json", split="train")
+replays = parallel_map(wl.Replay.from_demonstration, demos, num_workers=16, progress=True)
+```
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Iterable, List
+
+DEFAULT_NUM_WORKERS = 8
+
+
+def parallel_map(
+    fn: Callable,
+    items: Iterable,
+    num_workers: int = DEFAULT_NUM_WORKERS,
+    use_processes: bool = False,
+    progress: bool = False,
+    desc: str = None,
+    chunksize: int = 1,
+) -> List:
+    """
+    Returns `[fn(item) for item in items]`, computed concurrently. The results are in the
+    order of `items`, whatever the order in which they complete.
+
+    Parameters
+    ----------
+    fn : Callable
+        The function to apply to each item. With `use_processes`, it must be picklable (a
+        function defined at the top level of a module, or a partial of one), as must the items
+        and the results.
+
+    items : Iterable
+        The items, e.g. a list of Demonstration.
+
+    num_workers : int, optional
+        The number of threads, or processes if `use_processes` is True (capped to the number
+        of CPUs). If 0 or 1, the items are processed in the calling thread. Defaults to 8.
+
+    use_processes : bool, optional
+        Whether to use a pool of processes instead of threads, for work that holds the GIL
+        (parsing). Defaults to False.
+
+    progress : bool, optional
+        Whether to show a progress bar (requires tqdm). Defaults to False.
+
+    desc : str, optional
+        The description of the progress bar.
+
+    chunksize : int, optional
+        The number of items sent to a process at once, with `use_processes`. Defaults to 1.
+
+    Returns
+    -------
+    list
+        The results, in the order of `items`.
+    """
+    items = list(items)
+
+    if progress:
+        from tqdm import tqdm
+
+        progress_bar = tqdm(total=len(items), desc=desc)
+    else:
+        progress_bar = None
+
+    if num_workers is None or num_workers <= 1 or len(items) <= 1:
+        results = []
+        for item in items:
+            results.append(fn(item))
+            if progress_bar is not None:
+                progress_bar.update(1)
+    else:
+        if use_processes:
+            executor = ProcessPoolExecutor(max_workers=min(num_workers, os.cpu_count() or 1))
+            results_iter = executor.map(fn, items, chunksize=chunksize)
+        else:
+            executor = ThreadPoolExecutor(max_workers=num_workers)
+            results_iter = executor.map(fn, items)
+
+        # executor.map yields in the order of the items, so the results are deterministic
+        results = []
+        with executor:
+            for result in results_iter:
+                results.append(result)
+                if progress_bar is not None:
+                    progress_bar.update(1)
+
+    if progress_bar is not None:
+        progress_bar.close()
+
+    return results
@@ -0,0 +1,272 @@
+"""
+Content-addressed, compressed storage for the HTML pages of a demonstration. Pages are stored
+once per distinct content, under the sha256 of their UTF-8 bytes, and compressed with zstd
+(if the `zstandard` package is installed) or gzip. An append-only index maps the usual page
+names (e.g. `page-3-0.html`) to their content, so identical snapshots are only stored once.
+
+The store lives in the `pages` directory of a demonstration:
+
+```
+pages/
+    store/
+        index.jsonl
+        3f/3f2a...c1.html.gz
+        ...
+```
+
+It is read transparently by `Turn.html` and `Demonstration.list_all_html_pages` when the
+raw `page-*.html` file does not exist.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from importlib.util import find_spec
+from pathlib import Path
+from typing import List, Union
+
+STORE_DIRNAME = "store"
+INDEX_FILENAME = "index.jsonl"
+CODEC_EXTENSIONS = {"zstd": ".html.zst", "gzip": ".html.gz"}
+
+# PageStore instances shared by all the turns reading from the same pages directory. Each one
+# keeps its index and up to `cache_size` decompressed pages, so only the most recently opened
+# MAX_OPEN_STORES are kept: a pass over many demonstrations does not keep all their pages
+MAX_OPEN_STORES = 16
+_open_stores = OrderedDict()
+_open_stores_lock = threading.Lock()
+
+
+def _resolve_codec(codec):
+    if codec == "auto":
+        return "zstd" if find_spec("zstandard") else "gzip"
+    if codec not in CODEC_EXTENSIONS:
+        raise ValueError(f"Invalid codec '{codec}'. Must be either 'auto', 'zstd', or 'gzip'")
+    if codec == "zstd" and not find_spec("zstandard"):
+        raise ImportError("The zstd codec requires the zstandard package: pip install zstandard")
+    return codec
+
+
+def compress(data: bytes, codec: str, level: int = None) -> bytes:
+    if codec == "zstd":
+        import zstandard
+
+        return zstandard.ZstdCompressor(level=3 if level is None else level).compress(data)
+    elif codec == "gzip":
+        return gzip.compress(data, compresslevel=6 if level is None else level)
+    else:
+        raise ValueError(f"Invalid codec '{codec}'. Must be either 'zstd' or 'gzip'")
+
+
+def decompress(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        import zstandard
+
+        return zstandard.ZstdDecompressor().decompress(data)
+    elif codec == "gzip":
+        return gzip.decompress(data)
+    else:
+        raise ValueError(f"Invalid codec '{codec}'. Must be either 'zstd' or 'gzip'")
+
+
+class PageStore:
+    """
+    A content-addressed store of HTML pages, kept in `pages_dir/store`.
+
+    Parameters
+    ----------
+    pages_dir : str or Path
+        The `pages` directory of a demonstration.
+
+    codec : str, optional
+        The compression used for new pages, either 'auto' (zstd if available, otherwise
+        gzip), 'zstd', or 'gzip'. Pages already in the store are read with the codec they
+        were written with. Defaults to 'auto'.
+
+    level : int, optional
+        The compression level. Defaults to 3 for zstd and 6 for gzip.
+
+    cache_size : int, optional
+        The number of decompressed pages kept in memory, by content. Consecutive snapshots
+        are often identical, so they are only decompressed once. Defaults to 8.
+
+    Example
+    -------
+    ```
+    store = PageStore("demos/abc/pages")
+    store.put("page-3-0.html", html)
+    html = store.get("page-3-0.html")
+    ```
+    """
+
+    def __init__(self, pages_dir: Union[str, Path], codec="auto", level=None, cache_size=8):
+        self.pages_dir = Path(pages_dir)
+        self.store_dir = self.pages_dir / STORE_DIRNAME
+        self.index_path = self.store_dir / INDEX_FILENAME
+        self.codec = codec
+        self.level = level
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self.lock = threading.RLock()
+        self._index = {}
+        self._index_offset = 0
+
+    @classmethod
+    def exists(cls, pages_dir: Union[str, Path]) -> bool:
+        """
+        Returns True if `pages_dir` contains a page store.
+        """
+        return Path(pages_dir, STORE_DIRNAME, INDEX_FILENAME).exists()
+
+    @classmethod
+    def open(cls, pages_dir: Union[str, Path]) -> "PageStore":
+        """
+        Returns a PageStore for `pages_dir` that is shared by all the callers in the process,
+        so its index is only loaded once. The MAX_OPEN_STORES most recently used stores are
+        kept. Returns None if there is no store in `pages_dir`.
+        """
+        key = os.path.abspath(pages_dir)
+        with _open_stores_lock:
+            if key in _open_stores:
+                _open_stores.move_to_end(key)
+                return _open_stores[key]
+            if not cls.exists(pages_dir):
+                return None
+            store = _open_stores[key] = cls(pages_dir)
+            while len(_open_stores) > MAX_OPEN_STORES:
+                _open_stores.popitem(last=False)
+            return store
+
+    def _refresh_index(self):
+        # The index is append-only, so only the records written since the last read are loaded
+        with self.lock:
+            if not self.index_path.exists():
+                return self._index
+            if self.index_path.stat().st_size == self._index_offset:
+                return self._index
+
+            with open(self.index_path, "rb") as f:
+                f.seek(self._index_offset)
+                data = f.read()
+
+            # Ignore a partially written last record, it is read once it is complete
+            end = data.rfind(b"\n") + 1
+            for line in data[:end].splitlines():
+                if line.strip():
+                    record = json.loads(line)
+                    self._index[record["name"]] = record
+            self._index_offset += end
+            return self._index
+
+    def get_blob_path(self, digest: str, codec: str) -> Path:
+        return self.store_dir / digest[:2] / f"{digest}{CODEC_EXTENSIONS[codec]}"
+
+    def names(self) -> List[str]:
+        """
+        Returns the names of all the pages in the store.
+        """
+        return list(self._refresh_index().keys())
+
+    def has(self, name: str) -> bool:
+        return name in self._refresh_index()
+
+    def get_record(self, name: str) -> dict:
+        """
+        Returns the index record of a page, with the keys "name", "sha256", "codec" and
+        "size" (uncompressed size in bytes), or None if the page is not in the store.
+        """
+        return self._refresh_index().get(name)
+
+    def get(self, name: str) -> str:
+        """
+        Returns the HTML of the page `name` (e.g. "page-3-0.html"), or None if it is not in
+        the store.
+        """
+        record = self.get_record(name)
+        if record is None:
+            return None
+
+        digest = record["sha256"]
+        with self.lock:
+            if digest in self._cache:
+                self._cache.move_to_end(digest)
+                return self._cache[digest]
+
+        with open(self.get_blob_path(digest, record["codec"]), "rb") as f:
+            html = decompress(f.read(), record["codec"]).decode("utf-8")
+
+        with self.lock:
+            self._cache[digest] = html
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return html
+
+    def put(self, name: str, html: str) -> str:
+        """
+        Stores the HTML of the page `name` and returns its sha256. If a page with the same
+        content is already in the store, it is not written again.
+        """
+        data = html.encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+
+        with self.lock:
+            self.store_dir.mkdir(parents=True, exist_ok=True)
+            index = self._refresh_index()
+
+            codec = None
+            for existing_codec in CODEC_EXTENSIONS:
+                if self.get_blob_path(digest, existing_codec).exists():
+                    codec = existing_codec
+                    break
+
+            if codec is None:
+                codec = _resolve_codec(self.codec)
+                blob_path = self.get_blob_path(digest, codec)
+                blob_path.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = blob_path.with_name(blob_path.name + ".tmp")
+                with open(tmp_path, "wb") as f:
+                    f.write(compress(data, codec, self.level))
+                os.replace(tmp_path, blob_path)
+
+            record = {"name": name, "sha256": digest, "codec": codec, "size": len(data)}
+            if index.get(name) != record:
+                with open(self.index_path, "ab") as f:
+                    f.write(json.dumps(record).encode("utf-8") + b"\n")
+                self._refresh_index()
+
+        return digest
+
+    def import_pages(self, remove_raw=False) -> int:
+        """
+        Adds every raw `page-*.html` file of the pages directory to the store, and removes
+        them if `remove_raw` is True. Returns the number of pages imported.
+        """
+        from .html import open_html_with_encodings
+
+        paths = sorted(self.pages_dir.glob("page-*.html"))
+        for path in paths:
+            self.put(path.name, open_html_with_encodings(path))
+            if remove_raw:
+                path.unlink()
+        return len(paths)
+
+    def disk_usage(self) -> int:
+        """
+        Returns the size in bytes of the store on disk (index and compressed pages).
+        """
+        return sum(p.stat().st_size for p in self.store_dir.rglob("*") if p.is_file())
+
+
+def read_page(path: Union[str, Path]) -> str:
+    """
+    Reads the page at `path` (e.g. `.../pages/page-3-0.html`) from the page store of its
+    directory. Returns None if there is no store or the page is not in it.
+    """
+    path = Path(path)
+    store = PageStore.open(path.parent)
+    if store is None:
+        return None
+    return store.get(path.name)